@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import os
+import platform
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+
+from ._timing import timer
+from ._utils import _cache_dir
+
+# Implementations method="auto" chooses from. The pure Python implementation
+# is never the fastest and is left out, as is the fixed-point implementation,
+# whose result may differ by one from the others
+_AUTO_METHODS = ["numpy", "numba", "numba-parallel", "cython",
+                 "cython-parallel", "lut"]
+
+# Image shapes the implementations are timed on during calibration
+_CALIBRATION_SHAPES = [(32, 32), (128, 128), (512, 512), (1536, 1536)]
+_N_EXPERIMENTS = 3
+
+
+def _cache_file():
+    """
+    Filename of the calibration cache of this host.
+
+    The cache is stored in the directory given by the environment variable
+    'INSTAPY_CACHE_DIR' if set, otherwise in ~/.cache/instapy.
+
+    Returns
+    -------
+    cache_file : str
+        Filename (with path included) of the calibration cache
+    """
+    host = platform.node() or "localhost"
+    return os.path.join(_cache_dir(), f"calibration-{host}.json")
+
+
+def _host_info():
+    """
+    Description of the host and implementations a calibration is valid for.
+
+    Returns
+    -------
+    host_info : dict
+        Host name, machine type, number of CPUs and calibrated methods
+    """
+    return {"host": platform.node(), "machine": platform.machine(),
+            "cpu_count": os.cpu_count(), "methods": _AUTO_METHODS}
+
+
+def _calibrate():
+    """
+    Time every implementation of both filters on random images of the
+    calibration shapes.
+
+    Every implementation is called once before timing, so that JIT
+    compilation and thread pool start-up are not measured.
+
+    Returns
+    -------
+    calibration : dict
+        For "grayscale" and "sepia", a list with the number of pixels, the
+        fastest method and the run times of all methods per image shape
+    """
+    from .filters import _grayscale_funcs, _sepia_funcs
+
+    rng = np.random.default_rng(2020)
+    calibration = {"grayscale": [], "sepia": []}
+    for shape in _CALIBRATION_SHAPES:
+        bgr_image = rng.integers(0, 256, size=(*shape, 3), dtype=np.uint8)
+        for filter_name, func_dict in (("grayscale", _grayscale_funcs),
+                                       ("sepia", _sepia_funcs)):
+            run_times = {}
+            for method in _AUTO_METHODS:
+                func = func_dict[method]
+                func(bgr_image)
+                _, run_times[method] = timer(_N_EXPERIMENTS, func, bgr_image)
+            calibration[filter_name].append(
+                {"pixels": shape[0] * shape[1],
+                 "method": min(run_times, key=run_times.get),
+                 "run_times": run_times})
+
+    return calibration
+
+
+@lru_cache(maxsize=None)
+def _calibration():
+    """
+    Calibration of this host, loaded from the cache file.
+
+    The implementations are calibrated once per host, and again if the
+    host or the set of implementations changes. If the cache file cannot be
+    written, the calibration is kept in memory for this process only.
+
+    Returns
+    -------
+    calibration : dict
+        See '_calibrate'
+    """
+    cache_file = _cache_file()
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+        if cache["host_info"] == _host_info():
+            return cache["calibration"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    calibration = _calibrate()
+    cache = {"host_info": _host_info(), "calibration": calibration}
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Write to a temporary file first, so that processes calibrating at
+        # the same time never read a partially written cache
+        fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(cache_file),
+                                       suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmpfile, cache_file)
+    except OSError:
+        pass
+
+    return calibration
+
+
+def _auto_method(filter_name, shape):
+    """
+    Fastest implementation of a filter on this host for an image shape.
+
+    The method that was fastest for the calibration shape closest in number
+    of pixels (on a log scale) is chosen.
+
+    Arguments
+    ---------
+    filter_name : str
+        Name of the filter; either "grayscale" or "sepia"
+    shape : tuple of int
+        Shape (H, W, c) of the image to filter
+
+    Returns
+    -------
+    method : str
+        Name of the fastest implementation
+    """
+    pixels = max(shape[0] * shape[1], 1)
+    entries = _calibration()[filter_name]
+    nearest = min(entries, key=lambda entry: abs(
+        math.log(pixels) - math.log(entry["pixels"])))
+    return nearest["method"]
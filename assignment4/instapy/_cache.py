@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# File extensions of cached arrays and cached encoded images on disk
+_ARRAY_SUFFIX = ".npy"
+_BYTES_SUFFIX = ".bin"
+
+
+def _cache_key(buffer, params):
+    """
+    Content address of a filtered image.
+
+    Arguments
+    ---------
+    buffer : array, shape = (n,)
+        Encoded source image as uint8 array
+    params : tuple
+        Filter name and every parameter the filtered image depends on, as
+        values with a deterministic repr
+
+    Returns
+    -------
+    key : str
+        Hexadecimal BLAKE2b digest of the source bytes and 'params'
+    """
+    digest = hashlib.blake2b(buffer, digest_size=20)
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
+
+def _result_size(result):
+    """
+    Size in bytes of a filtered image.
+
+    Arguments
+    ---------
+    result : array or bytes
+        Filtered image as array, or encoded as bytes
+
+    Returns
+    -------
+    size : int
+        Number of bytes held by 'result'
+    """
+    return result.nbytes if isinstance(result, np.ndarray) else len(result)
+
+
+class _ResultCache:
+    """
+    Least recently used cache of filtered images.
+
+    Filtered images are held in memory up to 'max_bytes' in total and, if a
+    directory is given, stored on disk up to 'max_disk_bytes' in total, so
+    that they survive the process and are shared between processes. The
+    least recently used images are evicted first from either. Images are
+    stored as arrays or as encoded bytes and keyed by '_cache_key'.
+
+    Arrays are copied when stored and when returned, so that callers may
+    modify the images they get without changing the cache.
+
+    Arguments
+    ---------
+    max_bytes : int
+        Largest total size in bytes of the images held in memory
+    directory : str or None
+        Directory of the on-disk cache, created if missing. None keeps the
+        images in memory only.
+    max_disk_bytes : int
+        Largest total size in bytes of the images stored on disk
+    """
+
+    def __init__(self, max_bytes, directory=None, max_disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """
+        Look up a filtered image.
+
+        Arguments
+        ---------
+        key : str
+            Cache key, see '_cache_key'
+
+        Returns
+        -------
+        result : array, bytes or None
+            Copy of the cached array or the cached bytes, None if neither
+            the memory nor the disk cache holds 'key'
+        """
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+        if result is None:
+            result = self._load(key)
+            if result is None:
+                return None
+            self._remember(key, result)
+        return result.copy() if isinstance(result, np.ndarray) else result
+
+    def put(self, key, result):
+        """
+        Store a filtered image.
+
+        Arguments
+        ---------
+        key : str
+            Cache key, see '_cache_key'
+        result : array or bytes
+            Filtered image as array, or encoded as bytes
+        """
+        if isinstance(result, np.ndarray):
+            result = result.copy()
+            result.setflags(write=False)
+        else:
+            result = bytes(result)
+        self._remember(key, result)
+        self._store(key, result)
+
+    def _remember(self, key, result):
+        """
+        Hold a filtered image in memory and evict the least recently used
+        images beyond 'max_bytes'.
+        """
+        size = _result_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= _result_size(previous)
+            self._entries[key] = result
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= _result_size(evicted)
+
+    def _path(self, key, suffix):
+        """
+        Filename of a cached image in the disk cache.
+        """
+        return os.path.join(self.directory, key + suffix)
+
+    def _load(self, key):
+        """
+        Read a filtered image from the disk cache.
+
+        The modification time of the file is updated, as the disk cache
+        evicts by modification time.
+
+        Returns
+        -------
+        result : array, bytes or None
+            Cached image, None if not on disk or unreadable
+        """
+        if self.directory is None:
+            return None
+        try:
+            path = self._path(key, _ARRAY_SUFFIX)
+            if os.path.exists(path):
+                result = np.load(path, allow_pickle=False)
+                result.setflags(write=False)
+            else:
+                path = self._path(key, _BYTES_SUFFIX)
+                with open(path, "rb") as f:
+                    result = f.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, or evicted or partially removed by another process
+            return None
+        return result
+
+    def _store(self, key, result):
+        """
+        Write a filtered image to the disk cache and evict the least
+        recently used files beyond 'max_disk_bytes'.
+
+        Failures to write are ignored, so that a full or read-only disk
+        only disables the disk cache.
+        """
+        if (self.directory is None or
+                _result_size(result) > self.max_disk_bytes):
+            return
+        is_array = isinstance(result, np.ndarray)
+        path = self._path(key, _ARRAY_SUFFIX if is_array else _BYTES_SUFFIX)
+        try:
+            # Write to a temporary file first, so that other processes never
+            # read a partially written image
+            fd, tmpfile = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if is_array:
+                    np.save(f, result, allow_pickle=False)
+                else:
+                    f.write(result)
+            os.replace(tmpfile, path)
+        except OSError:
+            try:
+                os.remove(tmpfile)
+            except OSError:
+                pass
+            return
+        self._evict_files(path)
+
+    def _evict_files(self, keep):
+        """
+        Remove the least recently used files of the disk cache until its
+        total size is at most 'max_disk_bytes'.
+
+        File modification times are only as fine as the clock tick of the
+        file system, so the file just written, 'keep', is never removed.
+        """
+        files = []
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith((_ARRAY_SUFFIX, _BYTES_SUFFIX)):
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -1,35 +1,143 @@
 #!/usr/bin/env python3
 # cython: language_level=3
+# cython: boundscheck=False, wraparound=False
 
-import os
+from cython.parallel cimport prange, threadid
 
-import cv2
 import numpy as np
 
+from ._utils import (_GRAYSCALE_MATRIX, _area_factors, _area_means,
+                     _check_color_matrix, _check_sepia_amount, _empty_image,
+                     _needs_clip, _num_threads, _resize, _scratch,
+                     _sepia_matrix)
 
-cpdef _cython_color2gray(imagefile, outfile=None, scale=None):
+cdef extern from *:
+    """
+    #if defined(__AVX2__)
+    #define INSTAPY_WIDE_VECTORS 1
+    #else
+    #define INSTAPY_WIDE_VECTORS 0
+    #endif
+    """
+    bint INSTAPY_WIDE_VECTORS
+
+# Three-channel results are computed on planes of B, G and R values, see
+# '_planar_row', if the module is compiled for a CPU with 256-bit vectors
+# (with INSTAPY_NATIVE=1 on an AVX2 host, see setup.py). With 128-bit SSE2
+# vectors of the portable build splitting and interleaving the channels
+# costs more than the vectorized weighted sums save. For a single-channel
+# result the interleaved loop is always faster. The layout is read on every
+# call and can be changed at runtime, see
+# 'instapy.filters.set_planar_layout'
+_WIDE_VECTORS = INSTAPY_WIDE_VECTORS
+_PLANAR_LAYOUT = _WIDE_VECTORS
+
+
+cpdef _cython_color_matrix(bgr_image, matrix, bias=None, scale=None,
+                           out=None):
+    """
+    Color matrix image filter.
+
+    Map the B, G and R channels of every pixel to new channels with a
+    Cython implementation. Every new channel is the weighted sum of the B, G
+    and R channels plus a bias, clipped to [0, 255] and truncated to uint8.
+    The new image can also be up/downscaled while preserving the aspect
+    ratio of the original.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'matrix' or 'bias' are invalid, see '_check_color_matrix'
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    return _color_matrix(bgr_image, matrix, bias, scale, 0, out)
+
+
+cpdef _cython_parallel_color_matrix(bgr_image, matrix, bias=None, scale=None,
+                                    num_threads=None, out=None):
+    """
+    Multithreaded color matrix image filter.
+
+    Map the B, G and R channels of every pixel to new channels with the
+    image rows split across OpenMP threads by Cython. See
+    '_cython_color_matrix'.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    num_threads : int, optional, default None
+        Number of threads. Defaults to the environment variable
+        'INSTAPY_NUM_THREADS' if set, otherwise the number of CPUs.
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'matrix' or 'bias' are invalid, see '_check_color_matrix'
+    ValueError : if 'num_threads' is not a positive integer
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    return _color_matrix(bgr_image, matrix, bias, scale,
+                         _num_threads(num_threads), out)
+
+
+cpdef _cython_color2gray(bgr_image, scale=None, out=None):
     """
     Grayscale image filter.
 
     Turn a colorful image of choice into a dramatic grayscale image with a
-    Cython implementation. The new image can be saved to a specified location.
-    The new image can also be up/downscaled while preservingthe aspect ratio
-    of the original.
-
+    Cython implementation. The new image can also be up/downscaled while
+    preserving the aspect ratio of the original.
 
     Arguments
     ---------
-    imagefile : str
-        Image filename (with path included) of image with shape (H, W, c) to
-        transform
-    outfile : str, optional, default None
-        Image filename (with path included) if transformed image with shape
-        (H, W) should be saved to a particular location. Keyword 'auto' will
-        save the new image in the same destination as the original with the
-        transformation added to the original filename.
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
     scale : float, optional, default None
-          Scale factor to resize image as fraction, e.g. 0.5 halves image
-          dimensions whereas 2 doubles
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
@@ -39,75 +147,72 @@ cpdef _cython_color2gray(imagefile, outfile=None, scale=None):
     Raises
     ------
     ValueError : if 'scale' is not larger than 0
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
     """
-    bgr_image = cv2.imread(imagefile)
+    return _color_matrix(bgr_image, _GRAYSCALE_MATRIX, None, scale, 0, out)
 
-    if scale is not None:
-        # Up/downscale but preserve aspect ratio
-        if scale > 0:
-            width = int(bgr_image.shape[1] * scale)
-            height = int(bgr_image.shape[0] * scale)
-            dim = (width, height)
-            bgr_image = cv2.resize(
-                bgr_image, dim, interpolation=cv2.INTER_AREA)
-        else:
-            raise ValueError("'scale' must be a float larger than 0")
 
-    # Apply grayscale kernel
-    cdef int H = bgr_image.shape[0]
-    cdef int W = bgr_image.shape[1]
+cpdef _cython_parallel_color2gray(bgr_image, scale=None, num_threads=None,
+                                  out=None):
+    """
+    Multithreaded grayscale image filter.
 
-    grayscale_image = np.zeros((H, W))
+    Turn a colorful image of choice into a dramatic grayscale image with the
+    image rows split across OpenMP threads by Cython. The new image can also
+    be up/downscaled while preserving the aspect ratio of the original.
 
-    cdef int[:, :, :] bgr_view = bgr_image.astype(np.dtype("i"))
-    cdef double[:, :] gray_view = grayscale_image.astype(np.dtype("d"))
-    cdef int i, j
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    num_threads : int, optional, default None
+        Number of threads. Defaults to the environment variable
+        'INSTAPY_NUM_THREADS' if set, otherwise the number of CPUs.
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
-    for i in range(H):
-        for j in range(W):
-            gray_view[i, j] += bgr_view[i, j, 0] * 0.07 + \
-                bgr_view[i, j, 1] * 0.72 + \
-                bgr_view[i, j, 2] * 0.21
-
-    grayscale_image[:, :] = gray_view
-    grayscale_image = grayscale_image.astype("uint8")
-
-    if outfile is not None:
-        # Save new image
-        if outfile == "auto":
-            filename, file_extension = os.path.splitext(imagefile)
-            cv2.imwrite(filename + "_grayscale" + file_extension, grayscale_image)
-        else:
-            cv2.imwrite(outfile, grayscale_image)
+    Returns
+    -------
+    grayscale_image : array, shape = (H, W)
+        Transformed image as array
 
-    return grayscale_image
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'num_threads' is not a positive integer
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    return _color_matrix(bgr_image, _GRAYSCALE_MATRIX, None, scale,
+                         _num_threads(num_threads), out)
 
 
-cpdef _cython_color2sepia(imagefile, outfile=None, scale=None, sepia_amount=1.0):
+cpdef _cython_color2sepia(bgr_image, scale=None, sepia_amount=1.0, out=None):
     """
     Stepless sepia image filter.
 
     Turn a colorful image of choice into a nostalgic sepia image with a pure
-    Python implementation. The new image can be saved to a specified location.
-    The new image can also be up/downscaled while preserving the aspect ratio
-    of the original.
+    Cython implementation. The new image can also be up/downscaled while
+    preserving the aspect ratio of the original.
 
     Arguments
     ---------
-    imagefile : str
-        Image filename (with path included) of image with shape (H, W, c) to
-        transform
-    outfile : str, optional, default None
-        Image filename (with path included) if transformed image with shape
-        (H, W, c) should be saved to a particular location. Keyword 'auto' will
-        save the new image in the same destination as the original with the
-        transformation added to the original filename.
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
     scale : float, optional, default None
         Scale factor to resize image as fraction, e.g. 0.5 halves image
         dimensions whereas 2 doubles
     sepia_amount : float, optional, default 1.0
         0-100 percent amount sepia effect. 1.0 is full sepia effect, 0.0 the
         original image
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
@@ -118,75 +223,345 @@ cpdef _cython_color2sepia(imagefile, outfile=None, scale=None, sepia_amount=1.0)
     ------
     ValueError : if 'scale' is not larger than 0
     ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
     """
-    bgr_image = cv2.imread(imagefile)
+    _check_sepia_amount(sepia_amount)
+    return _color_matrix(bgr_image, _sepia_matrix(sepia_amount), None, scale,
+                         0, out)
 
-    if scale is not None:
-        # Up/downscale but preserve aspect ratio
-        if scale > 0:
-            width = int(bgr_image.shape[1] * scale)
-            height = int(bgr_image.shape[0] * scale)
-            dim = (width, height)
-            bgr_image = cv2.resize(
-                bgr_image, dim, interpolation=cv2.INTER_AREA)
-        else:
-            raise ValueError("'scale' must be a float larger than 0")
 
-    # Apply sepia kernel
-    if not 0.0 <= sepia_amount <= 1.0:
-        raise ValueError(
-            "'sepia_amount' must be a float between 0 (no sepia effect) and 1 (full sepia effect)")
+cpdef _cython_parallel_color2sepia(bgr_image, scale=None, sepia_amount=1.0,
+                                   num_threads=None, out=None):
+    """
+    Multithreaded stepless sepia image filter.
 
-    cdef int H = bgr_image.shape[0]
-    cdef int W = bgr_image.shape[1]
+    Turn a colorful image of choice into a nostalgic sepia image with the
+    image rows split across OpenMP threads by Cython. The new image can also
+    be up/downscaled while preserving the aspect ratio of the original.
 
-    sepia_image = np.zeros_like(bgr_image)
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    sepia_amount : float, optional, default 1.0
+        0-100 percent amount sepia effect. 1.0 is full sepia effect, 0.0 the
+        original image
+    num_threads : int, optional, default None
+        Number of threads. Defaults to the environment variable
+        'INSTAPY_NUM_THREADS' if set, otherwise the number of CPUs.
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
-    cdef int[:, :, :] bgr_view = bgr_image.astype(np.dtype("i"))
-    cdef double[:, :, :] sepia_view = sepia_image.astype(np.dtype("d"))
-    cdef double B, G, R, k
-    cdef int i, j
+    Returns
+    -------
+    sepia_image : array, shape = (H, W, c)
+        Transformed image as array
 
-    k = 1 - sepia_amount
-    for i in range(H):
-        for j in range(W):
-            B = bgr_view[i, j, 0] * (0.131 + 0.869 * k) + bgr_view[i, j, 1] * (
-                0.534 - 0.534 * k) + bgr_view[i, j, 2] * (0.272 - 0.272 * k)
-            G = bgr_view[i, j, 0] * (0.168 - 0.168 * k) + bgr_view[i, j, 1] * (
-                0.686 + 0.314 * k) + bgr_view[i, j, 2] * (0.349 - 0.349 * k)
-            R = bgr_view[i, j, 0] * (0.189 - 0.189 * k) + bgr_image[i, j, 1] * (
-                0.769 - 0.769 * k) + bgr_view[i, j, 2] * (0.393 + 0.607 * k)
-
-            if B > 255:
-                sepia_view[i, j, 0] = 255
-            elif B < 0:
-                sepia_view[i, j, 0] = 0
-            else:
-                sepia_view[i, j, 0] = B
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'num_threads' is not a positive integer
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    cdef int n_threads = _num_threads(num_threads)
+    _check_sepia_amount(sepia_amount)
+    return _color_matrix(bgr_image, _sepia_matrix(sepia_amount), None, scale,
+                         n_threads, out)
 
-            if G > 255:
-                sepia_view[i, j, 1] = 255
-            elif G < 0:
-                sepia_view[i, j, 1] = 0
-            else:
-                sepia_view[i, j, 1] = G
 
-            if R > 255:
-                sepia_view[i, j, 2] = 255
-            elif R < 0:
-                sepia_view[i, j, 2] = 0
+cdef _color_matrix(bgr_image, matrix, bias, scale, int num_threads, out):
+    """
+    Apply the color matrix kernel to an image.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix, bias : array_like
+        Color matrix and bias, see '_check_color_matrix'
+    scale : float or None
+        Scale factor to resize image as fraction, see '_resize'
+    num_threads : int
+        Number of OpenMP threads, 0 to run serially
+    out : array or None
+        Array to write the new image to, see '_empty_image'
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+    """
+    matrix, bias = _check_color_matrix(matrix, bias)
+    cdef bint clip = _needs_clip(matrix, bias)
+
+    # Integer downscaling is fused into the kernel
+    factors = _area_factors(bgr_image, scale)
+    if factors is not None:
+        return _color_matrix_area(bgr_image, matrix, bias, clip, factors,
+                                  num_threads, out)
+
+    # Up/downscale but preserve aspect ratio
+    bgr_image = np.ascontiguousarray(_resize(bgr_image, scale))
+
+    # Apply color matrix kernel
+    H, W = bgr_image.shape[:2]
+    new_image = _empty_image(H, W, matrix, out)
+    cdef const unsigned char[:, :, ::1] bgr_view = bgr_image
+    cdef const double[:, ::1] matrix_view = matrix
+    cdef const double[::1] bias_view = bias
+    cdef unsigned char[:, :, ::1] new_view = new_image.reshape(H, W,
+                                                               len(matrix))
+    cdef double[:, ::1] planes_view
+    cdef unsigned char[:, ::1] new_planes_view
+    cdef Py_ssize_t i
+
+    if len(matrix) == 3 and _PLANAR_LAYOUT:
+        # Planes of every thread
+        planes_view = _scratch("planes", (max(num_threads, 1), W * 3))
+        new_planes_view = _scratch("new_planes", (max(num_threads, 1), W * 3),
+                                   np.uint8)
+        with nogil:
+            if num_threads == 0:
+                for i in range(new_view.shape[0]):
+                    _planar_row(bgr_view, matrix_view, bias_view,
+                                &planes_view[0, 0], &new_planes_view[0, 0],
+                                new_view, i)
             else:
-                sepia_view[i, j, 2] = R
+                for i in prange(new_view.shape[0], num_threads=num_threads,
+                                schedule="static"):
+                    _planar_row(bgr_view, matrix_view, bias_view,
+                                &planes_view[threadid(), 0],
+                                &new_planes_view[threadid(), 0], new_view, i)
+        return new_image
+
+    with nogil:
+        if num_threads == 0:
+            for i in range(new_view.shape[0]):
+                _color_matrix_row(bgr_view, matrix_view, bias_view, clip,
+                                  new_view, i)
+        else:
+            for i in prange(new_view.shape[0], num_threads=num_threads,
+                            schedule="static"):
+                _color_matrix_row(bgr_view, matrix_view, bias_view, clip,
+                                  new_view, i)
+
+    return new_image
+
+
+cdef _color_matrix_area(bgr_image, matrix, bias, bint clip, factors,
+                        int num_threads, out):
+    """
+    Apply the color matrix kernel fused with integer downscaling.
+
+    Every new pixel is the color matrix applied to the mean of a block of
+    'fy' x 'fx' pixels, identical to resizing with cv2.resize and INTER_AREA
+    first, but without an intermediate resized image.
 
-    sepia_image[:, :, :] = sepia_view
-    sepia_image = sepia_image.astype("uint8")
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array, shape = (c, 3)
+        Color matrix, see '_check_color_matrix'
+    bias : array, shape = (c,)
+        Bias of each new channel
+    clip : bool
+        Whether to clip the new channels to [0, 255], see '_needs_clip'
+    factors : tuple of int
+        Integer factors (fy, fx) the image rows and columns are downscaled by
+    num_threads : int
+        Number of OpenMP threads, 0 to run serially
+    out : array or None
+        Array to write the new image to, see '_empty_image'
 
-    if outfile is not None:
-        # Save new image
-        if outfile == "auto":
-            filename, file_extension = os.path.splitext(imagefile)
-            cv2.imwrite(filename + "_sepia" + file_extension, sepia_image)
+    Returns
+    -------
+    new_image : array, shape = (H // fy, W // fx) or (H // fy, W // fx, c)
+        Transformed image as array; 2D for a single-row matrix
+    """
+    cdef Py_ssize_t fy, fx
+    fy, fx = factors
+    bgr_image = np.ascontiguousarray(bgr_image)
+    H, W = bgr_image.shape[:2]
+
+    new_image = _empty_image(H // fy, W // fx, matrix, out)
+    sums = _scratch("sums", (max(num_threads, 1), W * 3), np.uint16)
+    cdef const unsigned char[:, :, ::1] bgr_view = bgr_image
+    cdef const double[:, ::1] matrix_view = matrix
+    cdef const double[::1] bias_view = bias
+    cdef const unsigned char[::1] means_view = _area_means(fy, fx)
+    cdef unsigned short[:, ::1] sums_view = sums
+    cdef unsigned char[:, :, ::1] new_view = new_image.reshape(
+        H // fy, W // fx, len(matrix))
+    cdef Py_ssize_t i
+
+    with nogil:
+        if num_threads == 0:
+            for i in range(new_view.shape[0]):
+                _color_matrix_area_row(bgr_view, fy, fx, means_view,
+                                       matrix_view, bias_view, clip,
+                                       &sums_view[0, 0], new_view, i)
         else:
-            cv2.imwrite(outfile, sepia_image)
+            for i in prange(new_view.shape[0], num_threads=num_threads,
+                            schedule="static"):
+                _color_matrix_area_row(bgr_view, fy, fx, means_view,
+                                       matrix_view, bias_view, clip,
+                                       &sums_view[threadid(), 0], new_view, i)
+
+    return new_image
+
 
-    return sepia_image
+cdef inline unsigned char _clip(double value, bint clip) nogil:
+    """
+    Clip a value to [0, 255] if 'clip' is true and truncate it to uint8.
+    The compiler hoists the loop invariant 'clip' out of the row loops.
+    """
+    if not clip:
+        return <unsigned char>value
+    if value > 255:
+        return 255
+    elif value < 0:
+        return 0
+    return <unsigned char>value
+
+
+cdef inline void _color_matrix_row(const unsigned char[:, :, ::1] bgr_view,
+                                   const double[:, ::1] matrix,
+                                   const double[::1] bias, bint clip,
+                                   unsigned char[:, :, ::1] new_view,
+                                   Py_ssize_t i) nogil:
+    """
+    Apply the color matrix to row 'i', for one or three new channels.
+    """
+    cdef Py_ssize_t j
+    cdef double b, g, r
+    cdef double BB = matrix[0, 0], BG = matrix[0, 1], BR = matrix[0, 2]
+    cdef double B_bias = bias[0]
+    cdef double GB, GG, GR, RB, RG, RR, G_bias, R_bias
+
+    if new_view.shape[2] == 1:
+        for j in range(bgr_view.shape[1]):
+            new_view[i, j, 0] = _clip(bgr_view[i, j, 0] * BB +
+                                      bgr_view[i, j, 1] * BG +
+                                      bgr_view[i, j, 2] * BR + B_bias, clip)
+        return
+
+    GB, GG, GR = matrix[1, 0], matrix[1, 1], matrix[1, 2]
+    RB, RG, RR = matrix[2, 0], matrix[2, 1], matrix[2, 2]
+    G_bias, R_bias = bias[1], bias[2]
+    for j in range(bgr_view.shape[1]):
+        b = bgr_view[i, j, 0]
+        g = bgr_view[i, j, 1]
+        r = bgr_view[i, j, 2]
+        new_view[i, j, 0] = _clip(b * BB + g * BG + r * BR + B_bias, clip)
+        new_view[i, j, 1] = _clip(b * GB + g * GG + r * GR + G_bias, clip)
+        new_view[i, j, 2] = _clip(b * RB + g * RG + r * RR + R_bias, clip)
+
+
+cdef inline void _planar_row(const unsigned char[:, :, ::1] bgr_view,
+                             const double[:, ::1] matrix,
+                             const double[::1] bias, double *planes,
+                             unsigned char *new_planes,
+                             unsigned char[:, :, ::1] new_view,
+                             Py_ssize_t i) nogil:
+    """
+    Apply a three-channel color matrix to row 'i' on planes.
+
+    The row is split into contiguous planes of B, G and R values, every new
+    channel is computed from the planes in a loop of its own, which the C
+    compiler vectorizes, and the new planes are interleaved into the new
+    row. The new channels are always clipped, which costs little in
+    vectorized loops and gives the same result as '_color_matrix_row'.
+    'planes' and 'new_planes' hold 3 * W values each.
+    """
+    cdef Py_ssize_t W = bgr_view.shape[1]
+    cdef const unsigned char *row = &bgr_view[i, 0, 0]
+    cdef unsigned char *new_row = &new_view[i, 0, 0]
+    cdef double *b = planes
+    cdef double *g = planes + W
+    cdef double *r = planes + 2 * W
+    cdef unsigned char *new_plane
+    cdef double wB, wG, wR, c_bias, value
+    cdef Py_ssize_t c, j
+
+    for j in range(W):
+        b[j] = row[3 * j]
+        g[j] = row[3 * j + 1]
+        r[j] = row[3 * j + 2]
+
+    for c in range(3):
+        wB, wG, wR = matrix[c, 0], matrix[c, 1], matrix[c, 2]
+        c_bias = bias[c]
+        new_plane = new_planes + c * W
+        for j in range(W):
+            value = b[j] * wB + g[j] * wG + r[j] * wR + c_bias
+            value = value if value > 0 else 0
+            new_plane[j] = <unsigned char>(value if value < 255 else 255)
+
+    for j in range(W):
+        new_row[3 * j] = new_planes[j]
+        new_row[3 * j + 1] = new_planes[W + j]
+        new_row[3 * j + 2] = new_planes[2 * W + j]
+
+
+cdef inline void _column_sums(const unsigned char[:, :, ::1] bgr_view,
+                              Py_ssize_t start, Py_ssize_t rows,
+                              unsigned short *sums) nogil:
+    """
+    Sum 'rows' image rows from row 'start' on per column and channel into
+    'sums', ordered like the values of an image row.
+    """
+    cdef Py_ssize_t n = bgr_view.shape[1] * 3
+    cdef const unsigned char *row = &bgr_view[start, 0, 0]
+    cdef Py_ssize_t x, y
+
+    for x in range(n):
+        sums[x] = row[x]
+    for y in range(start + 1, start + rows):
+        row = &bgr_view[y, 0, 0]
+        for x in range(n):
+            sums[x] += row[x]
+
+
+cdef inline void _color_matrix_area_row(
+        const unsigned char[:, :, ::1] bgr_view, Py_ssize_t fy, Py_ssize_t fx,
+        const unsigned char[::1] means, const double[:, ::1] matrix,
+        const double[::1] bias, bint clip, unsigned short *sums,
+        unsigned char[:, :, ::1] new_view, Py_ssize_t i) nogil:
+    """
+    Apply the color matrix to the means of the blocks of new row 'i', for
+    one or three new channels.
+    """
+    cdef Py_ssize_t j, x
+    cdef Py_ssize_t B, G, R
+    cdef double b, g, r
+    cdef bint single = new_view.shape[2] == 1
+    cdef double BB = matrix[0, 0], BG = matrix[0, 1], BR = matrix[0, 2]
+    cdef double B_bias = bias[0]
+    cdef double GB = 0, GG = 0, GR = 0, RB = 0, RG = 0, RR = 0
+    cdef double G_bias = 0, R_bias = 0
+
+    if not single:
+        GB, GG, GR = matrix[1, 0], matrix[1, 1], matrix[1, 2]
+        RB, RG, RR = matrix[2, 0], matrix[2, 1], matrix[2, 2]
+        G_bias, R_bias = bias[1], bias[2]
+
+    _column_sums(bgr_view, i * fy, fy, sums)
+    for j in range(new_view.shape[1]):
+        B = G = R = 0
+        for x in range(j * fx * 3, (j + 1) * fx * 3, 3):
+            B += sums[x]
+            G += sums[x + 1]
+            R += sums[x + 2]
+        b, g, r = means[B], means[G], means[R]
+        new_view[i, j, 0] = _clip(b * BB + g * BG + r * BR + B_bias, clip)
+        if not single:
+            new_view[i, j, 1] = _clip(b * GB + g * GG + r * GR + G_bias, clip)
+            new_view[i, j, 2] = _clip(b * RB + g * RG + r * RR + R_bias, clip)
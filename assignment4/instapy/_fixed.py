@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numba
+import numpy as np
+
+from ._numpy import _numpy_color_matrix
+from ._utils import (_GRAYSCALE_MATRIX, _check_color_matrix,
+                     _check_sepia_amount, _empty_image, _resize,
+                     _sepia_matrix)
+
+# Fixed-point precision of the weights. Every weight and bias is scaled by
+# 2**_SHIFT and rounded to the nearest integer, which moves a weighted sum
+# of three channel values by at most 3 * 255 / 2 + 1 / 2 units, less than
+# one after shifting back. Truncating the fixed-point sum therefore gives
+# the truncated floating-point value or a value off by one.
+_SHIFT = 14
+_ONE = 1 << _SHIFT
+# Largest magnitude of a weighted sum that fits in int32
+_MAX_SUM = 2**31 - 1
+
+# The kernels read image rows as flat arrays, which lets the compiler
+# vectorize the integer arithmetic, and only support C-contiguous images.
+# The weighted sums never leave the registers, so the kernels read the uint8
+# image and write the uint8 result only, without any float64 intermediate.
+_CHANNEL_SIGNATURES = [
+    "void(uint8[:, :, ::1], int32[:, ::1], int32[::1], boolean, boolean, uint8[:, ::1])"]
+_COLOR_MATRIX_SIGNATURES = [
+    "void(uint8[:, :, ::1], int32[:, ::1], int32[::1], boolean, boolean, uint8[:, :, ::1])"]
+
+
+def _fixed_weights(matrix, bias):
+    """
+    Fixed-point weights and bias of a color matrix.
+
+    Arguments
+    ---------
+    matrix : array, shape = (c, 3)
+        Color matrix, see '_check_color_matrix'
+    bias : array, shape = (c,)
+        Bias of each new channel
+
+    Returns
+    -------
+    weights : array, shape = (c, 3) or None
+        Weights scaled by 2**_SHIFT as int32. None if a weighted sum may
+        not fit in int32.
+    fixed_bias : array, shape = (c,) or None
+        Bias scaled by 2**_SHIFT as int32
+    """
+    weights = np.round(matrix * _ONE)
+    fixed_bias = np.round(bias * _ONE)
+    largest = np.abs(weights).sum(axis=1) * 255 + np.abs(fixed_bias)
+    if largest.max() > _MAX_SUM:
+        return None, None
+    return weights.astype(np.int32), fixed_bias.astype(np.int32)
+
+
+def _clip_flags(weights, fixed_bias):
+    """
+    Whether the new channels of fixed-point weights must be clipped.
+
+    Arguments
+    ---------
+    weights : array, shape = (c, 3)
+        Fixed-point weights, see '_fixed_weights'
+    fixed_bias : array, shape = (c,)
+        Fixed-point bias, see '_fixed_weights'
+
+    Returns
+    -------
+    clip_low, clip_high : bool
+        Whether a weighted sum can be negative, and whether it can exceed
+        255 after truncation
+    """
+    lowest = np.minimum(weights, 0).sum(axis=1) * 255 + fixed_bias
+    highest = np.maximum(weights, 0).sum(axis=1) * 255 + fixed_bias
+    return bool(lowest.min() < 0), bool(highest.max() >= 256 * _ONE)
+
+
+@numba.njit(_CHANNEL_SIGNATURES, nogil=True, cache=True)
+def _fixed_channel_filter(bgr_image, weights, bias, clip_low, clip_high,
+                          channel_image):
+    """
+    Single-channel fixed-point kernel operation with Numba.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        C-contiguous BGR image to transform as array
+    weights : array, shape = (1, 3)
+        Fixed-point weights of the B, G and R channels
+    bias : array, shape = (1,)
+        Fixed-point offset added to the new channel
+    clip_low, clip_high : bool
+        Whether the new channel must be clipped at 0 and at 255. Both are
+        loop invariant branches, which the compiler hoists out of the loop.
+    channel_image : array, shape = (H, W)
+        Preallocated uint8 array the transformed image is written to
+    """
+    H, W = bgr_image.shape[:2]
+    wB, wG, wR = weights[0, 0], weights[0, 1], weights[0, 2]
+    c_bias = bias[0]
+    for i in range(H):
+        row = bgr_image[i].reshape(3 * W)
+        channel_row = channel_image[i]
+        for j in range(W):
+            value = (np.int32(row[3 * j]) * wB +
+                     np.int32(row[3 * j + 1]) * wG +
+                     np.int32(row[3 * j + 2]) * wR + c_bias) >> _SHIFT
+            if clip_low:
+                value = max(value, 0)
+            if clip_high:
+                value = min(value, 255)
+            channel_row[j] = value
+
+
+@numba.njit(_COLOR_MATRIX_SIGNATURES, nogil=True, cache=True)
+def _fixed_color_matrix_filter(bgr_image, weights, bias, clip_low, clip_high,
+                               new_image):
+    """
+    Three-channel fixed-point kernel operation with Numba.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        C-contiguous BGR image to transform as array
+    weights : array, shape = (3, 3)
+        Fixed-point weights of the B, G and R channels (columns) for each
+        new channel (rows)
+    bias : array, shape = (3,)
+        Fixed-point offset added to each new channel
+    clip_low, clip_high : bool
+        Whether the new channels must be clipped at 0 and at 255, see
+        '_fixed_channel_filter'
+    new_image : array, shape = (H, W, c)
+        Preallocated uint8 array the transformed image is written to
+    """
+    H, W = bgr_image.shape[:2]
+    BB, BG, BR = weights[0, 0], weights[0, 1], weights[0, 2]
+    GB, GG, GR = weights[1, 0], weights[1, 1], weights[1, 2]
+    RB, RG, RR = weights[2, 0], weights[2, 1], weights[2, 2]
+    B_bias, G_bias, R_bias = bias[0], bias[1], bias[2]
+    for i in range(H):
+        row = bgr_image[i].reshape(3 * W)
+        new_row = new_image[i].reshape(3 * W)
+        for j in range(W):
+            b = np.int32(row[3 * j])
+            g = np.int32(row[3 * j + 1])
+            r = np.int32(row[3 * j + 2])
+            B_value = (b * BB + g * BG + r * BR + B_bias) >> _SHIFT
+            G_value = (b * GB + g * GG + r * GR + G_bias) >> _SHIFT
+            R_value = (b * RB + g * RG + r * RR + R_bias) >> _SHIFT
+            if clip_low:
+                B_value = max(B_value, 0)
+                G_value = max(G_value, 0)
+                R_value = max(R_value, 0)
+            if clip_high:
+                B_value = min(B_value, 255)
+                G_value = min(G_value, 255)
+                R_value = min(R_value, 255)
+            new_row[3 * j] = B_value
+            new_row[3 * j + 1] = G_value
+            new_row[3 * j + 2] = R_value
+
+
+def _fixed_color_matrix(bgr_image, matrix, bias=None, scale=None, out=None):
+    """
+    Color matrix image filter.
+
+    Map the B, G and R channels of every pixel to new channels with
+    fixed-point integer arithmetic. Every new channel is the weighted sum of
+    the B, G and R channels plus a bias, clipped to [0, 255] and truncated
+    to uint8. The weights are rounded to multiples of 2**-14, so a channel
+    may differ by one from the NumPy implementation, which is used instead
+    for matrices too large for int32 sums. Strided views are copied to a
+    C-contiguous uint8 image first. The new image can also be up/downscaled
+    while preserving the aspect ratio of the original.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'matrix' or 'bias' are invalid, see '_check_color_matrix'
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    matrix, bias = _check_color_matrix(matrix, bias)
+    weights, fixed_bias = _fixed_weights(matrix, bias)
+    if weights is None:
+        return _numpy_color_matrix(bgr_image, matrix, bias, scale, out=out)
+
+    # Up/downscale but preserve aspect ratio
+    bgr_image = np.ascontiguousarray(_resize(bgr_image, scale))
+
+    new_image = _empty_image(*bgr_image.shape[:2], matrix, out)
+    clip_low, clip_high = _clip_flags(weights, fixed_bias)
+    if len(matrix) == 1:
+        _fixed_channel_filter(bgr_image, weights, fixed_bias, clip_low,
+                              clip_high, new_image)
+    else:
+        _fixed_color_matrix_filter(bgr_image, weights, fixed_bias, clip_low,
+                                   clip_high, new_image)
+
+    return new_image
+
+
+def _fixed_color2gray(bgr_image, scale=None, out=None):
+    """
+    Grayscale image filter.
+
+    Turn a colorful image of choice into a dramatic grayscale image with
+    fixed-point integer arithmetic. A pixel may differ by one from the NumPy
+    implementation. The new image can also be up/downscaled while preserving
+    the aspect ratio of the original.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    grayscale_image : array, shape = (H, W)
+        Transformed image as array
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    return _fixed_color_matrix(bgr_image, _GRAYSCALE_MATRIX, scale=scale,
+                               out=out)
+
+
+def _fixed_color2sepia(bgr_image, scale=None, sepia_amount=1.0, out=None):
+    """
+    Stepless sepia image filter.
+
+    Turn a colorful image of choice into a nostalgic sepia image with
+    fixed-point integer arithmetic. A channel may differ by one from the
+    NumPy implementation. The new image can also be up/downscaled while
+    preserving the aspect ratio of the original.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    sepia_amount : float, optional, default 1.0
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    sepia_image : array, shape = (H, W, c)
+        Transformed image as array
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    _check_sepia_amount(sepia_amount)
+    return _fixed_color_matrix(bgr_image, _sepia_matrix(sepia_amount),
+                               scale=scale, out=out)
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from functools import lru_cache
+
+import numba
+import numpy as np
+
+from ._numpy import _numpy_color_matrix
+from ._utils import (_GRAYSCALE_MATRIX, _check_color_matrix,
+                     _check_sepia_amount, _empty_image, _needs_clip, _resize,
+                     _scratch, _sepia_matrix)
+
+# Fixed-point precision of the lookup tables. Each table entry is the
+# contribution of one input channel value to one output channel, scaled by
+# 2**_SHIFT and rounded down. The entries must fit in int32, which holds
+# while every weighted channel value plus the bias lies within (-2048, 2048)
+_SHIFT = 20
+_ONE = 1 << _SHIFT
+_FRACTION = _ONE - 1
+_MAX_ENTRY = 2**31 - 1
+
+
+def _matrix_tables(matrix, bias):
+    """
+    Lookup tables of a color matrix. Cached for the last 64 color matrices,
+    e.g. per 'sepia_amount' of the sepia filter.
+
+    Arguments
+    ---------
+    matrix : array, shape = (c, 3)
+        Color matrix, see '_check_color_matrix'
+    bias : array, shape = (c,)
+        Bias of each new channel
+
+    Returns
+    -------
+    tables : array, shape = (c, 3, 256) or None
+        Fixed-point contributions of the B, G and R channels to each new
+        channel, see '_tables'. None if the entries do not fit in int32.
+    margins : array, shape = (c,) or None
+        Rounding margins of the new channels, see '_tables'
+    """
+    return _cached_tables(matrix.tobytes(), bias.tobytes())
+
+
+@lru_cache(maxsize=64)
+def _cached_tables(matrix_bytes, bias_bytes):
+    """
+    Lookup tables of a color matrix given as bytes, see '_matrix_tables'.
+    """
+    bias = np.frombuffer(bias_bytes)
+    matrix = np.frombuffer(matrix_bytes).reshape(len(bias), 3)
+    return _tables(matrix, bias)
+
+
+def _tables(matrix, bias):
+    """
+    Build fixed-point lookup tables of a color matrix.
+
+    Every table entry is rounded down by less than one unit, so the sum of
+    the three entries of an output channel is at most (number of inexact
+    tables) units below the exact value. Pixels whose fractional part lies
+    within this margin of an integer could truncate differently than the
+    floating-point filter, and are marked as ambiguous by the kernel. The
+    bias is folded into the tables of the B channel.
+
+    Arguments
+    ---------
+    matrix : array, shape = (c, 3)
+        Weights of the B, G and R channels (columns) for each output
+        channel (rows)
+    bias : array, shape = (c,)
+        Offset added to each output channel
+
+    Returns
+    -------
+    tables : array, shape = (c, 3, 256) or None
+        Fixed-point contributions of each channel value. None if the entries
+        do not fit in int32.
+    margins : array, shape = (c,) or None
+        Rounding margin in fixed-point units of each output channel. Zero if
+        all tables of the channel are exact.
+    """
+    scaled = (matrix[:, :, np.newaxis] * np.arange(256)) * _ONE
+    scaled[:, 0] += bias[:, np.newaxis] * _ONE
+    tables = np.floor(scaled)
+    if np.abs(tables).max() > _MAX_ENTRY:
+        return None, None
+    inexact = (tables != scaled).any(axis=2).sum(axis=1)
+    margins = np.where(inexact > 0, inexact + 1, 0)
+    return tables.astype(np.int32), margins.astype(np.int32)
+
+
+@numba.njit("boolean(int64, int64)", inline="always", cache=True)
+def _is_ambiguous(value, margin):
+    """
+    Whether a fixed-point value lies within 'margin' of an integer.
+    """
+    fraction = value & _FRACTION
+    return margin > 0 and (fraction <= margin or fraction >= _ONE - margin)
+
+
+@numba.njit(["int64(uint8[:, :, ::1], int32[:, :, ::1], int32[::1], boolean, boolean, uint8[:, ::1], boolean[:, ::1])",
+             "int64(uint8[:, :, :], int32[:, :, ::1], int32[::1], boolean, boolean, uint8[:, ::1], boolean[:, ::1])"],
+            cache=True)
+def _lut_channel_filter(bgr_image, tables, margins, clip_low, clip_high,
+                        channel_image, ambiguous):
+    """
+    Single-channel lookup table kernel operation with Numba.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    tables : array, shape = (1, 3, 256)
+        Fixed-point lookup tables, see '_tables'
+    margins : array, shape = (1,)
+        Rounding margin of the output channel, see '_tables'
+    clip_low, clip_high : bool
+        Whether the output channel must be clipped at 0 and at 255. Both are
+        loop invariant branches, which the compiler hoists out of the loop.
+    channel_image : array, shape = (H, W)
+        Preallocated uint8 array the transformed image is written to
+    ambiguous : array, shape = (H, W)
+        Preallocated boolean array marking pixels that must be recomputed
+        with floating-point arithmetic
+
+    Returns
+    -------
+    n_ambiguous : int
+        Number of ambiguous pixels
+    """
+    H, W = bgr_image.shape[:2]
+    B_table, G_table, R_table = tables[0, 0], tables[0, 1], tables[0, 2]
+    margin = margins[0]
+    n_ambiguous = 0
+    for i in range(H):
+        for j in range(W):
+            value = B_table[bgr_image[i, j, 0]] + \
+                G_table[bgr_image[i, j, 1]] + \
+                R_table[bgr_image[i, j, 2]]
+            flag = _is_ambiguous(value, margin)
+            ambiguous[i, j] = flag
+            n_ambiguous += flag
+            value >>= _SHIFT
+            if clip_low:
+                value = max(value, 0)
+            if clip_high:
+                value = min(value, 255)
+            channel_image[i, j] = value
+
+    return n_ambiguous
+
+
+@numba.njit(["int64(uint8[:, :, ::1], int32[:, :, ::1], int32[::1], boolean, boolean, uint8[:, :, ::1], boolean[:, ::1])",
+             "int64(uint8[:, :, :], int32[:, :, ::1], int32[::1], boolean, boolean, uint8[:, :, ::1], boolean[:, ::1])"],
+            cache=True)
+def _lut_color_matrix_filter(bgr_image, tables, margins, clip_low, clip_high,
+                             new_image, ambiguous):
+    """
+    Three-channel lookup table kernel operation with Numba.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    tables : array, shape = (3, 3, 256)
+        Fixed-point lookup tables, see '_tables'
+    margins : array, shape = (3,)
+        Rounding margins of the output channels, see '_tables'
+    clip_low, clip_high : bool
+        Whether the output channels must be clipped at 0 and at 255, see
+        '_lut_channel_filter'
+    new_image : array, shape = (H, W, c)
+        Preallocated uint8 array the transformed image is written to
+    ambiguous : array, shape = (H, W)
+        Preallocated boolean array marking pixels that must be recomputed
+        with floating-point arithmetic
+
+    Returns
+    -------
+    n_ambiguous : int
+        Number of ambiguous pixels
+    """
+    H, W = bgr_image.shape[:2]
+    BB, BG, BR = tables[0, 0], tables[0, 1], tables[0, 2]
+    GB, GG, GR = tables[1, 0], tables[1, 1], tables[1, 2]
+    RB, RG, RR = tables[2, 0], tables[2, 1], tables[2, 2]
+    B_margin, G_margin, R_margin = margins[0], margins[1], margins[2]
+    n_ambiguous = 0
+    for i in range(H):
+        for j in range(W):
+            B = bgr_image[i, j, 0]
+            G = bgr_image[i, j, 1]
+            R = bgr_image[i, j, 2]
+            B_value = BB[B] + BG[G] + BR[R]
+            G_value = GB[B] + GG[G] + GR[R]
+            R_value = RB[B] + RG[G] + RR[R]
+            flag = _is_ambiguous(B_value, B_margin) or \
+                _is_ambiguous(G_value, G_margin) or \
+                _is_ambiguous(R_value, R_margin)
+            ambiguous[i, j] = flag
+            n_ambiguous += flag
+            B_value >>= _SHIFT
+            G_value >>= _SHIFT
+            R_value >>= _SHIFT
+            if clip_low:
+                B_value = max(B_value, 0)
+                G_value = max(G_value, 0)
+                R_value = max(R_value, 0)
+            if clip_high:
+                B_value = min(B_value, 255)
+                G_value = min(G_value, 255)
+                R_value = min(R_value, 255)
+            new_image[i, j, 0] = B_value
+            new_image[i, j, 1] = G_value
+            new_image[i, j, 2] = R_value
+
+    return n_ambiguous
+
+
+def _ambiguous_values(bgr_image, ambiguous, matrix, bias):
+    """
+    Recompute the pixels marked as ambiguous by a lookup table kernel.
+
+    Every new channel is computed as b * w0 + g * w1 + r * w2 + bias,
+    summed from left to right in float64 like the other implementations, so
+    that the truncated value does not depend on the number of ambiguous
+    pixels or on the summation order of a matrix product.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image as array
+    ambiguous : array, shape = (H, W)
+        Boolean array marking the ambiguous pixels
+    matrix : array, shape = (c, 3)
+        Color matrix, see '_check_color_matrix'
+    bias : array, shape = (c,)
+        Bias of each new channel
+
+    Returns
+    -------
+    rows, cols : array
+        Indices of the ambiguous pixels
+    values : array, shape = (N, c)
+        New channels of the ambiguous pixels, clipped to [0, 255]
+    """
+    rows, cols = np.nonzero(ambiguous)
+    bgr_pixels = bgr_image[rows, cols].astype(np.float64)
+    b = bgr_pixels[:, 0, np.newaxis]
+    g = bgr_pixels[:, 1, np.newaxis]
+    r = bgr_pixels[:, 2, np.newaxis]
+    values = b * matrix[:, 0] + g * matrix[:, 1] + r * matrix[:, 2] + bias
+    np.clip(values, 0, 255, out=values)
+    return rows, cols, values
+
+
+def _lut_color_matrix(bgr_image, matrix, bias=None, scale=None, out=None):
+    """
+    Color matrix image filter.
+
+    Map the B, G and R channels of every pixel to new channels with
+    precomputed lookup tables and fixed-point arithmetic. Every new channel
+    is the weighted sum of the B, G and R channels plus a bias, clipped to
+    [0, 255] and truncated to uint8. The result is identical to the NumPy
+    implementation, which is used instead for matrices too large for the
+    fixed-point tables. The new image can also be up/downscaled while
+    preserving the aspect ratio of the original.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'matrix' or 'bias' are invalid, see '_check_color_matrix'
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    matrix, bias = _check_color_matrix(matrix, bias)
+    tables, margins = _matrix_tables(matrix, bias)
+    if tables is None:
+        return _numpy_color_matrix(bgr_image, matrix, bias, scale, out=out)
+
+    # Up/downscale but preserve aspect ratio
+    bgr_image = _resize(bgr_image, scale)
+
+    # Apply lookup tables. Rounded-down sums of non-negative entries are
+    # never negative, and never exceed 255 if the floating-point values
+    # cannot, so clipping is skipped where possible
+    new_image = _empty_image(*bgr_image.shape[:2], matrix, out)
+    ambiguous = _scratch("ambiguous", bgr_image.shape[:2], np.bool_)
+    clip_low = bool(tables.min() < 0)
+    clip_high = _needs_clip(matrix, bias)
+    if len(matrix) == 1:
+        n_ambiguous = _lut_channel_filter(bgr_image, tables, margins,
+                                          clip_low, clip_high, new_image,
+                                          ambiguous)
+    else:
+        n_ambiguous = _lut_color_matrix_filter(bgr_image, tables, margins,
+                                               clip_low, clip_high, new_image,
+                                               ambiguous)
+    if n_ambiguous:
+        # Recompute pixels close to an integer in floating point
+        rows, cols, values = _ambiguous_values(bgr_image, ambiguous, matrix,
+                                               bias)
+        new_image[rows, cols] = values[:, 0] if len(matrix) == 1 else values
+
+    return new_image
+
+
+def _lut_color2gray(bgr_image, scale=None, out=None):
+    """
+    Grayscale image filter.
+
+    Turn a colorful image of choice into a dramatic grayscale image with
+    precomputed lookup tables and fixed-point arithmetic. The result is
+    identical to the NumPy implementation. The new image can also be
+    up/downscaled while preserving the aspect ratio of the original.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    grayscale_image : array, shape = (H, W)
+        Transformed image as array
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    return _lut_color_matrix(bgr_image, _GRAYSCALE_MATRIX, scale=scale,
+                             out=out)
+
+
+def _lut_color2sepia(bgr_image, scale=None, sepia_amount=1.0, out=None):
+    """
+    Stepless sepia image filter.
+
+    Turn a colorful image of choice into a nostalgic sepia image with
+    precomputed lookup tables and fixed-point arithmetic. The result is
+    identical to the NumPy implementation. The new image can also be
+    up/downscaled while preserving the aspect ratio of the original.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    sepia_amount : float, optional, default 1.0
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    sepia_image : array, shape = (H, W, c)
+        Transformed image as array
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    _check_sepia_amount(sepia_amount)
+    return _lut_color_matrix(bgr_image, _sepia_matrix(sepia_amount),
+                             scale=scale, out=out)
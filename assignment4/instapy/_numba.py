@@ -1,123 +1,350 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
-
-import cv2
 import numba
 import numpy as np
 
+from ._utils import (_GRAYSCALE_MATRIX, _area_factors, _area_means,
+                     _check_color_matrix, _check_sepia_amount, _empty_image,
+                     _needs_clip, _num_threads, _resize, _sepia_matrix)
+
+# Fast-math flags of the parallel kernels. Contraction into fused
+# multiply-adds ('contract') and reassociation ('reassoc') are left out, as
+# they change the rounding of the weighted sums and thereby the truncated
+# uint8 result compared to the serial kernels
+_FASTMATH = {"nnan", "ninf", "nsz", "arcp", "afn"}
+
+# Explicit signatures compile the kernels eagerly when the module is
+# imported, and 'cache=True' stores the machine code on disk, so only the
+# very first import on a host pays for compilation. Both C-contiguous
+# images (as returned by cv2.imread and cv2.resize) and arbitrary strided
+# views of uint8 images are supported. The color matrix engine has a kernel
+# for single-channel and one for three-channel results, as a loop over a
+# variable number of channels is considerably slower than either. The
+# kernels release the GIL ('nogil=True'), so that threads decoding and
+# encoding images run while they filter, see 'instapy._stages'
+_CHANNEL_SIGNATURES = [
+    "void(uint8[:, :, ::1], float64[::1], float64, boolean, uint8[:, ::1])",
+    "void(uint8[:, :, :], float64[::1], float64, boolean, uint8[:, ::1])"]
+_COLOR_MATRIX_SIGNATURES = [
+    "void(uint8[:, :, ::1], float64[:, ::1], float64[::1], boolean, uint8[:, :, ::1])",
+    "void(uint8[:, :, :], float64[:, ::1], float64[::1], boolean, uint8[:, :, ::1])"]
+# The planar kernel reads image rows as flat arrays and only supports
+# C-contiguous images
+_PLANAR_SIGNATURES = [
+    "void(uint8[:, :, ::1], float64[:, ::1], float64[::1], uint8[:, :, ::1])"]
+# The kernels fused with downscaling read image rows as flat arrays and
+# only support C-contiguous images
+_CHANNEL_AREA_SIGNATURES = [
+    "void(uint8[:, :, ::1], int64, int64, uint8[::1], float64[::1], float64, boolean, uint8[:, ::1])"]
+_COLOR_MATRIX_AREA_SIGNATURES = [
+    "void(uint8[:, :, ::1], int64, int64, uint8[::1], float64[:, ::1], float64[::1], boolean, uint8[:, :, ::1])"]
+# The sepia preview kernels compute the difference between the full sepia
+# image and the image once, and blend any amount of sepia effect from it.
+# The blend kernel reads both as flat arrays and only supports C-contiguous
+# arrays
+_SEPIA_DELTA_SIGNATURES = [
+    "void(uint8[:, :, ::1], float64[:, ::1], float32[:, :, ::1])",
+    "void(uint8[:, :, :], float64[:, ::1], float32[:, :, ::1])"]
+_SEPIA_BLEND_SIGNATURES = [
+    "void(uint8[::1], float32[::1], float32, uint8[::1])"]
+
+# Three-channel results of C-contiguous images are computed by the planar
+# kernel, which splits every block of '_PLANAR_BLOCK_ROWS' rows into planes
+# of B, G and R values. The contiguous loops over a plane vectorize, which
+# makes the kernel 2-3x faster than the interleaved kernel. For a
+# single-channel result the interleaved kernel is faster, as splitting the
+# channels costs more than the weighted sum itself. Numba compiles for the
+# CPU it runs on, so unlike the Cython module the planar kernel always has
+# the widest vectors of the host. The layout is read on every call and can
+# be changed at runtime, see 'instapy.filters.set_planar_layout'
+_PLANAR_DEFAULT = True
+_PLANAR_LAYOUT = _PLANAR_DEFAULT
+_PLANAR_BLOCK_ROWS = 16
+
+
+@numba.njit(["void(uint8[:, :, ::1], int64, int64, uint16[::1])"], cache=True)
+def _column_sums(bgr_image, start, rows, sums):
+    """
+    Sum 'rows' image rows from row 'start' on per column and channel.
 
-def _numba_color2gray(imagefile, outfile=None, scale=None):
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image as array
+    start, rows : int
+        First image row and number of image rows to sum
+    sums : array, shape = (W * c,)
+        Preallocated uint16 buffer the sums are written to, ordered like the
+        values of an image row
     """
-    Grayscale image filter.
+    n = sums.shape[0]
+    row = bgr_image[start].reshape(n)
+    for x in range(n):
+        sums[x] = row[x]
+    for y in range(start + 1, start + rows):
+        row = bgr_image[y].reshape(n)
+        for x in range(n):
+            sums[x] += row[x]
 
-    Turn a colorful image of choice into a dramatic grayscale image with
+
+def _color_matrix(bgr_image, matrix, bias, scale, parallel, out=None):
+    """
+    Apply the color matrix kernels of this module to an image.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix, bias : array_like
+        Color matrix and bias, see '_check_color_matrix'
+    scale : float or None
+        Scale factor to resize image as fraction, see '_resize'
+    parallel : bool
+        Whether to run the multithreaded kernels
+    out : array, optional, default None
+        Array to write the new image to, see '_empty_image'
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'matrix' or 'bias' are invalid, see '_check_color_matrix'
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    matrix, bias = _check_color_matrix(matrix, bias)
+    clip = _needs_clip(matrix, bias)
+
+    # Integer downscaling is fused into the kernel
+    factors = _area_factors(bgr_image, scale)
+    if factors is not None:
+        fy, fx = factors
+        bgr_image = np.ascontiguousarray(bgr_image)
+        H, W = bgr_image.shape[:2]
+        new_image = _empty_image(H // fy, W // fx, matrix, out)
+        means = _area_means(fy, fx)
+        if len(matrix) == 1:
+            kernel = _channel_area_filter_parallel if parallel \
+                else _channel_area_filter
+            kernel(bgr_image, fy, fx, means, matrix[0], bias[0], clip,
+                   new_image)
+        else:
+            kernel = _color_matrix_area_filter_parallel if parallel \
+                else _color_matrix_area_filter
+            kernel(bgr_image, fy, fx, means, matrix, bias, clip, new_image)
+        return new_image
+
+    # Up/downscale but preserve aspect ratio
+    bgr_image = _resize(bgr_image, scale)
+
+    # Apply color matrix kernel
+    new_image = _empty_image(*bgr_image.shape[:2], matrix, out)
+    if len(matrix) == 1:
+        kernel = _channel_filter_parallel if parallel else _channel_filter
+        kernel(bgr_image, matrix[0], bias[0], clip, new_image)
+    elif _PLANAR_LAYOUT and bgr_image.flags.c_contiguous:
+        kernel = _planar_filter_parallel if parallel else _planar_filter
+        kernel(bgr_image, matrix, bias, new_image)
+    else:
+        kernel = _color_matrix_filter_parallel if parallel \
+            else _color_matrix_filter
+        kernel(bgr_image, matrix, bias, clip, new_image)
+
+    return new_image
+
+
+def _numba_color_matrix(bgr_image, matrix, bias=None, scale=None, out=None):
+    """
+    Color matrix image filter.
+
+    Map the B, G and R channels of every pixel to new channels with
     automatic parallelization (and related optimizations) enabled by Numba.
-    The new image can be saved to a specified location. The new image can
-    also be up/downscaled while preserving the aspect ratio of the original.
+    Every new channel is the weighted sum of the B, G and R channels plus a
+    bias, clipped to [0, 255] and truncated to uint8. The new image can also
+    be up/downscaled while preserving the aspect ratio of the original.
 
     Arguments
     ---------
-    imagefile : str
-        Image filename (with path included) of image with shape (H, W, c) to
-        transform
-    outfile : str, optional, default None
-        Image filename (with path included) if transformed image with shape
-        (H, W) should be saved. Keyword 'auto' will save the new image in
-        the same destination as the original with the transformation added to
-        the original filename.
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
     scale : float, optional, default None
         Scale factor to resize image as fraction, e.g. 0.5 halves image
         dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
-    grayscale_image : array, shape = (H, W)
-        Transformed image as array
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
 
     Raises
     ------
     ValueError : if 'scale' is not larger than 0
+    ValueError : if 'matrix' or 'bias' are invalid, see '_check_color_matrix'
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
     """
-    bgr_image = cv2.imread(imagefile)
+    return _color_matrix(bgr_image, matrix, bias, scale, parallel=False,
+                         out=out)
 
-    if scale is not None:
-        # Up/downscale but preserve aspect ratio
-        if scale > 0:
-            width = int(bgr_image.shape[1] * scale)
-            height = int(bgr_image.shape[0] * scale)
-            dim = (width, height)
-            bgr_image = cv2.resize(
-                bgr_image, dim, interpolation=cv2.INTER_AREA)
-        else:
-            raise ValueError("'scale' must be a float larger than 0")
 
-    # Apply grayscale kernel
-    grayscale_image = _grayscale_filter(bgr_image).astype("uint8")
+def _numba_parallel_color_matrix(bgr_image, matrix, bias=None, scale=None,
+                                 num_threads=None, out=None):
+    """
+    Multithreaded color matrix image filter.
 
-    if outfile is not None:
-        # Save new image
-        if outfile == "auto":
-            filename, file_extension = os.path.splitext(imagefile)
-            cv2.imwrite(filename + "_grayscale" +
-                        file_extension, grayscale_image)
-        else:
-            cv2.imwrite(outfile, grayscale_image)
+    Map the B, G and R channels of every pixel to new channels with the
+    image rows distributed across threads by Numba. See
+    '_numba_color_matrix'.
 
-    return grayscale_image
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    num_threads : int, optional, default None
+        Number of threads. Defaults to the environment variable
+        'INSTAPY_NUM_THREADS' if set, otherwise the number of CPUs. Capped
+        at the size of Numba's thread pool.
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'matrix' or 'bias' are invalid, see '_check_color_matrix'
+    ValueError : if 'num_threads' is not a positive integer
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    numba.set_num_threads(
+        min(_num_threads(num_threads), numba.config.NUMBA_NUM_THREADS))
+    return _color_matrix(bgr_image, matrix, bias, scale, parallel=True,
+                         out=out)
 
 
-@numba.njit
-def _grayscale_filter(bgr_image):
+def _numba_color2gray(bgr_image, scale=None, out=None):
     """
-    Grayscale kernel operation with Numba.
+    Grayscale image filter.
+
+    Turn a colorful image of choice into a dramatic grayscale image with
+    automatic parallelization (and related optimizations) enabled by Numba.
+    The new image can also be up/downscaled while preserving the aspect
+    ratio of the original.
 
     Arguments
     ---------
     bgr_image : array, shape = (H, W, c)
         BGR image to transform as array
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
     grayscale_image : array, shape = (H, W)
         Transformed image as array
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
     """
-    H, W = bgr_image.shape[:2]
-    grayscale_image = np.zeros((H, W))
-    for i in range(H):
-        for j in range(W):
-            grayscale_image[i, j] += bgr_image[i, j, 0] * 0.07 + \
-                bgr_image[i, j, 1] * 0.72 + \
-                bgr_image[i, j, 2] * 0.21
+    return _numba_color_matrix(bgr_image, _GRAYSCALE_MATRIX, scale=scale,
+                               out=out)
+
+
+def _numba_parallel_color2gray(bgr_image, scale=None, num_threads=None,
+                               out=None):
+    """
+    Multithreaded grayscale image filter.
 
-    return grayscale_image
+    Turn a colorful image of choice into a dramatic grayscale image with the
+    image rows distributed across threads by Numba. The new image can also be
+    up/downscaled while preserving the aspect ratio of the original.
 
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    num_threads : int, optional, default None
+        Number of threads. Defaults to the environment variable
+        'INSTAPY_NUM_THREADS' if set, otherwise the number of CPUs. Capped
+        at the size of Numba's thread pool.
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    grayscale_image : array, shape = (H, W)
+        Transformed image as array
 
-def _numba_color2sepia(imagefile, outfile=None, scale=None, sepia_amount=1.0):
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'num_threads' is not a positive integer
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    return _numba_parallel_color_matrix(bgr_image, _GRAYSCALE_MATRIX,
+                                        scale=scale, num_threads=num_threads,
+                                        out=out)
+
+
+def _numba_color2sepia(bgr_image, scale=None, sepia_amount=1.0, out=None):
     """
     Stepless sepia image filter.
 
     Turn a colorful image of choice into a nostalgic sepia image with
     automatic parallelization (and related optimizations) enabled by Numba.
-    The new image can be saved to a specified location. The new image can
-    also be up/downscaled while preserving the aspect ratio of the original.
+    The new image can also be up/downscaled while preserving the aspect
+    ratio of the original.
 
     Arguments
     ---------
-    imagefile : str
-        Image filename (with path included) of image with shape (H, W, c) to
-        transform
-    outfile : str, optional, default None
-        Image filename (with path included) if transformed image with shape
-        (H, W, c) should be saved. Keyword 'auto' will save the new image in
-        the same destination as the original with the transformation added to
-        the original filename.
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
     scale : float, optional, default None
         Scale factor to resize image as fraction, e.g. 0.5 halves image
         dimensions whereas 2 doubles
     sepia_amount : float, optional, default 1.0
         0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
@@ -128,85 +355,449 @@ def _numba_color2sepia(imagefile, outfile=None, scale=None, sepia_amount=1.0):
     ------
     ValueError : if 'scale' is not larger than 0
     ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
     """
-    bgr_image = cv2.imread(imagefile)
-
-    if scale is not None:
-        # Up/downscale but preserve aspect ratio
-        if scale > 0:
-            width = int(bgr_image.shape[1] * scale)
-            height = int(bgr_image.shape[0] * scale)
-            dim = (width, height)
-            bgr_image = cv2.resize(
-                bgr_image, dim, interpolation=cv2.INTER_AREA)
-        else:
-            raise ValueError("'scale' must be a float larger than 0")
-
-    # Apply sepia kernel
-    if not 0.0 <= sepia_amount <= 1.0:
-        raise ValueError(
-            "'sepia_amount' must be a float between 0 (no sepia effect) and 1 (full sepia effect)")
-    sepia_image = _sepia_filter(bgr_image, sepia_amount).astype("uint8")
-
-    if outfile is not None:
-        # Save new image
-        if outfile == "auto":
-            filename, file_extension = os.path.splitext(imagefile)
-            cv2.imwrite(filename + "_sepia" + file_extension, sepia_image)
-        else:
-            cv2.imwrite(outfile, sepia_image)
-
-    return sepia_image
+    _check_sepia_amount(sepia_amount)
+    return _numba_color_matrix(bgr_image, _sepia_matrix(sepia_amount),
+                               scale=scale, out=out)
 
 
-@numba.njit
-def _sepia_filter(bgr_image, sepia_amount):
+def _numba_parallel_color2sepia(bgr_image, scale=None, sepia_amount=1.0,
+                                num_threads=None, out=None):
     """
-    Sepia kernel operation with Numba.
+    Multithreaded stepless sepia image filter.
+
+    Turn a colorful image of choice into a nostalgic sepia image with the
+    image rows distributed across threads by Numba. The new image can also be
+    up/downscaled while preserving the aspect ratio of the original.
 
     Arguments
     ---------
     bgr_image : array, shape = (H, W, c)
         BGR image to transform as array
-    sepia_amount : float
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    sepia_amount : float, optional, default 1.0
         0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    num_threads : int, optional, default None
+        Number of threads. Defaults to the environment variable
+        'INSTAPY_NUM_THREADS' if set, otherwise the number of CPUs. Capped
+        at the size of Numba's thread pool.
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
     sepia_image : array, shape = (H, W, c)
         Transformed image as array
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'num_threads' is not a positive integer
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    _check_sepia_amount(sepia_amount)
+    return _numba_parallel_color_matrix(bgr_image, _sepia_matrix(sepia_amount),
+                                        scale=scale, num_threads=num_threads,
+                                        out=out)
+
+
+def _channel_kernel(bgr_image, weights, bias, clip, channel_image):
+    """
+    Single-channel color matrix kernel operation with Numba.
+
+    The rows are iterated with 'numba.prange', which is distributed across
+    threads when compiled with 'parallel=True' and is an ordinary 'range'
+    otherwise. Clipping is a loop invariant branch, which the compiler
+    hoists out of the loop.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    weights : array, shape = (3,)
+        Weights of the B, G and R channels
+    bias : float
+        Offset added to the new channel
+    clip : bool
+        Whether to clip the new channel to [0, 255], see '_needs_clip'
+    channel_image : array, shape = (H, W)
+        Preallocated uint8 array the transformed image is written to
+    """
+    H, W = bgr_image.shape[:2]
+    wB, wG, wR = weights[0], weights[1], weights[2]
+    for i in numba.prange(H):
+        for j in range(W):
+            value = bgr_image[i, j, 0] * wB + bgr_image[i, j, 1] * wG + \
+                bgr_image[i, j, 2] * wR + bias
+
+            if not clip:
+                channel_image[i, j] = value
+            elif value > 255:
+                channel_image[i, j] = 255
+            elif value < 0:
+                channel_image[i, j] = 0
+            else:
+                channel_image[i, j] = value
+
+
+_channel_filter = numba.njit(
+    _CHANNEL_SIGNATURES, nogil=True, cache=True)(_channel_kernel)
+_channel_filter_parallel = numba.njit(
+    _CHANNEL_SIGNATURES, parallel=True, fastmath=_FASTMATH,
+    nogil=True, cache=True)(_channel_kernel)
+
+
+def _color_matrix_kernel(bgr_image, matrix, bias, clip, new_image):
+    """
+    Three-channel color matrix kernel operation with Numba.
+
+    The rows are iterated with 'numba.prange', which is distributed across
+    threads when compiled with 'parallel=True' and is an ordinary 'range'
+    otherwise. See '_channel_kernel'.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array, shape = (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows)
+    bias : array, shape = (3,)
+        Offset added to each new channel
+    clip : bool
+        Whether to clip the new channels to [0, 255], see '_needs_clip'
+    new_image : array, shape = (H, W, c)
+        Preallocated uint8 array the transformed image is written to
+    """
+    H, W = bgr_image.shape[:2]
+    BB, BG, BR = matrix[0, 0], matrix[0, 1], matrix[0, 2]
+    GB, GG, GR = matrix[1, 0], matrix[1, 1], matrix[1, 2]
+    RB, RG, RR = matrix[2, 0], matrix[2, 1], matrix[2, 2]
+    B_bias, G_bias, R_bias = bias[0], bias[1], bias[2]
+    for i in numba.prange(H):
+        for j in range(W):
+            b = bgr_image[i, j, 0]
+            g = bgr_image[i, j, 1]
+            r = bgr_image[i, j, 2]
+            B = b * BB + g * BG + r * BR + B_bias
+            G = b * GB + g * GG + r * GR + G_bias
+            R = b * RB + g * RG + r * RR + R_bias
+
+            if not clip:
+                new_image[i, j, 0] = B
+                new_image[i, j, 1] = G
+                new_image[i, j, 2] = R
+                continue
+
+            if B > 255:
+                new_image[i, j, 0] = 255
+            elif B < 0:
+                new_image[i, j, 0] = 0
+            else:
+                new_image[i, j, 0] = B
+
+            if G > 255:
+                new_image[i, j, 1] = 255
+            elif G < 0:
+                new_image[i, j, 1] = 0
+            else:
+                new_image[i, j, 1] = G
+
+            if R > 255:
+                new_image[i, j, 2] = 255
+            elif R < 0:
+                new_image[i, j, 2] = 0
+            else:
+                new_image[i, j, 2] = R
+
+
+_color_matrix_filter = numba.njit(
+    _COLOR_MATRIX_SIGNATURES, nogil=True, cache=True)(_color_matrix_kernel)
+_color_matrix_filter_parallel = numba.njit(
+    _COLOR_MATRIX_SIGNATURES, parallel=True, fastmath=_FASTMATH,
+    nogil=True, cache=True)(_color_matrix_kernel)
+
+
+def _planar_kernel(bgr_image, matrix, bias, new_image):
+    """
+    Three-channel color matrix kernel operation on planes with Numba.
+
+    The rows of every block of '_PLANAR_BLOCK_ROWS' rows are split into
+    contiguous planes of B, G and R values once. Every new channel is then
+    computed from the planes in a loop of its own, which the compiler
+    vectorizes, and the new planes are interleaved into the new image. The
+    blocks are iterated with 'numba.prange', so every thread has its own
+    planes. The new channels are always clipped, which costs nothing in
+    vectorized loops and gives the same result as '_color_matrix_kernel'.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        C-contiguous BGR image to transform as array
+    matrix : array, shape = (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows)
+    bias : array, shape = (3,)
+        Offset added to each new channel
+    new_image : array, shape = (H, W, c)
+        Preallocated uint8 array the transformed image is written to
     """
     H, W = bgr_image.shape[:2]
-    sepia_image = np.zeros_like(bgr_image)
-    k = 1 - sepia_amount
-    for i in range(H):
+    n_blocks = (H + _PLANAR_BLOCK_ROWS - 1) // _PLANAR_BLOCK_ROWS
+    for block in numba.prange(n_blocks):
+        planes = np.empty((3, W))
+        new_planes = np.empty((3, W), dtype=np.uint8)
+        start = block * _PLANAR_BLOCK_ROWS
+        for i in range(start, min(start + _PLANAR_BLOCK_ROWS, H)):
+            row = bgr_image[i].reshape(3 * W)
+            for j in range(W):
+                planes[0, j] = row[3 * j]
+                planes[1, j] = row[3 * j + 1]
+                planes[2, j] = row[3 * j + 2]
+
+            for c in range(3):
+                wB, wG, wR = matrix[c, 0], matrix[c, 1], matrix[c, 2]
+                c_bias = bias[c]
+                for j in range(W):
+                    value = planes[0, j] * wB + planes[1, j] * wG + \
+                        planes[2, j] * wR + c_bias
+                    new_planes[c, j] = min(max(value, 0.0), 255.0)
+
+            new_row = new_image[i].reshape(3 * W)
+            for j in range(W):
+                new_row[3 * j] = new_planes[0, j]
+                new_row[3 * j + 1] = new_planes[1, j]
+                new_row[3 * j + 2] = new_planes[2, j]
+
+
+_planar_filter = numba.njit(
+    _PLANAR_SIGNATURES, nogil=True, cache=True)(_planar_kernel)
+_planar_filter_parallel = numba.njit(
+    _PLANAR_SIGNATURES, parallel=True, fastmath=_FASTMATH,
+    nogil=True, cache=True)(_planar_kernel)
+
+
+def _channel_area_kernel(bgr_image, fy, fx, means, weights, bias, clip,
+                         channel_image):
+    """
+    Single-channel color matrix kernel operation fused with integer
+    downscaling with Numba.
+
+    Every new pixel is the new channel of the mean of a block of 'fy' x 'fx'
+    pixels, identical to resizing with cv2.resize and INTER_AREA first.
+    The image rows of a block are summed per column into a buffer of one
+    row, which is then summed per block, so no intermediate resized image is
+    allocated.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    fy, fx : int
+        Integer factors the image rows and columns are downscaled by
+    means : array, shape = (255 * fy * fx + 1,)
+        Rounded block means indexed by block sum, see '_area_means'
+    weights : array, shape = (3,)
+        Weights of the B, G and R channels
+    bias : float
+        Offset added to the new channel
+    clip : bool
+        Whether to clip the new channel to [0, 255], see '_needs_clip'
+    channel_image : array, shape = (H // fy, W // fx)
+        Preallocated uint8 array the transformed image is written to
+    """
+    H, W = channel_image.shape
+    wB, wG, wR = weights[0], weights[1], weights[2]
+    for i in numba.prange(H):
+        sums = np.empty(bgr_image.shape[1] * 3, dtype=np.uint16)
+        _column_sums(bgr_image, i * fy, fy, sums)
         for j in range(W):
-            B = bgr_image[i, j, 0] * (0.131 + 0.869 * k) + bgr_image[i, j, 1] * (
-                0.534 - 0.534 * k) + bgr_image[i, j, 2] * (0.272 - 0.272 * k)
-            G = bgr_image[i, j, 0] * (0.168 - 0.168 * k) + bgr_image[i, j, 1] * (
-                0.686 + 0.314 * k) + bgr_image[i, j, 2] * (0.349 - 0.349 * k)
-            R = bgr_image[i, j, 0] * (0.189 - 0.189 * k) + bgr_image[i, j, 1] * (
-                0.769 - 0.769 * k) + bgr_image[i, j, 2] * (0.393 + 0.607 * k)
+            B = G = R = 0
+            for x in range(j * fx * 3, (j + 1) * fx * 3, 3):
+                B += sums[x]
+                G += sums[x + 1]
+                R += sums[x + 2]
+            value = means[B] * wB + means[G] * wG + means[R] * wR + bias
+
+            if not clip:
+                channel_image[i, j] = value
+            elif value > 255:
+                channel_image[i, j] = 255
+            elif value < 0:
+                channel_image[i, j] = 0
+            else:
+                channel_image[i, j] = value
+
+
+_channel_area_filter = numba.njit(
+    _CHANNEL_AREA_SIGNATURES, nogil=True, cache=True)(_channel_area_kernel)
+_channel_area_filter_parallel = numba.njit(
+    _CHANNEL_AREA_SIGNATURES, parallel=True, fastmath=_FASTMATH,
+    nogil=True, cache=True)(_channel_area_kernel)
+
+
+def _color_matrix_area_kernel(bgr_image, fy, fx, means, matrix, bias, clip,
+                              new_image):
+    """
+    Three-channel color matrix kernel operation fused with integer
+    downscaling with Numba.
+
+    Every new pixel is the color matrix applied to the mean of a block of
+    'fy' x 'fx' pixels, identical to resizing with cv2.resize and INTER_AREA
+    first. See '_channel_area_kernel'.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    fy, fx : int
+        Integer factors the image rows and columns are downscaled by
+    means : array, shape = (255 * fy * fx + 1,)
+        Rounded block means indexed by block sum, see '_area_means'
+    matrix : array, shape = (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows)
+    bias : array, shape = (3,)
+        Offset added to each new channel
+    clip : bool
+        Whether to clip the new channels to [0, 255], see '_needs_clip'
+    new_image : array, shape = (H // fy, W // fx, c)
+        Preallocated uint8 array the transformed image is written to
+    """
+    H, W = new_image.shape[:2]
+    BB, BG, BR = matrix[0, 0], matrix[0, 1], matrix[0, 2]
+    GB, GG, GR = matrix[1, 0], matrix[1, 1], matrix[1, 2]
+    RB, RG, RR = matrix[2, 0], matrix[2, 1], matrix[2, 2]
+    B_bias, G_bias, R_bias = bias[0], bias[1], bias[2]
+    for i in numba.prange(H):
+        sums = np.empty(bgr_image.shape[1] * 3, dtype=np.uint16)
+        _column_sums(bgr_image, i * fy, fy, sums)
+        for j in range(W):
+            b = g = r = 0
+            for x in range(j * fx * 3, (j + 1) * fx * 3, 3):
+                b += sums[x]
+                g += sums[x + 1]
+                r += sums[x + 2]
+            b, g, r = means[b], means[g], means[r]
+            B = b * BB + g * BG + r * BR + B_bias
+            G = b * GB + g * GG + r * GR + G_bias
+            R = b * RB + g * RG + r * RR + R_bias
+
+            if not clip:
+                new_image[i, j, 0] = B
+                new_image[i, j, 1] = G
+                new_image[i, j, 2] = R
+                continue
 
             if B > 255:
-                sepia_image[i, j, 0] = 255
+                new_image[i, j, 0] = 255
             elif B < 0:
-                sepia_image[i, j, 0] = 0
+                new_image[i, j, 0] = 0
             else:
-                sepia_image[i, j, 0] = B
+                new_image[i, j, 0] = B
 
             if G > 255:
-                sepia_image[i, j, 1] = 255
+                new_image[i, j, 1] = 255
             elif G < 0:
-                sepia_image[i, j, 1] = 0
+                new_image[i, j, 1] = 0
             else:
-                sepia_image[i, j, 1] = G
+                new_image[i, j, 1] = G
 
             if R > 255:
-                sepia_image[i, j, 2] = 255
+                new_image[i, j, 2] = 255
             elif R < 0:
-                sepia_image[i, j, 2] = 0
+                new_image[i, j, 2] = 0
             else:
-                sepia_image[i, j, 2] = R
+                new_image[i, j, 2] = R
+
+
+_color_matrix_area_filter = numba.njit(
+    _COLOR_MATRIX_AREA_SIGNATURES, nogil=True,
+    cache=True)(_color_matrix_area_kernel)
+_color_matrix_area_filter_parallel = numba.njit(
+    _COLOR_MATRIX_AREA_SIGNATURES, parallel=True, fastmath=_FASTMATH,
+    nogil=True, cache=True)(_color_matrix_area_kernel)
+
+
+def _sepia_delta_kernel(bgr_image, matrix, delta):
+    """
+    Difference between the unclipped full sepia image and the image with
+    Numba.
+
+    The rows are iterated with 'numba.prange', see '_channel_kernel'.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image as array
+    matrix : array, shape = (3, 3)
+        Sepia matrix of full sepia effect, see '_sepia_matrix'
+    delta : array, shape = (H, W, c)
+        Preallocated float32 array the difference is written to
+    """
+    H, W = bgr_image.shape[:2]
+    BB, BG, BR = matrix[0, 0], matrix[0, 1], matrix[0, 2]
+    GB, GG, GR = matrix[1, 0], matrix[1, 1], matrix[1, 2]
+    RB, RG, RR = matrix[2, 0], matrix[2, 1], matrix[2, 2]
+    for i in numba.prange(H):
+        for j in range(W):
+            b = np.float64(bgr_image[i, j, 0])
+            g = np.float64(bgr_image[i, j, 1])
+            r = np.float64(bgr_image[i, j, 2])
+            delta[i, j, 0] = b * BB + g * BG + r * BR - b
+            delta[i, j, 1] = b * GB + g * GG + r * GR - g
+            delta[i, j, 2] = b * RB + g * RG + r * RR - r
+
+
+_sepia_delta = numba.njit(
+    _SEPIA_DELTA_SIGNATURES, nogil=True, cache=True)(_sepia_delta_kernel)
+_sepia_delta_parallel = numba.njit(
+    _SEPIA_DELTA_SIGNATURES, parallel=True, fastmath=_FASTMATH,
+    nogil=True, cache=True)(_sepia_delta_kernel)
+
+
+def _sepia_blend_kernel(bgr_values, delta, sepia_amount, new_values):
+    """
+    Blend an image with its full sepia image and clip with Numba.
+
+    As the sepia matrix is linear in the amount of sepia effect, the sepia
+    image is the image plus 'sepia_amount' times the difference to the
+    unclipped full sepia image. A single pass reads the image and the
+    difference and writes the clipped new image, which the compiler
+    vectorizes. The values are iterated with 'numba.prange', see
+    '_channel_kernel'.
+
+    Arguments
+    ---------
+    bgr_values : array, shape = (H * W * c,)
+        BGR image as flat array
+    delta : array, shape = (H * W * c,)
+        Difference between the unclipped full sepia image and the image as
+        flat float32 array, see '_sepia_delta_kernel'
+    sepia_amount : float
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    new_values : array, shape = (H * W * c,)
+        Preallocated flat uint8 array the sepia image is written to
+    """
+    for n in numba.prange(bgr_values.size):
+        value = bgr_values[n] + sepia_amount * delta[n]
+        if value > 255:
+            new_values[n] = 255
+        elif value < 0:
+            new_values[n] = 0
+        else:
+            new_values[n] = value
+
 
-    return sepia_image
+_sepia_blend = numba.njit(
+    _SEPIA_BLEND_SIGNATURES, nogil=True, cache=True)(_sepia_blend_kernel)
+_sepia_blend_parallel = numba.njit(
+    _SEPIA_BLEND_SIGNATURES, parallel=True, fastmath=_FASTMATH,
+    nogil=True, cache=True)(_sepia_blend_kernel)
@@ -1,35 +1,116 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
-
-import cv2
-import numba
 import numpy as np
 
+from ._utils import (_GRAYSCALE_MATRIX, _check_color_matrix,
+                     _check_sepia_amount, _empty_image, _needs_clip, _resize,
+                     _scratch, _sepia_matrix)
+
+# Number of pixels transformed at a time by the color matrix. The float64
+# intermediates of a tile are at most 1.5 MB and reused by later calls
+# in the same thread, so peak memory is bounded by the input and output
+# images instead of growing to 8x the image size
+_TILE_PIXELS = 65536
+
 
-def _numpy_color2gray(imagefile, outfile=None, scale=None):
+def _numpy_color_matrix(bgr_image, matrix, bias=None, scale=None, out=None):
     """
-    Grayscale image filter.
+    Color matrix image filter.
 
-    Turn a colorful image of choice into a dramatic grayscale image with the
-    power of a vectorized NumPy implementation. The new image can be saved to
-    a specified location. The new image can also be up/downscaled while
+    Map the B, G and R channels of every pixel to new channels with the power
+    of a vectorized NumPy implementation. Every new channel is the weighted
+    sum of the B, G and R channels plus a bias, clipped to [0, 255] and
+    truncated to uint8. The new image can also be up/downscaled while
     preserving the aspect ratio of the original.
 
     Arguments
     ---------
-    imagefile : str
-        Image filename (with path included) of image with shape (H, W, c) to
-        transform
-    outfile : str, optional, default None
-        Image filename (with path included) if transformed image with shape
-        (H, W) should be saved. Keyword 'auto' will save the new image in
-        the same destination as the original with the transformation added to
-        the original filename.
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'matrix' or 'bias' are invalid, see '_check_color_matrix'
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    matrix, bias = _check_color_matrix(matrix, bias)
+
+    # Up/downscale but preserve aspect ratio
+    bgr_image = _resize(bgr_image, scale)
+
+    # Apply the color matrix tile by tile
+    clip = _needs_clip(matrix, bias)
+    new_image = _empty_image(*bgr_image.shape[:2], matrix, out)
+    bgr_pixels = np.ascontiguousarray(bgr_image).reshape(-1, 3)
+    new_pixels = new_image.reshape(-1, len(matrix))
+    tile_pixels = min(_TILE_PIXELS, len(bgr_pixels))
+    planes = _scratch("planes", (3, tile_pixels))
+    values = _scratch("values", (tile_pixels,))
+    term = _scratch("term", (tile_pixels,))
+    for start in range(0, len(bgr_pixels), _TILE_PIXELS):
+        stop = min(start + _TILE_PIXELS, len(bgr_pixels))
+        n = stop - start
+        # Split the tile into contiguous float64 planes of B, G and R values
+        np.copyto(planes[:, :n], bgr_pixels[start:stop].T)
+        b, g, r = planes[0, :n], planes[1, :n], planes[2, :n]
+        # Every new channel is b * w0 + g * w1 + r * w2 + bias, summed from
+        # left to right like the other implementations. A matrix product
+        # would sum in an order that depends on NumPy's internals and on the
+        # number of pixels, which changes the truncated result
+        value = values[:n]
+        for c, (weights, offset) in enumerate(zip(matrix, bias)):
+            np.multiply(b, weights[0], out=value)
+            np.multiply(g, weights[1], out=term[:n])
+            value += term[:n]
+            np.multiply(r, weights[2], out=term[:n])
+            value += term[:n]
+            if offset:
+                value += offset
+            if clip:
+                np.clip(value, 0, 255, out=value)
+            # Assigning to the uint8 output truncates like astype("uint8")
+            new_pixels[start:stop, c] = value
+
+    return new_image
+
+
+def _numpy_color2gray(bgr_image, scale=None, out=None):
+    """
+    Grayscale image filter.
+
+    Turn a colorful image of choice into a dramatic grayscale image with
+    the power of a vectorized NumPy implementation. The new image can also
+    be up/downscaled while preserving the aspect ratio of the original.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
     scale : float, optional, default None
         Scale factor to resize image as fraction, e.g. 0.5 halves image
         dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
@@ -39,60 +120,33 @@ def _numpy_color2gray(imagefile, outfile=None, scale=None):
     Raises
     ------
     ValueError : if 'scale' is not larger than 0
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
     """
-    bgr_image = cv2.imread(imagefile)
-
-    if scale is not None:
-        # Up/downscale but preserve aspect ratio
-        if scale > 0:
-            width = int(bgr_image.shape[1] * scale)
-            height = int(bgr_image.shape[0] * scale)
-            dim = (width, height)
-            bgr_image = cv2.resize(
-                bgr_image, dim, interpolation=cv2.INTER_AREA)
-        else:
-            raise ValueError("'scale' must be a float larger than 0")
-
-    # Apply grayscale kernel
-    grayscale_kernel = np.array([0.07, 0.72, 0.21])
-    grayscale_image = (bgr_image @ grayscale_kernel).astype("uint8")
-
-    if outfile is not None:
-        # Save new image
-        if outfile == "auto":
-            filename, file_extension = os.path.splitext(imagefile)
-            cv2.imwrite(filename + "_grayscale" +
-                        file_extension, grayscale_image)
-        else:
-            cv2.imwrite(outfile, grayscale_image)
-
-    return grayscale_image
-
-
-def _numpy_color2sepia(imagefile, outfile=None, scale=None, sepia_amount=1.0):
+    return _numpy_color_matrix(bgr_image, _GRAYSCALE_MATRIX, scale=scale,
+                               out=out)
+
+
+def _numpy_color2sepia(bgr_image, scale=None, sepia_amount=1.0, out=None):
     """
     Stepless sepia image filter.
 
     Turn a colorful image of choice into a nostalgic sepia image with the
-    power of a vectorized NumPy implementation. The new image can be saved to
-    a specified location. The new image can also be up/downscaled while
-    preserving the aspect ratio of the original.
+    power of a vectorized NumPy implementation. The new image can also be
+    up/downscaled while preserving the aspect ratio of the original.
 
     Arguments
     ---------
-    imagefile : str
-        Image filename (with path included) of image with shape (H, W, c) to
-        transform
-    outfile : str, optional, default None
-        Image filename (with path included) if transformed image with shape
-        (H, W, c) should be saved. Keyword 'auto' will save the new image in
-        the same destination as the original with the transformation added to
-        the original filename.
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
     scale : float, optional, default None
         Scale factor to resize image as fraction, e.g. 0.5 halves image
         dimensions whereas 2 doubles
     sepia_amount : float, optional, default 1.0
         0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
@@ -103,41 +157,9 @@ def _numpy_color2sepia(imagefile, outfile=None, scale=None, sepia_amount=1.0):
     ------
     ValueError : if 'scale' is not larger than 0
     ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
     """
-    bgr_image = cv2.imread(imagefile)
-
-    if scale is not None:
-        # Up/downscale but preserve aspect ratio
-        if scale > 0:
-            width = int(bgr_image.shape[1] * scale)
-            height = int(bgr_image.shape[0] * scale)
-            dim = (width, height)
-            bgr_image = cv2.resize(
-                bgr_image, dim, interpolation=cv2.INTER_AREA)
-        else:
-            raise ValueError("'scale' must be a float larger than 0")
-
-    # Apply sepia kernel
-    if not 0.0 <= sepia_amount <= 1.0:
-        raise ValueError(
-            "'sepia_amount' must be a float between 0 (no sepia effect) and 1 (full sepia effect)")
-    bgr_image = np.array(bgr_image, dtype=np.float64)
-    k = 1 - sepia_amount
-    sepia_kernel = np.array([
-        [0.131 + 0.869 * k, 0.534 - 0.534 * k, 0.272 - 0.272 * k],
-        [0.168 - 0.168 * k, 0.686 + 0.314 * k, 0.349 - 0.349 * k],
-        [0.189 - 0.189 * k, 0.769 - 0.769 * k, 0.393 + 0.607 * k]])
-    sepia_image = bgr_image.dot(sepia_kernel.T)
-    sepia_image[np.where(sepia_image > 255)] = 255
-    sepia_image[np.where(sepia_image < 0)] = 0
-    sepia_image = sepia_image.astype("uint8")
-
-    if outfile is not None:
-        # Save new image
-        if outfile == "auto":
-            filename, file_extension = os.path.splitext(imagefile)
-            cv2.imwrite(filename + "_sepia" + file_extension, sepia_image)
-        else:
-            cv2.imwrite(outfile, sepia_image)
-
-    return sepia_image
+    _check_sepia_amount(sepia_amount)
+    return _numpy_color_matrix(bgr_image, _sepia_matrix(sepia_amount),
+                               scale=scale, out=out)
@@ -1,104 +1,130 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
+from ._utils import (_GRAYSCALE_MATRIX, _check_color_matrix,
+                     _check_sepia_amount, _empty_image, _resize, _sepia_matrix)
 
-import cv2
-import numpy as np
 
-
-def _python_color2gray(imagefile, outfile=None, scale=None):
+def _python_color_matrix(bgr_image, matrix, bias=None, scale=None, out=None):
     """
-    Grayscale image filter.
+    Color matrix image filter.
 
-    Turn a colorful image of choice into a dramatic grayscale image with a
-    pure Python implementation. The new image can be saved to a specified
-    location. The new image can also be up/downscaled while preserving
-    the aspect ratio of the original.
+    Map the B, G and R channels of every pixel to new channels with a pure
+    Python implementation. Every new channel is the weighted sum of the B, G
+    and R channels plus a bias, clipped to [0, 255] and truncated to uint8.
+    The new image can also be up/downscaled while preserving the aspect
+    ratio of the original.
 
     Arguments
     ---------
-    imagefile : str
-        Image filename (with path included) of image with shape (H, W, c) to
-        transform
-    outfile : str, optional, default None
-        Image filename (with path included) if transformed image with shape
-        (H, W) should be saved. Keyword 'auto' will save the new image in
-        the same destination as the original with the transformation added to
-        the original filename.
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
     scale : float, optional, default None
         Scale factor to resize image as fraction, e.g. 0.5 halves image
         dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
-    grayscale_image : array, shape = (H, W)
-        Transformed image as array
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
 
     Raises
     ------
     ValueError : if 'scale' is not larger than 0
+    ValueError : if 'matrix' or 'bias' are invalid, see '_check_color_matrix'
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
     """
-    bgr_image = cv2.imread(imagefile)
-
-    if scale is not None:
-        # Up/downscale but preserve aspect ratio
-        if scale > 0:
-            width = int(bgr_image.shape[1] * scale)
-            height = int(bgr_image.shape[0] * scale)
-            dim = (width, height)
-            bgr_image = cv2.resize(
-                bgr_image, dim, interpolation=cv2.INTER_AREA)
-        else:
-            raise ValueError("'scale' must be a float larger than 0")
-
-    # Apply grayscale kernel
+    matrix, bias = _check_color_matrix(matrix, bias)
+
+    # Up/downscale but preserve aspect ratio
+    bgr_image = _resize(bgr_image, scale)
+
+    # Apply color matrix
     H, W = bgr_image.shape[:2]
-    grayscale_image = np.zeros((H, W))
+    new_image = _empty_image(H, W, matrix, out)
+    new_view = new_image.reshape(H, W, len(matrix))
+    weights = matrix.tolist()
+    offsets = bias.tolist()
     for i in range(H):
         for j in range(W):
-            grayscale_image[i, j] += bgr_image[i, j, 0] * 0.07 + \
-                bgr_image[i, j, 1] * 0.72 + \
-                bgr_image[i, j, 2] * 0.21
+            for c in range(len(weights)):
+                value = bgr_image[i, j, 0] * weights[c][0] + \
+                    bgr_image[i, j, 1] * weights[c][1] + \
+                    bgr_image[i, j, 2] * weights[c][2] + offsets[c]
+
+                if value > 255:
+                    new_view[i, j, c] = 255
+                elif value < 0:
+                    new_view[i, j, c] = 0
+                else:
+                    new_view[i, j, c] = value
 
-    grayscale_image = grayscale_image.astype("uint8")
+    return new_image
+
+
+def _python_color2gray(bgr_image, scale=None, out=None):
+    """
+    Grayscale image filter.
+
+    Turn a colorful image of choice into a dramatic grayscale image with a
+    pure Python implementation. The new image can also be up/downscaled
+    while preserving the aspect ratio of the original.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
-    if outfile is not None:
-        # Save new image
-        if outfile == "auto":
-            filename, file_extension = os.path.splitext(imagefile)
-            cv2.imwrite(filename + "_grayscale" +
-                        file_extension, grayscale_image)
-        else:
-            cv2.imwrite(outfile, grayscale_image)
+    Returns
+    -------
+    grayscale_image : array, shape = (H, W)
+        Transformed image as array
 
-    return grayscale_image
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
+    """
+    return _python_color_matrix(bgr_image, _GRAYSCALE_MATRIX, scale=scale,
+                                out=out)
 
 
-def _python_color2sepia(imagefile, outfile=None, scale=None, sepia_amount=1.0):
+def _python_color2sepia(bgr_image, scale=None, sepia_amount=1.0, out=None):
     """
     Stepless sepia image filter.
 
-    Turn a colorful image of choice into a nostalgic sepia image with a pure
-    Python implementation. The new image can be saved to a specified location.
-    The new image can also be up/downscaled while preserving the aspect ratio
-    of the original.
+    Turn a colorful image of choice into a nostalgic sepia image with a
+    pure Python implementation. The new image can also be up/downscaled
+    while preserving the aspect ratio of the original.
 
     Arguments
     ---------
-    imagefile : str
-        Image filename (with path included) of image with shape (H, W, c) to
-        transform
-    outfile : str, optional, default None
-        Image filename (with path included) if transformed image with shape
-        (H, W, c) should be saved. Keyword 'auto' will save the new image in
-        the same destination as the original with the transformation added to
-        the original filename.
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
     scale : float, optional, default None
         Scale factor to resize image as fraction, e.g. 0.5 halves image
         dimensions whereas 2 doubles
     sepia_amount : float, optional, default 1.0
         0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    out : array, optional, default None
+        Array to write the new image to; C-contiguous uint8 of the shape of
+        the new image. Defaults to a new array.
 
     Returns
     -------
@@ -109,66 +135,9 @@ def _python_color2sepia(imagefile, outfile=None, scale=None, sepia_amount=1.0):
     ------
     ValueError : if 'scale' is not larger than 0
     ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image
     """
-    bgr_image = cv2.imread(imagefile)
-
-    if scale is not None:
-        # Up/downscale but preserve aspect ratio
-        if scale > 0:
-            width = int(bgr_image.shape[1] * scale)
-            height = int(bgr_image.shape[0] * scale)
-            dim = (width, height)
-            bgr_image = cv2.resize(
-                bgr_image, dim, interpolation=cv2.INTER_AREA)
-        else:
-            raise ValueError("'scale' must be a float larger than 0")
-
-    # Apply sepia kernel
-    if not 0.0 <= sepia_amount <= 1.0:
-        raise ValueError(
-            "'sepia_amount' must be a float between 0 (no sepia effect) and 1 (full sepia effect)")
-
-    H, W = bgr_image.shape[:2]
-    sepia_image = np.zeros_like(bgr_image)
-    k = 1 - sepia_amount
-    for i in range(H):
-        for j in range(W):
-            B = bgr_image[i, j, 0] * (0.131 + 0.869 * k) + bgr_image[i, j, 1] * (
-                0.534 - 0.534 * k) + bgr_image[i, j, 2] * (0.272 - 0.272 * k)
-            G = bgr_image[i, j, 0] * (0.168 - 0.168 * k) + bgr_image[i, j, 1] * (
-                0.686 + 0.314 * k) + bgr_image[i, j, 2] * (0.349 - 0.349 * k)
-            R = bgr_image[i, j, 0] * (0.189 - 0.189 * k) + bgr_image[i, j, 1] * (
-                0.769 - 0.769 * k) + bgr_image[i, j, 2] * (0.393 + 0.607 * k)
-
-            if B > 255:
-                sepia_image[i, j, 0] = 255
-            elif B < 0:
-                sepia_image[i, j, 0] = 0
-            else:
-                sepia_image[i, j, 0] = B
-
-            if G > 255:
-                sepia_image[i, j, 1] = 255
-            elif G < 0:
-                sepia_image[i, j, 1] = 0
-            else:
-                sepia_image[i, j, 1] = G
-
-            if R > 255:
-                sepia_image[i, j, 2] = 255
-            elif R < 0:
-                sepia_image[i, j, 2] = 0
-            else:
-                sepia_image[i, j, 2] = R
-
-    sepia_image = sepia_image.astype("uint8")
-
-    if outfile is not None:
-        # Save new image
-        if outfile == "auto":
-            filename, file_extension = os.path.splitext(imagefile)
-            cv2.imwrite(filename + "_sepia" + file_extension, sepia_image)
-        else:
-            cv2.imwrite(outfile, sepia_image)
-
-    return sepia_image
+    _check_sepia_amount(sepia_amount)
+    return _python_color_matrix(bgr_image, _sepia_matrix(sepia_amount),
+                                scale=scale, out=out)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import queue
+import threading
+
+# Marks the end of the items passed between the stages
+_DONE = object()
+
+# Seconds a stage waits on a full or empty queue before checking whether
+# another stage failed
+_POLL_INTERVAL = 0.1
+
+
+def _put(items, item, stop):
+    """
+    Put an item in a bounded queue unless the stages are stopped.
+
+    Returns
+    -------
+    put : bool
+        False if the stages were stopped before the item could be put
+    """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(items, stop):
+    """
+    Get an item from a queue, or '_DONE' if the stages are stopped.
+    """
+    while True:
+        try:
+            return items.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            if stop.is_set():
+                return _DONE
+
+
+def _run_stages(source, transform, sink, queue_size=8):
+    """
+    Run a reader, transform and writer stage concurrently.
+
+    The items of 'source' are produced in a reader thread, transformed in
+    the calling thread and consumed by 'sink' in a writer thread. The stages
+    are connected by queues of at most 'queue_size' items, which bounds the
+    memory use when one stage is slower than the others. OpenCV releases
+    the GIL while decoding and encoding, as do the compiled kernels, so the
+    three stages overlap. The first exception raised by a stage stops all
+    stages and is raised again.
+
+    Arguments
+    ---------
+    source : iterable
+        Items to transform, e.g. a generator reading video frames
+    transform : callable
+        Function applied to every item
+    sink : callable
+        Function called with every transformed item, in the order of
+        'source'
+    queue_size : int, optional, default 8
+        Maximum number of items waiting between two stages
+
+    Returns
+    -------
+    n_items : int
+        Number of items transformed and consumed
+
+    Raises
+    ------
+    ValueError : if 'queue_size' is not a positive integer
+    """
+    if not queue_size >= 1:
+        raise ValueError("'queue_size' must be a positive integer")
+
+    read_items = queue.Queue(maxsize=queue_size)
+    transformed_items = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        try:
+            for item in source:
+                if not _put(read_items, item, stop):
+                    return
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+        _put(read_items, _DONE, stop)
+
+    def write():
+        try:
+            while True:
+                item = _get(transformed_items, stop)
+                if item is _DONE:
+                    return
+                sink(item)
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+
+    reader = threading.Thread(target=read, daemon=True)
+    writer = threading.Thread(target=write, daemon=True)
+    reader.start()
+    writer.start()
+
+    n_items = 0
+    try:
+        while True:
+            item = _get(read_items, stop)
+            if item is _DONE:
+                break
+            if not _put(transformed_items, transform(item), stop):
+                break
+            n_items += 1
+    except BaseException as error:
+        errors.append(error)
+        stop.set()
+    _put(transformed_items, _DONE, stop)
+
+    reader.join()
+    writer.join()
+    if errors:
+        raise errors[0]
+    return n_items
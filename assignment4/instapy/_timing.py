@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+import numpy as np
+
+
+def run_times(n_experiments, func, *args, **kwargs):
+    """
+    Measure the run time of every one of n experiments of a function.
+
+    Arguments
+    ---------
+    n_experiments : int
+        Number of experiments (or runs)
+    func : object
+        Function object to profile
+    *args
+        Arbitrary arguments passed along to func
+    **kwargs
+        Arbitrary keyword arguments passed along to func
+
+    Returns
+    -------
+    run_times : array, shape = (n_experiments,)
+        Run time of every experiment in seconds
+    """
+    run_times = np.zeros(n_experiments)
+    for i in range(n_experiments):
+        t0 = time.perf_counter()
+        func(*args, **kwargs)
+        run_times[i] = time.perf_counter() - t0
+    return run_times
+
+
+def timer(n_experiments, func, *args, **kwargs):
+    """
+    Measure run time averaged over n experiments of a function.
+
+    Ported from profiling/manual_timing_.py for use within the package, with
+    time.perf_counter in place of time.time for a finer resolution.
+
+    Arguments
+    ---------
+    n_experiments : int
+        Number of experiments (or runs) to average time usage over
+    func : object
+        Function object to profile
+    *args
+        Arbitrary arguments passed along to func
+    **kwargs
+        Arbitrary keyword arguments passed along to func
+
+    Returns
+    -------
+    output : str
+        Nicely formated string of profile result
+    run_time_avg : float
+        Averaged run time
+    """
+    run_time_avg = np.mean(run_times(n_experiments, func, *args, **kwargs))
+    output = f"Average run time of {func.__name__!r} after {n_experiments} runs: {run_time_avg:.5f} secs\n"
+    return output, run_time_avg
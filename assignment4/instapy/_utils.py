@@ -0,0 +1,744 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+# Largest integer downscale factor fused into the compiled color kernels
+_MAX_AREA_FACTOR = 16
+
+# Decode modes of OpenCV that decode JPEG images at 1/2, 1/4 and 1/8 of
+# their size in the DCT domain, keyed by the reduction factor
+_REDUCED_COLOR_MODES = {8: cv2.IMREAD_REDUCED_COLOR_8,
+                        4: cv2.IMREAD_REDUCED_COLOR_4,
+                        2: cv2.IMREAD_REDUCED_COLOR_2}
+
+# Scratch buffers of the calling thread, see '_scratch'
+_workspace = threading.local()
+
+# Color matrix of the grayscale filter: weights of the B, G and R channels
+_GRAYSCALE_MATRIX = np.array([[0.07, 0.72, 0.21]])
+_GRAYSCALE_MATRIX.setflags(write=False)
+
+
+def _cache_dir():
+    """
+    Directory of the caches of instapy.
+
+    Returns
+    -------
+    cache_dir : str
+        The environment variable 'INSTAPY_CACHE_DIR' if set, otherwise
+        ~/.cache/instapy
+    """
+    return os.environ.get("INSTAPY_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "instapy")
+
+
+def _sepia_matrix(sepia_amount):
+    """
+    Color matrix of the sepia filter for a given amount of sepia effect.
+
+    Arguments
+    ---------
+    sepia_amount : float
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+
+    Returns
+    -------
+    sepia_matrix : array, shape = (3, 3)
+        Matrix mapping the B, G and R channels (columns) of a pixel to its new
+        B, G and R channels (rows)
+    """
+    k = 1 - sepia_amount
+    return np.array([
+        [0.131 + 0.869 * k, 0.534 - 0.534 * k, 0.272 - 0.272 * k],
+        [0.168 - 0.168 * k, 0.686 + 0.314 * k, 0.349 - 0.349 * k],
+        [0.189 - 0.189 * k, 0.769 - 0.769 * k, 0.393 + 0.607 * k]])
+
+
+def _check_color_matrix(matrix, bias=None):
+    """
+    Validate a color matrix and its bias.
+
+    Arguments
+    ---------
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) of a pixel for each new
+        channel (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
+
+    Returns
+    -------
+    matrix : array, shape = (c, 3)
+        C-contiguous float64 copy of 'matrix'
+    bias : array, shape = (c,)
+        C-contiguous float64 bias of each new channel
+
+    Raises
+    ------
+    ValueError : if 'matrix' does not have shape (3,), (1, 3) or (3, 3)
+    ValueError : if 'bias' does not broadcast to shape (c,)
+    ValueError : if 'matrix' or 'bias' are not finite
+    """
+    matrix = np.array(matrix, dtype=np.float64, ndmin=2)
+    if matrix.shape not in ((1, 3), (3, 3)):
+        raise ValueError("'matrix' must have shape (3,), (1, 3) or (3, 3)")
+
+    if bias is None:
+        bias = np.zeros(len(matrix))
+    else:
+        bias = np.asarray(bias, dtype=np.float64)
+        if bias.ndim > 1 or bias.size not in (1, len(matrix)):
+            raise ValueError(
+                f"'bias' must be a float or have shape ({len(matrix)},)")
+        bias = np.array(np.broadcast_to(bias, len(matrix)))
+
+    if not (np.isfinite(matrix).all() and np.isfinite(bias).all()):
+        raise ValueError("'matrix' and 'bias' must be finite")
+    return matrix, bias
+
+
+def _needs_clip(matrix, bias):
+    """
+    Whether a color matrix can map pixels outside [0, 256).
+
+    Values within this range are truncated to uint8 without clipping, which
+    the implementations skip where it saves time, e.g. for the grayscale
+    filter. The upper bound leaves room for the rounding of the weighted
+    sums.
+
+    Arguments
+    ---------
+    matrix : array, shape = (c, 3)
+        Color matrix, see '_check_color_matrix'
+    bias : array, shape = (c,)
+        Bias of each new channel
+
+    Returns
+    -------
+    clip : bool
+        True if a new channel of some pixel may have to be clipped
+    """
+    low = 255 * np.minimum(matrix, 0).sum(axis=1) + bias
+    high = 255 * np.maximum(matrix, 0).sum(axis=1) + bias
+    return not ((low >= 0).all() and (high <= 255.5).all())
+
+
+def _empty_image(height, width, matrix, out=None):
+    """
+    Allocate the image a color matrix transforms to, or check a
+    caller-supplied one.
+
+    Arguments
+    ---------
+    height, width : int
+        Image dimensions
+    matrix : array, shape = (c, 3)
+        Color matrix, see '_check_color_matrix'
+    out : array, optional, default None
+        Array to write the new image to instead of allocating one
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Uninitialized uint8 array, or 'out'; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'out' is not a writable C-contiguous uint8 array of the
+                 shape of the new image
+    """
+    if len(matrix) == 1:
+        shape = (height, width)
+    else:
+        shape = (height, width, len(matrix))
+    if out is None:
+        return np.empty(shape, dtype=np.uint8)
+    if not (isinstance(out, np.ndarray) and out.dtype == np.uint8 and
+            out.shape == shape and out.flags.c_contiguous and
+            out.flags.writeable):
+        raise ValueError("'out' must be a writable C-contiguous uint8 array "
+                         f"of shape {shape}")
+    return out
+
+
+def _scratch(name, shape, dtype=np.float64):
+    """
+    Scratch buffer of the calling thread.
+
+    Buffers are kept per thread and name and grown when needed, so that
+    filtering a stream of images of the same size allocates no temporaries
+    after the first image. The content is undefined, and only valid until
+    the next call with the same name in the same thread.
+
+    Arguments
+    ---------
+    name : str
+        Name of the buffer
+    shape : tuple of int
+        Shape of the buffer
+    dtype : data-type, optional, default np.float64
+        Data type of the buffer
+
+    Returns
+    -------
+    buffer : array
+        Uninitialized C-contiguous array of 'shape' and 'dtype'
+    """
+    size = int(np.prod(shape))
+    buffer = getattr(_workspace, name, None)
+    if buffer is None or buffer.dtype != dtype or buffer.size < size:
+        buffer = np.empty(size, dtype=dtype)
+        setattr(_workspace, name, buffer)
+    return buffer[:size].reshape(shape)
+
+
+def _read_image(imagefile):
+    """
+    Read a color image from file.
+
+    Arguments
+    ---------
+    imagefile : str
+        Image filename (with path included) of image with shape (H, W, c)
+
+    Returns
+    -------
+    bgr_image : array, shape = (H, W, c)
+        BGR image as array
+
+    Raises
+    ------
+    FileNotFoundError : if 'imagefile' could not be read as an image
+    """
+    bgr_image = cv2.imread(imagefile)
+    if bgr_image is None:
+        raise FileNotFoundError(f"Could not read image {imagefile!r}")
+    return bgr_image
+
+
+def _read_file(imagefile):
+    """
+    Read the encoded contents of an image file.
+
+    Arguments
+    ---------
+    imagefile : str
+        Image filename (with path included)
+
+    Returns
+    -------
+    buffer : array, shape = (n,)
+        Encoded image as uint8 array
+
+    Raises
+    ------
+    FileNotFoundError : if 'imagefile' could not be read
+    """
+    try:
+        return np.fromfile(imagefile, dtype=np.uint8)
+    except OSError:
+        raise FileNotFoundError(f"Could not read image {imagefile!r}") from None
+
+
+def _image_buffer(source):
+    """
+    View an encoded image as a flat uint8 array.
+
+    Arguments
+    ---------
+    source : bytes-like or file object
+        Encoded image, e.g. the contents of a JPEG or PNG file, as bytes,
+        bytearray, memoryview or any other object supporting the buffer
+        protocol, or a binary file object opened for reading
+
+    Returns
+    -------
+    buffer : array, shape = (n,)
+        Encoded image as uint8 array; a view of 'source' without copying if
+        it supports the buffer protocol
+
+    Raises
+    ------
+    TypeError : if 'source' is neither bytes-like nor a file object
+    """
+    if hasattr(source, "read"):
+        source = source.read()
+    try:
+        return np.frombuffer(source, dtype=np.uint8)
+    except TypeError:
+        raise TypeError("'source' must be bytes-like or a binary file object") from None
+
+
+def _decode_image(source):
+    """
+    Decode a color image from an encoded image held in memory.
+
+    Arguments
+    ---------
+    source : bytes-like or file object
+        Encoded image, see '_image_buffer'
+
+    Returns
+    -------
+    bgr_image : array, shape = (H, W, c)
+        BGR image as array
+
+    Raises
+    ------
+    TypeError : if 'source' is neither bytes-like nor a file object
+    ValueError : if 'source' could not be decoded as an image
+    """
+    buffer = _image_buffer(source)
+    bgr_image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+    if bgr_image is None:
+        raise ValueError("Could not decode image bytes")
+    return bgr_image
+
+
+def _encode_params(ext, quality=None, compression=None):
+    """
+    OpenCV parameters of an image format.
+
+    Arguments
+    ---------
+    ext : str
+        File extension of the image format, e.g. '.jpg', '.png' or '.webp';
+        the leading dot may be left out
+    quality : int or None
+        JPEG quality from 0 to 100, or WebP quality from 1 to 100 (above 100
+        is lossless). Defaults to OpenCV's default of 95 (JPEG) or lossless
+        (WebP) if None.
+    compression : int or None
+        PNG compression level from 0 (fastest, largest) to 9 (slowest,
+        smallest). Defaults to OpenCV's default of 1 if None.
+
+    Returns
+    -------
+    params : list of int
+        Pairs of parameter ids and values for cv2.imencode and cv2.imwrite
+
+    Raises
+    ------
+    ValueError : if 'quality' is given for a format other than JPEG or WebP,
+                 or is out of range
+    ValueError : if 'compression' is given for a format other than PNG, or
+                 is not between 0 and 9
+    """
+    ext = "." + ext.lower().lstrip(".")
+    params = []
+    if quality is not None:
+        if ext in (".jpg", ".jpeg", ".jpe"):
+            if not 0 <= quality <= 100:
+                raise ValueError("JPEG 'quality' must be between 0 and 100")
+            params += [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        elif ext == ".webp":
+            if not quality >= 1:
+                raise ValueError("WebP 'quality' must be at least 1")
+            params += [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+        else:
+            raise ValueError(f"'quality' is not supported for {ext!r} images")
+    if compression is not None:
+        if ext != ".png":
+            raise ValueError(f"'compression' is not supported for {ext!r} images")
+        if not 0 <= compression <= 9:
+            raise ValueError("PNG 'compression' must be between 0 and 9")
+        params += [cv2.IMWRITE_PNG_COMPRESSION, int(compression)]
+    return params
+
+
+def _encode_image(image, ext, quality=None, compression=None):
+    """
+    Encode a transformed image to bytes.
+
+    Arguments
+    ---------
+    image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array
+    ext : str
+        File extension of the image format, e.g. '.jpg', '.png' or '.webp'
+    quality, compression : int or None
+        Quality of JPEG and WebP images and compression level of PNG images,
+        see '_encode_params'
+
+    Returns
+    -------
+    image_bytes : bytes
+        Encoded image
+
+    Raises
+    ------
+    ValueError : if 'quality' or 'compression' are invalid for 'ext'
+    ValueError : if the image could not be encoded as 'ext'
+    """
+    params = _encode_params(ext, quality, compression)
+    if not ext.startswith("."):
+        ext = "." + ext
+    try:
+        ok, buffer = cv2.imencode(ext, image, params)
+    except cv2.error:
+        ok = False
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext!r}")
+    return buffer.tobytes()
+
+
+def _jpeg_size(buffer):
+    """
+    Size of a JPEG image according to its frame header.
+
+    Arguments
+    ---------
+    buffer : array, shape = (n,)
+        Encoded image as uint8 array
+
+    Returns
+    -------
+    size : tuple of int or None
+        Image height and width, None if 'buffer' is not a JPEG image or its
+        frame header could not be found
+    """
+    data = memoryview(buffer)
+    if bytes(data[:2]) != b"\xff\xd8":
+        return None
+
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a segment
+            i += 2
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            # Start of frame
+            height = data[i + 5] << 8 | data[i + 6]
+            width = data[i + 7] << 8 | data[i + 8]
+            return height, width
+        else:
+            i += 2 + (data[i + 2] << 8 | data[i + 3])
+    return None
+
+
+def _decode_reduced(buffer, scale):
+    """
+    Decode and downscale a JPEG image without decoding it at full size.
+
+    The image is decoded with the smallest of OpenCV's reduced decode modes
+    that is still at least the size of the new image, and then resized to
+    the size '_resize' would give with INTER_AREA. The result is close to,
+    but not identical with, decoding at full size and resizing.
+
+    Arguments
+    ---------
+    buffer : array, shape = (n,)
+        Encoded image as uint8 array
+    scale : float or None
+        Scale factor to resize image as fraction, see '_resize'
+
+    Returns
+    -------
+    bgr_image : array, shape = (H * scale, W * scale, c) or None
+        Decoded and resized BGR image as array. None if the image is not a
+        JPEG image, is not downscaled by a factor of two or more, or could
+        not be decoded, in which case it should be decoded at full size.
+    """
+    if scale is None or not 0 < scale <= 0.5:
+        return None
+    size = _jpeg_size(buffer)
+    if size is None:
+        return None
+
+    factor = max(f for f in _REDUCED_COLOR_MODES if f * scale <= 1)
+    bgr_image = cv2.imdecode(buffer, _REDUCED_COLOR_MODES[factor])
+    if bgr_image is None:
+        return None
+
+    # The decoder rounds the reduced size up, and may have rotated the image
+    # according to its EXIF orientation
+    H, W = size
+    reduced = (-(-H // factor), -(-W // factor))
+    if bgr_image.shape[:2] == reduced[::-1]:
+        H, W = W, H
+    elif bgr_image.shape[:2] != reduced:
+        return None
+
+    width = int(W * scale)
+    height = int(H * scale)
+    if width == 0 or height == 0:
+        return None
+    if (height, width) == bgr_image.shape[:2]:
+        return bgr_image
+    return cv2.resize(bgr_image, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def _read_image_scaled(imagefile, scale, buffer=None):
+    """
+    Read a color image from file and prepare it for resizing.
+
+    JPEG images downscaled by a factor of two or more are decoded at reduced
+    size, see '_decode_reduced', which saves most of the decoding time of
+    thumbnails.
+
+    Arguments
+    ---------
+    imagefile : str
+        Image filename (with path included) of image with shape (H, W, c)
+    scale : float or None
+        Scale factor to resize image as fraction, see '_resize'
+    buffer : array, shape = (n,), optional, default None
+        Contents of 'imagefile' if read already, see '_read_file'
+
+    Returns
+    -------
+    bgr_image : array, shape = (H, W, c)
+        BGR image as array, possibly resized already
+    scale : float or None
+        Scale factor still to be applied to 'bgr_image'; None if it is
+        resized already
+
+    Raises
+    ------
+    FileNotFoundError : if 'imagefile' could not be read as an image
+    """
+    if buffer is None:
+        if scale is None or not 0 < scale <= 0.5:
+            return _read_image(imagefile), scale
+        buffer = _read_file(imagefile)
+
+    bgr_image = _decode_reduced(buffer, scale)
+    if bgr_image is not None:
+        return bgr_image, None
+    bgr_image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+    if bgr_image is None:
+        raise FileNotFoundError(f"Could not read image {imagefile!r}")
+    return bgr_image, scale
+
+
+def _decode_image_scaled(source, scale):
+    """
+    Decode a color image held in memory and prepare it for resizing.
+
+    Like '_read_image_scaled' for an encoded image held in memory.
+
+    Arguments
+    ---------
+    source : bytes-like or file object
+        Encoded image, see '_image_buffer'
+    scale : float or None
+        Scale factor to resize image as fraction, see '_resize'
+
+    Returns
+    -------
+    bgr_image : array, shape = (H, W, c)
+        BGR image as array, possibly resized already
+    scale : float or None
+        Scale factor still to be applied to 'bgr_image'; None if it is
+        resized already
+
+    Raises
+    ------
+    TypeError : if 'source' is neither bytes-like nor a file object
+    ValueError : if 'source' could not be decoded as an image
+    """
+    buffer = _image_buffer(source)
+    bgr_image = _decode_reduced(buffer, scale)
+    if bgr_image is not None:
+        return bgr_image, None
+    return _decode_image(buffer), scale
+
+
+def _write_image(image, imagefile, outfile, suffix):
+    """
+    Save a transformed image to file.
+
+    Arguments
+    ---------
+    image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array
+    imagefile : str
+        Image filename (with path included) of the original image
+    outfile : str or None
+        Image filename (with path included) of the new image. Keyword 'auto'
+        will save the new image in the same destination as the original with
+        the transformation added to the original filename. Nothing is saved
+        if None.
+    suffix : str
+        Transformation added to the original filename, e.g. '_grayscale'
+
+    Returns
+    -------
+    outfile : str or None
+        Image filename of the saved image, None if nothing was saved
+
+    Raises
+    ------
+    OSError : if the image could not be written to 'outfile'
+    """
+    if outfile is None:
+        return None
+
+    if outfile == "auto":
+        filename, file_extension = os.path.splitext(imagefile)
+        outfile = filename + suffix + file_extension
+    if not cv2.imwrite(outfile, image):
+        raise OSError(f"Could not write image {outfile!r}")
+
+    return outfile
+
+
+def _resize(bgr_image, scale):
+    """
+    Up/downscale image but preserve aspect ratio.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to resize as array
+    scale : float or None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles. The image is returned as is if None.
+
+    Returns
+    -------
+    bgr_image : array, shape = (H * scale, W * scale, c)
+        Resized image as array
+
+    Raises
+    ------
+    ValueError : if 'scale' is not larger than 0
+    """
+    if scale is None:
+        return bgr_image
+    if not scale > 0:
+        raise ValueError("'scale' must be a float larger than 0")
+
+    width = int(bgr_image.shape[1] * scale)
+    height = int(bgr_image.shape[0] * scale)
+    dim = (width, height)
+    return cv2.resize(bgr_image, dim, interpolation=cv2.INTER_AREA)
+
+
+def _area_factors(bgr_image, scale):
+    """
+    Integer factors of a downscale that averages blocks of pixels.
+
+    Downscaling by integer factors with INTER_AREA turns every block of
+    'fy' x 'fx' pixels into its mean. Such a resize is fused into the color
+    kernel of the compiled implementations instead of running '_resize' into
+    an intermediate image. Halving (2x2 blocks) is left to '_resize', as
+    OpenCV's vectorized halving plus the color kernel is faster. Factors are
+    limited to 16, which covers thumbnails down to a scale of 1/16 and keeps
+    the block sums of a column of pixels within uint16.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to resize as array
+    scale : float or None
+        Scale factor to resize image as fraction, see '_resize'
+
+    Returns
+    -------
+    factors : tuple of int or None
+        Factors (fy, fx) the image rows and columns are downscaled by. None
+        if the resize should be done by '_resize'.
+    """
+    if scale is None or not 0 < scale < 1:
+        return None
+
+    H, W = bgr_image.shape[:2]
+    height = int(H * scale)
+    width = int(W * scale)
+    if height == 0 or width == 0 or H % height or W % width:
+        return None
+
+    fy, fx = H // height, W // width
+    if fy * fx <= 4 or max(fy, fx) > _MAX_AREA_FACTOR:
+        return None
+    return fy, fx
+
+
+@lru_cache(maxsize=16)
+def _area_means(fy, fx):
+    """
+    Means of blocks of 'fy' x 'fx' uint8 values indexed by the block sum.
+
+    The means are rounded exactly like cv2.resize with INTER_AREA for
+    integer downscaling: 2x2 blocks in integer arithmetic, all other blocks
+    as the single-precision product of the sum and the inverse block area,
+    rounded half to even. Indexing the table replaces the rounding in the
+    kernels.
+
+    Arguments
+    ---------
+    fy, fx : int
+        Block height and width
+
+    Returns
+    -------
+    means : array, shape = (255 * fy * fx + 1,)
+        uint8 mean of every possible block sum
+    """
+    area = fy * fx
+    totals = np.arange(255 * area + 1)
+    if fy == 2 and fx == 2:
+        means = (totals + 2) >> 2
+    else:
+        inverse_area = np.float32(1) / np.float32(area)
+        means = np.rint(totals.astype(np.float32) * inverse_area)
+    return means.astype(np.uint8)
+
+
+def _check_sepia_amount(sepia_amount):
+    """
+    Validate the amount of sepia effect.
+
+    Arguments
+    ---------
+    sepia_amount : float
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+
+    Raises
+    ------
+    ValueError : if 'sepia_amount' is not a float between 0 and 1
+    """
+    if not 0.0 <= sepia_amount <= 1.0:
+        raise ValueError(
+            "'sepia_amount' must be a float between 0 (no sepia effect) and 1 (full sepia effect)")
+
+
+def _num_threads(num_threads=None):
+    """
+    Number of threads used by the multithreaded implementations.
+
+    Arguments
+    ---------
+    num_threads : int, optional, default None
+        Number of threads. Defaults to the environment variable
+        'INSTAPY_NUM_THREADS' if set, otherwise the number of CPUs.
+
+    Returns
+    -------
+    num_threads : int
+        Number of threads
+
+    Raises
+    ------
+    ValueError : if the number of threads is not a positive integer
+    """
+    if num_threads is None:
+        num_threads = os.environ.get("INSTAPY_NUM_THREADS") or os.cpu_count() or 1
+    num_threads = int(num_threads)
+    if num_threads < 1:
+        raise ValueError("'num_threads' must be a positive integer")
+    return num_threads
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ._auto import _calibration
+from ._stages import _run_stages
+from ._utils import _read_image_scaled, _write_image
+from .filters import grayscale_array, grayscale_image, sepia_array, sepia_image
+
+_filter_funcs = {"grayscale": grayscale_image, "sepia": sepia_image}
+_array_funcs = {"grayscale": grayscale_array, "sepia": sepia_array}
+_filter_suffixes = {"grayscale": "_grayscale", "sepia": "_sepia"}
+_image_extensions = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp")
+
+
+def collect_images(source):
+    """
+    Collect image filenames from files, glob patterns and directories.
+
+    Arguments
+    ---------
+    source : str or list of str
+        Image filename, glob pattern (e.g. 'images/*.jpg') or directory, or a
+        list of these. Directories are searched (non-recursively) for files
+        with a common image file extension.
+
+    Returns
+    -------
+    imagefiles : list of str
+        Sorted image filenames without duplicates
+    """
+    if isinstance(source, str):
+        source = [source]
+
+    imagefiles = []
+    for entry in source:
+        if os.path.isdir(entry):
+            imagefiles.extend(os.path.join(entry, name)
+                              for name in os.listdir(entry)
+                              if name.lower().endswith(_image_extensions))
+        elif glob.has_magic(entry):
+            imagefiles.extend(glob.glob(entry))
+        else:
+            imagefiles.append(entry)
+
+    return sorted(set(imagefiles))
+
+
+def _outfile(imagefile, filter_name, outdir):
+    """
+    Construct the filename of a filtered image.
+
+    Arguments
+    ---------
+    imagefile : str
+        Image filename (with path included) of the original image
+    filter_name : str
+        Name of the filter; either "grayscale" or "sepia"
+    outdir : str or None
+        Directory to save the new image in. The new image is saved in the
+        same destination as the original if None.
+
+    Returns
+    -------
+    outfile : str
+        Image filename (with path included) of the new image
+    """
+    if outdir is None:
+        outdir = os.path.dirname(imagefile)
+    filename, file_extension = os.path.splitext(os.path.basename(imagefile))
+    return os.path.join(outdir, filename + _filter_suffixes[filter_name] +
+                        file_extension)
+
+
+def _outfiles(imagefiles, filter_name, outdir, failures):
+    """
+    Construct the filenames of the filtered images of a batch.
+
+    Images whose new filenames collide with the new filename of a previous
+    image in the batch are added to 'failures' and skipped.
+
+    Arguments
+    ---------
+    imagefiles : list of str
+        Image filenames (with path included) of the original images
+    filter_name : str
+        Name of the filter; either "grayscale" or "sepia"
+    outdir : str or None
+        Directory to save the new images in, see '_outfile'
+    failures : dict
+        Raised exception keyed by original image filename, updated in place
+
+    Returns
+    -------
+    outfiles : dict
+        Image filename of the new image keyed by original image filename
+    """
+    outfiles = {}
+    originals = {}
+    for imagefile in imagefiles:
+        outfile = _outfile(imagefile, filter_name, outdir)
+        key = os.path.normcase(os.path.abspath(outfile))
+        if key in originals:
+            failures[imagefile] = FileExistsError(
+                f"Output {outfile!r} is already written for {originals[key]!r}")
+            continue
+        originals[key] = imagefile
+        outfiles[imagefile] = outfile
+    return outfiles
+
+
+def _check_batch(filter_name, outdir, kwargs):
+    """
+    Validate the filter of a batch and prepare its output directory.
+
+    Raises
+    ------
+    ValueError : if 'filter_name' is not one of ['grayscale', 'sepia']
+    """
+    if filter_name not in _filter_funcs:
+        raise ValueError(f"'filter_name' must be one of {list(_filter_funcs)}")
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+    if kwargs.get("method") == "auto":
+        # Calibrate once up front, rather than in every worker at the same
+        # time; the workers read the calibration from the cache
+        _calibration()
+
+
+def _filter_file(imagefile, filter_name, outfile, kwargs):
+    """
+    Decode, filter and encode a single image. Run in the worker processes.
+
+    Returns
+    -------
+    outfile : str
+        Image filename (with path included) of the saved image
+    """
+    _filter_funcs[filter_name](imagefile, outfile, **kwargs)
+    return outfile
+
+
+def batch_filter(source, filter_name="grayscale", outdir=None,
+                 max_workers=None, **kwargs):
+    """
+    Apply an image filter to many images in parallel.
+
+    Every image is read, filtered and saved in a separate worker process of
+    a process pool. An image that fails does not stop the batch; the error
+    is reported together with the offending filename instead. Images whose
+    new filenames collide with the new filename of a previous image in the
+    batch, e.g. 'a/x.jpg' and 'b/x.jpg' with 'outdir' set, are reported as
+    failures and not filtered.
+
+    Arguments
+    ---------
+    source : str or list of str
+        Image filename, glob pattern or directory, or a list of these. See
+        'collect_images'.
+    filter_name : str, optional, default 'grayscale'
+        Filter to apply; either "grayscale" or "sepia"
+    outdir : str, optional, default None
+        Directory to save the new images in. By default the new images are
+        saved in the same destination as the originals with the
+        transformation added to the original filenames.
+    max_workers : int, optional, default None
+        Number of worker processes. Defaults to the number of CPUs.
+    **kwargs
+        Keyword arguments passed along to the filter, e.g. 'scale',
+        'sepia_amount' and 'method'
+
+    Returns
+    -------
+    results : dict
+        Image filename of the saved image keyed by original image filename
+        for every image that was filtered successfully
+    failures : dict
+        Raised exception keyed by original image filename for every image
+        that failed
+
+    Raises
+    ------
+    ValueError : if 'filter_name' is not one of ['grayscale', 'sepia']
+    """
+    _check_batch(filter_name, outdir, kwargs)
+    imagefiles = collect_images(source)
+
+    results = {}
+    failures = {}
+    outfiles = _outfiles(imagefiles, filter_name, outdir, failures)
+    # Worker processes are spawned rather than forked, as forking a process
+    # whose Numba or OpenMP thread pool is already running may deadlock
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=mp_context) as executor:
+        futures = {}
+        for imagefile, outfile in outfiles.items():
+            future = executor.submit(_filter_file, imagefile, filter_name,
+                                     outfile, kwargs)
+            futures[future] = imagefile
+
+        for future in as_completed(futures):
+            imagefile = futures[future]
+            try:
+                results[imagefile] = future.result()
+            except Exception as error:
+                failures[imagefile] = error
+
+    return results, failures
+
+
+def pipelined_filter(source, filter_name="grayscale", outdir=None,
+                     queue_size=8, **kwargs):
+    """
+    Apply an image filter to many images with overlapping I/O and filtering.
+
+    The images are read in a reader thread, filtered in the calling thread
+    and saved in a writer thread, connected by bounded queues. OpenCV
+    releases the GIL while reading, decoding, encoding and writing images,
+    as do the compiled kernels, so that disk and codec time hide behind
+    filtering in a single process. This suits storage with high latency,
+    e.g. network-attached storage, and multithreaded implementations such as
+    "numba-parallel", which keep the CPUs busy while the next image is read.
+    Failures are reported like in 'batch_filter'.
+
+    Arguments
+    ---------
+    source : str or list of str
+        Image filename, glob pattern or directory, or a list of these. See
+        'collect_images'.
+    filter_name : str, optional, default 'grayscale'
+        Filter to apply; either "grayscale" or "sepia"
+    outdir : str, optional, default None
+        Directory to save the new images in. By default the new images are
+        saved in the same destination as the originals with the
+        transformation added to the original filenames.
+    queue_size : int, optional, default 8
+        Maximum number of images waiting between two stages
+    **kwargs
+        Keyword arguments passed along to the filter, e.g. 'scale',
+        'sepia_amount', 'method' and 'num_threads'
+
+    Returns
+    -------
+    results : dict
+        Image filename of the saved image keyed by original image filename
+        for every image that was filtered successfully
+    failures : dict
+        Raised exception keyed by original image filename for every image
+        that failed
+
+    Raises
+    ------
+    ValueError : if 'filter_name' is not one of ['grayscale', 'sepia']
+    ValueError : if 'queue_size' is not a positive integer
+    """
+    _check_batch(filter_name, outdir, kwargs)
+    imagefiles = collect_images(source)
+
+    results = {}
+    failures = {}
+    outfiles = _outfiles(imagefiles, filter_name, outdir, failures)
+    func = _array_funcs[filter_name]
+
+    # Errors of single images travel through the stages with the image, as
+    # an exception raised by a stage would stop the whole batch
+    def read():
+        for imagefile in outfiles:
+            try:
+                image, scale = _read_image_scaled(imagefile,
+                                                  kwargs.get("scale"))
+                yield imagefile, image, scale, None
+            except Exception as error:
+                yield imagefile, None, None, error
+
+    def transform(item):
+        imagefile, image, scale, error = item
+        if error is None:
+            try:
+                image = func(image, **{**kwargs, "scale": scale})
+            except Exception as filter_error:
+                image, error = None, filter_error
+        return imagefile, image, error
+
+    def write(item):
+        imagefile, image, error = item
+        if error is None:
+            try:
+                results[imagefile] = _write_image(image, imagefile,
+                                                  outfiles[imagefile], "")
+                return
+            except Exception as write_error:
+                error = write_error
+        failures[imagefile] = error
+
+    _run_stages(read(), transform, write, queue_size=queue_size)
+
+    return results, failures
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import math
+import os
+import platform
+import sys
+
+import cv2
+import numba
+import numpy as np
+
+from ._timing import run_times
+from .filters import (_grayscale_funcs, grayscale_array, sepia_array,
+                      set_planar_layout)
+
+_filter_funcs = {"grayscale": grayscale_array, "sepia": sepia_array}
+
+# The pure Python implementation takes seconds per image and is only
+# benchmarked on request
+_default_methods = [method for method in _grayscale_funcs
+                    if method != "python"]
+
+# Layouts of the three-channel Numba and Cython kernels, see
+# 'instapy.filters.set_planar_layout'. None benchmarks the default layouts
+_layouts = {None: None, "planar": True, "interleaved": False}
+
+# Percentiles of the run times stored for every benchmark
+_percentiles = {"p5": 5, "p25": 25, "median": 50, "p75": 75, "p95": 95}
+
+# Columns of the CSV report. The individual run times are only stored in
+# the JSON report
+_csv_fields = ["filter", "method", "height", "width", "scale",
+               "sepia_amount", "layout", "repeats", "min", "p5", "p25",
+               "median", "p75", "p95", "max", "mean"]
+
+
+def host_info():
+    """
+    Description of the host and software the benchmarks are run with.
+
+    Returns
+    -------
+    host_info : dict
+        Host name, platform, number of CPUs and versions of Python, NumPy,
+        Numba and OpenCV
+    """
+    return {"host": platform.node(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpu_count": os.cpu_count(),
+            "python": platform.python_version(), "numpy": np.__version__,
+            "numba": numba.__version__, "opencv": cv2.__version__}
+
+
+def run_benchmarks(methods=None, filters=("grayscale", "sepia"),
+                   shapes=((256, 256), (1024, 1024)), scales=(None,),
+                   sepia_amounts=(1.0,), layouts=(None,), n_warmup=1,
+                   n_repeats=10, num_threads=None, seed=2020):
+    """
+    Benchmark the in-memory image filters of every implementation.
+
+    Every combination of method, filter, image shape, scale, (for the sepia
+    filter) sepia amount and kernel layout is benchmarked on a random image.
+    The filter is called 'n_warmup' times before 'n_repeats' timed calls, so
+    that JIT compilation, thread pool start-up and cold caches are not
+    measured.
+
+    Arguments
+    ---------
+    methods : list of str, optional, default None
+        Implementations to benchmark. Defaults to all but "python".
+    filters : list of str, optional, default ('grayscale', 'sepia')
+        Filters to benchmark
+    shapes : list of tuple of int, optional, default ((256, 256), (1024, 1024))
+        Image shapes (H, W) to benchmark
+    scales : list of float or None, optional, default (None,)
+        Scale factors to resize images by, None to keep the size
+    sepia_amounts : list of float, optional, default (1.0,)
+        Amounts of sepia effect to benchmark the sepia filter with
+    layouts : list of str or None, optional, default (None,)
+        Layouts of the three-channel Numba and Cython kernels, "planar" or
+        "interleaved", None for the default layouts, see
+        'instapy.filters.set_planar_layout'
+    n_warmup : int, optional, default 1
+        Number of untimed calls before timing
+    n_repeats : int, optional, default 10
+        Number of timed calls
+    num_threads : int, optional, default None
+        Number of threads of the multithreaded implementations
+    seed : int, optional, default 2020
+        Seed of the random images
+
+    Returns
+    -------
+    results : list of dict
+        One record per benchmark with its parameters, the minimum, maximum,
+        mean and percentiles (p5, p25, median, p75, p95) of the run times in
+        seconds, and the individual run times
+
+    Raises
+    ------
+    ValueError : if a filter is not one of ['grayscale', 'sepia']
+    ValueError : if a layout is not one of [None, 'planar', 'interleaved']
+    ValueError : if 'n_repeats' is not a positive integer
+    """
+    if methods is None:
+        methods = _default_methods
+    for filter_name in filters:
+        if filter_name not in _filter_funcs:
+            raise ValueError(
+                f"'filters' must be a subset of {list(_filter_funcs)}")
+    for layout in layouts:
+        if layout not in _layouts:
+            raise ValueError(
+                f"'layouts' must be a subset of {list(_layouts)}")
+    if not n_repeats >= 1:
+        raise ValueError("'n_repeats' must be a positive integer")
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for height, width in shapes:
+        bgr_image = rng.integers(0, 256, size=(height, width, 3),
+                                 dtype=np.uint8)
+        for filter_name in filters:
+            amounts = sepia_amounts if filter_name == "sepia" else (None,)
+            for method in methods:
+                for scale in scales:
+                    for sepia_amount in amounts:
+                        kwargs = {"scale": scale, "method": method,
+                                  "num_threads": num_threads}
+                        if sepia_amount is not None:
+                            kwargs["sepia_amount"] = sepia_amount
+                        func = _filter_funcs[filter_name]
+                        for layout in layouts:
+                            set_planar_layout(_layouts[layout])
+                            try:
+                                for _ in range(n_warmup):
+                                    func(bgr_image, **kwargs)
+                                times = run_times(n_repeats, func, bgr_image,
+                                                  **kwargs)
+                            finally:
+                                set_planar_layout()
+                            results.append(_record(
+                                filter_name, method, height, width, scale,
+                                sepia_amount, layout, times))
+
+    return results
+
+
+def _record(filter_name, method, height, width, scale, sepia_amount, layout,
+            times):
+    """
+    Summarize the run times of one benchmark.
+
+    Returns
+    -------
+    record : dict
+        Parameters and run time statistics of the benchmark, see
+        'run_benchmarks'
+    """
+    record = {"filter": filter_name, "method": method, "height": height,
+              "width": width, "scale": scale, "sepia_amount": sepia_amount,
+              "layout": layout, "repeats": len(times),
+              "min": float(np.min(times))}
+    for name, q in _percentiles.items():
+        record[name] = float(np.percentile(times, q))
+    record["max"] = float(np.max(times))
+    record["mean"] = float(np.mean(times))
+    record["run_times"] = [float(t) for t in times]
+    return record
+
+
+def write_json(results, filename):
+    """
+    Write benchmark results with a description of the host to a JSON file.
+
+    Arguments
+    ---------
+    results : list of dict
+        Benchmark records as returned by 'run_benchmarks'
+    filename : str
+        Filename (with path included) of the JSON report
+    """
+    with open(filename, "w") as f:
+        json.dump({"host_info": host_info(), "results": results}, f,
+                  indent=2)
+
+
+def read_json(filename):
+    """
+    Read benchmark results from a JSON file written by 'write_json'.
+
+    Arguments
+    ---------
+    filename : str
+        Filename (with path included) of the JSON report
+
+    Returns
+    -------
+    results : list of dict
+        Benchmark records
+    host_info : dict
+        Description of the host the benchmarks were run on
+    """
+    with open(filename) as f:
+        report = json.load(f)
+    return report["results"], report["host_info"]
+
+
+def write_csv(results, filename):
+    """
+    Write benchmark results to a CSV file with one row per benchmark.
+
+    Arguments
+    ---------
+    results : list of dict
+        Benchmark records as returned by 'run_benchmarks'
+    filename : str
+        Filename (with path included) of the CSV report, or "-" for stdout
+    """
+    f = sys.stdout if filename == "-" else open(filename, "w", newline="")
+    try:
+        writer = csv.DictWriter(f, fieldnames=_csv_fields,
+                                extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def _key(record):
+    """
+    Parameters identifying a benchmark record.
+    """
+    # Reports written before the layout was recorded used the defaults
+    return (record["filter"], record["method"], record["height"],
+            record["width"], record["scale"], record["sepia_amount"],
+            record.get("layout"))
+
+
+def baseline_grid(baseline):
+    """
+    Benchmark parameters of the records of a baseline.
+
+    Arguments
+    ---------
+    baseline : list of dict
+        Benchmark records, e.g. as returned by 'read_json'
+
+    Returns
+    -------
+    grid : dict
+        Keyword arguments 'methods', 'filters', 'shapes', 'scales',
+        'sepia_amounts' and 'layouts' of 'run_benchmarks' covering the
+        baseline
+    """
+    def unique(values):
+        return list(dict.fromkeys(values))
+
+    return {"methods": unique(r["method"] for r in baseline),
+            "filters": unique(r["filter"] for r in baseline),
+            "shapes": unique((r["height"], r["width"]) for r in baseline),
+            "scales": unique(r["scale"] for r in baseline),
+            "sepia_amounts": unique(r["sepia_amount"] for r in baseline
+                                    if r["sepia_amount"] is not None) or [1.0],
+            "layouts": unique(r.get("layout") for r in baseline)}
+
+
+def _mann_whitney(x, y):
+    """
+    One-sided Mann-Whitney U test that the values of 'x' tend to be larger
+    than the values of 'y'.
+
+    The p-value is computed with the normal approximation of the U
+    statistic, corrected for ties and continuity, which is accurate for the
+    10 or more run times per benchmark of a typical report.
+
+    Arguments
+    ---------
+    x, y : array
+        Samples to compare
+
+    Returns
+    -------
+    p_value : float
+        Probability of a U statistic at least as large if 'x' and 'y' come
+        from the same distribution
+    """
+    n1, n2 = len(x), len(y)
+    n = n1 + n2
+    _, inverse, counts = np.unique(np.concatenate([x, y]),
+                                   return_inverse=True, return_counts=True)
+    # Tied values share the average of their ranks
+    ranks = (np.cumsum(counts) - (counts - 1) / 2)[inverse]
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+
+    ties = np.sum(counts ** 3 - counts) / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - ties))
+    if sigma == 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare(results, baseline, threshold=0.1, alpha=0.05):
+    """
+    Compare benchmark results with a baseline to detect regressions.
+
+    A benchmark has regressed if its run times are significantly larger than
+    the baseline run times slowed down by 'threshold', according to a
+    one-sided Mann-Whitney U test. A single slow run, or a slowdown within
+    the threshold, is therefore not flagged. 'alpha' is the significance
+    level of the whole comparison; it is divided by the number of compared
+    benchmarks (Bonferroni correction), so that comparing many benchmarks
+    does not raise false alarms. Benchmarks without a counterpart in the
+    baseline are left out.
+
+    Arguments
+    ---------
+    results : list of dict
+        Benchmark records as returned by 'run_benchmarks'
+    baseline : list of dict
+        Benchmark records of the baseline, e.g. as returned by 'read_json'
+    threshold : float, optional, default 0.1
+        Tolerated relative slowdown, e.g. 0.1 for 10%
+    alpha : float, optional, default 0.05
+        Family-wise significance level of the tests
+
+    Returns
+    -------
+    comparisons : list of dict
+        One record per benchmark with its parameters, the baseline and
+        current median run times, their ratio, the p-value and whether the
+        benchmark has regressed
+
+    Raises
+    ------
+    ValueError : if 'threshold' is negative or 'alpha' not between 0 and 1
+    """
+    if not threshold >= 0:
+        raise ValueError("'threshold' must be a non-negative float")
+    if not 0 < alpha < 1:
+        raise ValueError("'alpha' must be a float between 0 and 1")
+
+    baseline = {_key(record): record for record in baseline}
+    pairs = [(record, baseline[_key(record)]) for record in results
+             if _key(record) in baseline]
+    comparisons = []
+    for record, reference in pairs:
+        tolerated = np.asarray(reference["run_times"]) * (1 + threshold)
+        p_value = _mann_whitney(np.asarray(record["run_times"]), tolerated)
+        comparison = {name: record.get(name) for name in _csv_fields[:7]}
+        comparison.update(baseline_median=reference["median"],
+                          median=record["median"],
+                          ratio=record["median"] / reference["median"],
+                          p_value=p_value,
+                          regressed=p_value < alpha / len(pairs))
+        comparisons.append(comparison)
+
+    return comparisons
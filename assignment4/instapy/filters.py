@@ -1,19 +1,508 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-import cv2
-import numba
 import numpy as np
 
-from ._cython import _cython_color2gray, _cython_color2sepia
-from ._numba import _numba_color2gray, _numba_color2sepia
-from ._numpy import _numpy_color2gray, _numpy_color2sepia
-from ._python import _python_color2gray, _python_color2sepia
+from . import _cython, _numba
+from ._auto import _auto_method
+from ._cache import _cache_key, _ResultCache
+from ._cython import (_cython_color2gray, _cython_color2sepia,
+                      _cython_color_matrix, _cython_parallel_color2gray,
+                      _cython_parallel_color2sepia,
+                      _cython_parallel_color_matrix)
+from ._fixed import (_fixed_color2gray, _fixed_color2sepia,
+                     _fixed_color_matrix)
+from ._lut import _lut_color2gray, _lut_color2sepia, _lut_color_matrix
+from ._numba import (_numba_color2gray, _numba_color2sepia,
+                     _numba_color_matrix, _numba_parallel_color2gray,
+                     _numba_parallel_color2sepia, _numba_parallel_color_matrix)
+from ._numpy import _numpy_color2gray, _numpy_color2sepia, _numpy_color_matrix
+from ._python import (_python_color2gray, _python_color2sepia,
+                      _python_color_matrix)
+from ._utils import (_GRAYSCALE_MATRIX, _cache_dir, _check_color_matrix,
+                     _check_sepia_amount, _decode_image_scaled,
+                     _encode_image, _encode_params, _image_buffer,
+                     _num_threads, _read_file, _read_image_scaled,
+                     _sepia_matrix, _write_image)
 
+_grayscale_funcs = {"python": _python_color2gray, "numpy": _numpy_color2gray,
+                    "numba": _numba_color2gray,
+                    "numba-parallel": _numba_parallel_color2gray,
+                    "cython": _cython_color2gray,
+                    "cython-parallel": _cython_parallel_color2gray,
+                    "lut": _lut_color2gray, "fixed": _fixed_color2gray}
+_sepia_funcs = {"python": _python_color2sepia, "numpy": _numpy_color2sepia,
+                "numba": _numba_color2sepia,
+                "numba-parallel": _numba_parallel_color2sepia,
+                "cython": _cython_color2sepia,
+                "cython-parallel": _cython_parallel_color2sepia,
+                "lut": _lut_color2sepia, "fixed": _fixed_color2sepia}
+_color_matrix_funcs = {"python": _python_color_matrix,
+                       "numpy": _numpy_color_matrix,
+                       "numba": _numba_color_matrix,
+                       "numba-parallel": _numba_parallel_color_matrix,
+                       "cython": _cython_color_matrix,
+                       "cython-parallel": _cython_parallel_color_matrix,
+                       "lut": _lut_color_matrix,
+                       "fixed": _fixed_color_matrix}
 
-def grayscale_image(imagefile, outfile=None, scale=None, method="numpy"):
+# Multithreaded implementations accept the number of threads
+_threaded_methods = ["numba-parallel", "cython-parallel"]
+
+# Default size in bytes of the input row bands of the tiled filters
+_BAND_BYTES = 64 * 2**20
+
+# Executor of the async filters, created on first use, see
+# 'set_async_workers'
+_async_executor = None
+_async_lock = threading.Lock()
+
+# Cache of filtered images, disabled by default, see 'set_result_cache'
+_result_cache = None
+
+
+def _get_func(func_dict, method):
+    """
+    Look up the implementation of a filter.
+
+    Arguments
+    ---------
+    func_dict : dict
+        Filter implementations keyed by method name
+    method : str
+        Implementation to use
+
+    Returns
+    -------
+    func : object
+        Function object of the implementation
+
+    Raises
+    ------
+    ValueError : if 'method' is not a key of 'func_dict' or "auto"
+    """
+    if method not in func_dict:
+        raise ValueError(
+            f"'method' must be one of {list(func_dict) + ['auto']}")
+    return func_dict[method]
+
+
+def _resolve_method(method, filter_name, bgr_image):
+    """
+    Replace method "auto" by the fastest implementation for an image.
+
+    Arguments
+    ---------
+    method : str
+        Implementation to use
+    filter_name : str
+        Name of the filter; either "grayscale" or "sepia"
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+
+    Returns
+    -------
+    method : str
+        'method', or the fastest implementation on this host for the size of
+        'bgr_image' if 'method' is "auto". The first use of "auto" on a host
+        calibrates the implementations, see 'instapy._auto'.
+    """
+    if method == "auto":
+        return _auto_method(filter_name, bgr_image.shape)
+    return method
+
+
+def _thread_kwargs(method, num_threads):
+    """
+    Keyword arguments controlling the threads of an implementation.
+
+    Arguments
+    ---------
+    method : str
+        Implementation to use
+    num_threads : int or None
+        Number of threads
+
+    Returns
+    -------
+    kwargs : dict
+        {'num_threads': num_threads} for multithreaded implementations,
+        otherwise empty
+    """
+    if method in _threaded_methods:
+        return {"num_threads": num_threads}
+    return {}
+
+
+def _cached(cache, buffer, params, method, func_dict, compute):
+    """
+    Look up a filtered image in the result cache, or compute and store it.
+
+    Arguments
+    ---------
+    cache : _ResultCache or None
+        Result cache, see 'set_result_cache'. None computes the image.
+    buffer : array, shape = (n,) or None
+        Encoded source image as uint8 array; None if 'cache' is None
+    params : tuple
+        Filter name and every other parameter the filtered image depends on
+    method : str
+        Implementation to use. All implementations but "fixed" give
+        identical images, so they share cached images.
+    func_dict : dict
+        Filter implementations keyed by method name
+    compute : callable
+        Function without arguments returning the filtered image
+
+    Returns
+    -------
+    result : array or bytes
+        Filtered image, from the cache if it holds an image for the source
+        bytes and 'params'
+
+    Raises
+    ------
+    ValueError : if 'method' is not a key of 'func_dict' or "auto"
+    """
+    if cache is None:
+        return compute()
+    if method != "auto":
+        _get_func(func_dict, method)
+    key = _cache_key(buffer, (*params, method == "fixed"))
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.put(key, result)
+    return result
+
+
+def _check_out(out, bgr_image):
+    """
+    Reject an output array sharing memory with the image to transform.
+
+    The kernels read pixels of the image after writing others of the new
+    image, so the new image cannot be written over the image itself.
+
+    Arguments
+    ---------
+    out : array or None
+        Array to write the new image to
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array
+
+    Raises
+    ------
+    ValueError : if 'out' may share memory with 'bgr_image'
+    """
+    if out is not None and np.may_share_memory(out, bgr_image):
+        raise ValueError("'out' must not share memory with 'bgr_image'")
+
+
+def _load_source(source):
+    """
+    Memory map the source image of the tiled filters.
+
+    Arguments
+    ---------
+    source : str or array, shape = (H, W, c)
+        Filename of a NumPy .npy file with the BGR image, which is memory
+        mapped, or a (memory-mapped) uint8 array
+
+    Returns
+    -------
+    source : array, shape = (H, W, c)
+        (Memory-mapped) BGR image as uint8 array
+
+    Raises
+    ------
+    ValueError : if 'source' is not a uint8 array of shape (H, W, 3)
+    """
+    if isinstance(source, str):
+        source = np.load(source, mmap_mode="r")
+    if source.dtype != np.uint8 or source.ndim != 3 or source.shape[2] != 3:
+        raise ValueError("'source' must be a uint8 image of shape (H, W, 3)")
+    return source
+
+
+def _filter_bands(func, source, destination, channels, band_rows, kwargs):
+    """
+    Apply a filter implementation to an image in row bands.
+
+    Arguments
+    ---------
+    func : object
+        Function object of the implementation
+    source : array, shape = (H, W, c)
+        (Memory-mapped) BGR image as uint8 array, see '_load_source'
+    destination : str or array
+        Filename of the NumPy .npy file to create for the transformed image,
+        which is memory mapped, or a (memory-mapped) uint8 array of the
+        shape of the transformed image
+    channels : int or None
+        Number of channels of the transformed image, None for a 2D image
+    band_rows : int or None
+        Number of image rows per band. By default bands of about 64 MiB.
+    kwargs : dict
+        Keyword arguments passed along to the implementation
+
+    Returns
+    -------
+    new_image : array
+        Transformed image as (memory-mapped) array
+
+    Raises
+    ------
+    ValueError : if 'destination' does not have the shape of the result
+    ValueError : if 'band_rows' is not a positive integer
+    """
+    H, W = source.shape[:2]
+    shape = (H, W) if channels is None else (H, W, channels)
+    if isinstance(destination, str):
+        destination = np.lib.format.open_memmap(destination, mode="w+",
+                                                dtype=np.uint8, shape=shape)
+    elif destination.shape != shape:
+        raise ValueError(f"'destination' must have shape {shape}")
+
+    if band_rows is None:
+        band_rows = max(1, _BAND_BYTES // (W * 3))
+    if not band_rows >= 1:
+        raise ValueError("'band_rows' must be a positive integer")
+
+    # Only one input band and one output band are in memory at a time. The
+    # band is copied out of the read-only map, as the compiled kernels expect
+    # writable arrays, into a buffer reused for every band. A C-contiguous
+    # destination, such as a memory map, is written to directly
+    band = np.empty((min(band_rows, H),) + source.shape[1:], dtype=np.uint8)
+    direct = destination.flags.c_contiguous
+    for start in range(0, H, band_rows):
+        stop = min(start + band_rows, H)
+        bgr_band = band[:stop - start]
+        np.copyto(bgr_band, source[start:stop])
+        if direct:
+            func(bgr_band, out=destination[start:stop], **kwargs)
+        else:
+            destination[start:stop] = func(bgr_band, **kwargs)
+    if isinstance(destination, np.memmap):
+        destination.flush()
+
+    return destination
+
+
+def grayscale_array(bgr_image, scale=None, method="numpy", num_threads=None,
+                    out=None):
+    """
+    Grayscale image filter applied to an image already in memory.
+
+    Turn a colorful image of choice into a dramatic grayscale image with method
+    of choice. The new image can also be up/downscaled while preserving the
+    aspect ratio of the original. No file I/O is performed.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array, e.g. as returned by cv2.imread
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    method : str, optional, default 'numpy'
+        Choose implementation to use; either ["python", "numpy", "numba",
+        "numba-parallel", "cython", "cython-parallel", "lut", "fixed", "auto"].
+        "fixed" computes with integers and may differ by one from the others.
+        "auto" picks the implementation that is fastest on this host for the
+        image size, calibrated once per host.
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel".
+        Defaults to the environment variable 'INSTAPY_NUM_THREADS' if set,
+        otherwise the number of CPUs.
+    out : array, optional, default None
+        Array to write the new image to, e.g. the result of an earlier call
+        on an image of the same size; C-contiguous uint8 of the shape of the
+        new image. Defaults to a new array.
+
+    Returns
+    -------
+    grayscale_image : array, shape = (H, W)
+        Transformed image as array
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image, or shares memory with 'bgr_image'
+    """
+    method = _resolve_method(method, "grayscale", bgr_image)
+    func = _get_func(_grayscale_funcs, method)
+    _check_out(out, bgr_image)
+    return func(bgr_image, scale=scale, out=out,
+                **_thread_kwargs(method, num_threads))
+
+
+def sepia_array(bgr_image, scale=None, sepia_amount=1, method="numpy",
+                num_threads=None, out=None):
+    """
+    Sepia image filter applied to an image already in memory.
+
+    Turn a colorful image of choice into a nostalgic sepia image with method
+    of choice. The new image can also be up/downscaled while preserving the
+    aspect ratio of the original. No file I/O is performed.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array, e.g. as returned by cv2.imread
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    sepia_amount : float, optional, default 1.0
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    method : str, optional, default 'numpy'
+        Choose implementation to use; either ["python", "numpy", "numba",
+        "numba-parallel", "cython", "cython-parallel", "lut", "fixed", "auto"].
+        "fixed" computes with integers and may differ by one from the others.
+        "auto" picks the implementation that is fastest on this host for the
+        image size, calibrated once per host.
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel".
+        Defaults to the environment variable 'INSTAPY_NUM_THREADS' if set,
+        otherwise the number of CPUs.
+    out : array, optional, default None
+        Array to write the new image to, e.g. the result of an earlier call
+        on an image of the same size; C-contiguous uint8 of the shape of the
+        new image. Defaults to a new array.
+
+    Returns
+    -------
+    sepia_image : array, shape = (H, W, c)
+        Transformed image as array
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image, or shares memory with 'bgr_image'
+    """
+    method = _resolve_method(method, "sepia", bgr_image)
+    func = _get_func(_sepia_funcs, method)
+    _check_out(out, bgr_image)
+    return func(bgr_image, scale=scale, sepia_amount=sepia_amount, out=out,
+                **_thread_kwargs(method, num_threads))
+
+
+def grayscale_matrix():
+    """
+    Color matrix of the grayscale filter.
+
+    Returns
+    -------
+    grayscale_matrix : array, shape = (1, 3)
+        Weights of the B, G and R channels of a pixel, for use with
+        'color_matrix_array' and 'color_matrix_image'
+    """
+    return _GRAYSCALE_MATRIX.copy()
+
+
+def sepia_matrix(sepia_amount=1):
+    """
+    Color matrix of the sepia filter.
+
+    Arguments
+    ---------
+    sepia_amount : float, optional, default 1.0
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+
+    Returns
+    -------
+    sepia_matrix : array, shape = (3, 3)
+        Matrix mapping the B, G and R channels (columns) of a pixel to its new
+        B, G and R channels (rows), for use with 'color_matrix_array' and
+        'color_matrix_image'
+
+    Raises
+    ------
+    ValueError : if 'sepia_amount' is not a float between 0 and 1
+    """
+    _check_sepia_amount(sepia_amount)
+    return _sepia_matrix(sepia_amount)
+
+
+def color_matrix_array(bgr_image, matrix, bias=None, scale=None,
+                       method="numpy", num_threads=None, out=None):
+    """
+    Color matrix image filter applied to an image already in memory.
+
+    Map the B, G and R channels of every pixel to new channels with method of
+    choice: every new channel is the weighted sum of the B, G and R channels
+    plus a bias, clipped to [0, 255] and truncated to uint8. Custom tints and
+    channel mixers run on the same kernels as the grayscale and sepia
+    filters, which are presets of this filter, see 'grayscale_matrix' and
+    'sepia_matrix'. The new image can also be up/downscaled while preserving
+    the aspect ratio of the original. No file I/O is performed.
+
+    Arguments
+    ---------
+    bgr_image : array, shape = (H, W, c)
+        BGR image to transform as array, e.g. as returned by cv2.imread
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    method : str, optional, default 'numpy'
+        Choose implementation to use; either ["python", "numpy", "numba",
+        "numba-parallel", "cython", "cython-parallel", "lut", "fixed", "auto"].
+        "fixed" computes with integers and may differ by one from the others.
+        "auto" picks the implementation that is fastest on this host for the
+        image size, as calibrated for the grayscale (single-row matrix) or
+        sepia filter.
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel".
+        Defaults to the environment variable 'INSTAPY_NUM_THREADS' if set,
+        otherwise the number of CPUs.
+    out : array, optional, default None
+        Array to write the new image to, e.g. the result of an earlier call
+        on an image of the same size; C-contiguous uint8 of the shape of the
+        new image. Defaults to a new array.
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    ValueError : if 'matrix' does not have shape (3,), (1, 3) or (3, 3)
+    ValueError : if 'bias' does not have one value per new channel
+    ValueError : if 'matrix' or 'bias' are not finite
+    ValueError : if 'out' is not a C-contiguous uint8 array of the shape of
+                 the new image, or shares memory with 'bgr_image'
+    """
+    matrix, bias = _check_color_matrix(matrix, bias)
+    filter_name = "grayscale" if len(matrix) == 1 else "sepia"
+    method = _resolve_method(method, filter_name, bgr_image)
+    func = _get_func(_color_matrix_funcs, method)
+    _check_out(out, bgr_image)
+    return func(bgr_image, matrix, bias, scale=scale, out=out,
+                **_thread_kwargs(method, num_threads))
+
+
+def grayscale_image(imagefile, outfile=None, scale=None, method="numpy",
+                    num_threads=None):
     """
     Grayscale image filter.
 
@@ -34,9 +523,18 @@ def grayscale_image(imagefile, outfile=None, scale=None, method="numpy"):
         the original filename.
     scale : float, optional, default None
         Scale factor to resize image as fraction, e.g. 0.5 halves image
-        dimensions whereas 2 doubles
+        dimensions whereas 2 doubles. JPEG images downscaled by a factor of
+        two or more are decoded at 1/2, 1/4 or 1/8 of their size first.
     method : str, optional, default 'numpy'
-        Choose implementation to use; either ["python", "numpy", "numba", "cython"]
+        Choose implementation to use; either ["python", "numpy", "numba",
+        "numba-parallel", "cython", "cython-parallel", "lut", "fixed", "auto"].
+        "fixed" computes with integers and may differ by one from the others.
+        "auto" picks the implementation that is fastest on this host for the
+        image size, calibrated once per host.
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel".
+        Defaults to the environment variable 'INSTAPY_NUM_THREADS' if set,
+        otherwise the number of CPUs.
 
     Returns
     -------
@@ -45,21 +543,31 @@ def grayscale_image(imagefile, outfile=None, scale=None, method="numpy"):
 
     Raises
     ------
-    ValueError : if 'method' is not one of ['python', 'numpy', 'numba', 'cython']
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    FileNotFoundError : if 'imagefile' could not be read as an image
     """
-    allowed_methods = ["python", "numpy", "numba", "cython"]
-    func_dict = {"python": _python_color2gray, "numpy": _numpy_color2gray,
-                 "numba": _numba_color2gray, "cython": _cython_color2gray}
-    if method in allowed_methods:
-        grayscale_image = func_dict[method](imagefile, outfile, scale=scale)
-    else:
-        raise ValueError(
-            "'method' must be one of ['python', 'numpy', 'numba', 'cython']")
+    cache = _result_cache
+    buffer = None if cache is None else _read_file(imagefile)
+
+    def compute():
+        bgr_image, remaining_scale = _read_image_scaled(imagefile, scale,
+                                                        buffer)
+        resolved = _resolve_method(method, "grayscale", bgr_image)
+        func = _get_func(_grayscale_funcs, resolved)
+        return func(bgr_image, scale=remaining_scale,
+                    **_thread_kwargs(resolved, num_threads))
+
+    grayscale_image = _cached(cache, buffer, ("grayscale", scale), method,
+                              _grayscale_funcs, compute)
+    _write_image(grayscale_image, imagefile, outfile, "_grayscale")
 
     return grayscale_image
 
 
-def sepia_image(imagefile, outfile=None, scale=None, sepia_amount=1, method="numpy"):
+def sepia_image(imagefile, outfile=None, scale=None, sepia_amount=1, method="numpy",
+                num_threads=None):
     """
     Sepia image filter.
 
@@ -80,11 +588,20 @@ def sepia_image(imagefile, outfile=None, scale=None, sepia_amount=1, method="num
         the original filename.
     scale : float, optional, default None
         Scale factor to resize image as fraction, e.g. 0.5 halves image
-        dimensions whereas 2 doubles
+        dimensions whereas 2 doubles. JPEG images downscaled by a factor of
+        two or more are decoded at 1/2, 1/4 or 1/8 of their size first.
     sepia_amount : float, optional, default 1.0
         0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
     method : str, optional, default 'numpy'
-        Choose implementation to use; either ["python", "numpy", "numba", "cython"]
+        Choose implementation to use; either ["python", "numpy", "numba",
+        "numba-parallel", "cython", "cython-parallel", "lut", "fixed", "auto"].
+        "fixed" computes with integers and may differ by one from the others.
+        "auto" picks the implementation that is fastest on this host for the
+        image size, calibrated once per host.
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel".
+        Defaults to the environment variable 'INSTAPY_NUM_THREADS' if set,
+        otherwise the number of CPUs.
 
     Returns
     -------
@@ -93,16 +610,558 @@ def sepia_image(imagefile, outfile=None, scale=None, sepia_amount=1, method="num
 
     Raises
     ------
-    ValueError : if 'method' is not one of ['python', 'numpy', 'numba', 'cython']
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    FileNotFoundError : if 'imagefile' could not be read as an image
     """
-    allowed_methods = ["python", "numpy", "numba", "cython"]
-    func_dict = {"python": _python_color2sepia, "numpy": _numpy_color2sepia,
-                 "numba": _numba_color2sepia, "cython": _cython_color2sepia}
-    if method in allowed_methods:
-        sepia_image = func_dict[method](
-            imagefile, outfile, scale=scale, sepia_amount=sepia_amount)
-    else:
-        raise ValueError(
-            "'method' must be one of ['python', 'numpy', 'numba', 'cython']")
+    cache = _result_cache
+    buffer = None if cache is None else _read_file(imagefile)
+
+    def compute():
+        bgr_image, remaining_scale = _read_image_scaled(imagefile, scale,
+                                                        buffer)
+        resolved = _resolve_method(method, "sepia", bgr_image)
+        func = _get_func(_sepia_funcs, resolved)
+        return func(bgr_image, scale=remaining_scale,
+                    sepia_amount=sepia_amount,
+                    **_thread_kwargs(resolved, num_threads))
+
+    sepia_image = _cached(cache, buffer, ("sepia", scale, sepia_amount),
+                          method, _sepia_funcs, compute)
+    _write_image(sepia_image, imagefile, outfile, "_sepia")
 
     return sepia_image
+
+
+def color_matrix_image(imagefile, matrix, bias=None, outfile=None, scale=None,
+                       method="numpy", num_threads=None):
+    """
+    Color matrix image filter.
+
+    Map the B, G and R channels of every pixel to new channels with method of
+    choice, see 'color_matrix_array'. The new image can be saved to a
+    specified location. The new image can also be up/downscaled while
+    preserving the aspect ratio of the original.
+
+    Arguments
+    ---------
+    imagefile : str
+        Image filename (with path included) of image with shape (H, W, c) to
+        transform
+    matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+        Weights of the B, G and R channels (columns) for each new channel
+        (rows). A single row gives a single-channel image.
+    bias : float or array_like, shape = (c,), optional, default None
+        Offset added to each new channel. Defaults to no offset.
+    outfile : str, optional, default None
+        Image filename (with path included) if transformed image should be
+        saved. Keyword 'auto' will save the new image in the same destination
+        as the original with the transformation added to the original
+        filename.
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles. JPEG images downscaled by a factor of
+        two or more are decoded at 1/2, 1/4 or 1/8 of their size first.
+    method : str, optional, default 'numpy'
+        Choose implementation to use; either ["python", "numpy", "numba",
+        "numba-parallel", "cython", "cython-parallel", "lut", "fixed", "auto"].
+        "fixed" computes with integers and may differ by one from the others.
+        "auto" picks the implementation that is fastest on this host for the
+        image size, as calibrated for the grayscale (single-row matrix) or
+        sepia filter.
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel".
+        Defaults to the environment variable 'INSTAPY_NUM_THREADS' if set,
+        otherwise the number of CPUs.
+
+    Returns
+    -------
+    new_image : array, shape = (H, W) or (H, W, c)
+        Transformed image as array; 2D for a single-row matrix
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    ValueError : if 'matrix' or 'bias' are invalid, see 'color_matrix_array'
+    FileNotFoundError : if 'imagefile' could not be read as an image
+    """
+    bgr_image, scale = _read_image_scaled(imagefile, scale)
+    new_image = color_matrix_array(bgr_image, matrix, bias, scale=scale,
+                                   method=method, num_threads=num_threads)
+    _write_image(new_image, imagefile, outfile, "_color_matrix")
+
+    return new_image
+
+
+def grayscale_bytes(source, ext=".png", scale=None, method="numpy",
+                    num_threads=None, quality=None, compression=None):
+    """
+    Grayscale image filter for encoded images held in memory.
+
+    Turn a colorful image of choice into a dramatic grayscale image with method
+    of choice. The image is decoded from and the new image encoded to memory
+    with cv2.imdecode and cv2.imencode, e.g. for uploads, so that no file is
+    written or read back.
+
+    Arguments
+    ---------
+    source : bytes-like or file object
+        Encoded image with shape (H, W, c) to transform, e.g. the contents of
+        a JPEG file as bytes, bytearray, memoryview or another object
+        supporting the buffer protocol (read without copying), or a binary
+        file object such as io.BytesIO
+    ext : str, optional, default '.png'
+        File extension of the format to encode the new image in, e.g. '.jpg',
+        '.png' or '.webp'
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles. JPEG images downscaled by a factor of
+        two or more are decoded at 1/2, 1/4 or 1/8 of their size first.
+    method : str, optional, default 'numpy'
+        Choose implementation to use, see 'grayscale_image'
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel",
+        see 'grayscale_image'
+    quality : int, optional, default None
+        JPEG quality from 0 to 100 (OpenCV default 95), or WebP quality from
+        1 to 100 (OpenCV default lossless, as is above 100)
+    compression : int, optional, default None
+        PNG compression level from 0 (fastest) to 9 (smallest). OpenCV
+        defaults to 1.
+
+    Returns
+    -------
+    image_bytes : bytes
+        Encoded transformed image with shape (H, W)
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    TypeError : if 'source' is neither bytes-like nor a file object
+    ValueError : if 'source' could not be decoded as an image
+    ValueError : if the new image could not be encoded as 'ext'
+    ValueError : if 'quality' or 'compression' are invalid for 'ext'
+    """
+    # Invalid encoder settings fail before the image is filtered
+    _encode_params(ext, quality, compression)
+    buffer = _image_buffer(source)
+
+    def compute():
+        bgr_image, remaining_scale = _decode_image_scaled(buffer, scale)
+        grayscale_image = grayscale_array(bgr_image, scale=remaining_scale,
+                                          method=method,
+                                          num_threads=num_threads)
+        return _encode_image(grayscale_image, ext, quality, compression)
+
+    return _cached(_result_cache, buffer,
+                   ("grayscale", scale, ext, quality, compression), method,
+                   _grayscale_funcs, compute)
+
+
+def sepia_bytes(source, ext=".png", scale=None, sepia_amount=1,
+                method="numpy", num_threads=None, quality=None,
+                compression=None):
+    """
+    Sepia image filter for encoded images held in memory.
+
+    Turn a colorful image of choice into a nostalgic sepia image with method
+    of choice. The image is decoded from and the new image encoded to memory
+    with cv2.imdecode and cv2.imencode, e.g. for uploads, so that no file is
+    written or read back.
+
+    Arguments
+    ---------
+    source : bytes-like or file object
+        Encoded image with shape (H, W, c) to transform, see
+        'grayscale_bytes'
+    ext : str, optional, default '.png'
+        File extension of the format to encode the new image in, e.g. '.jpg',
+        '.png' or '.webp'
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles. JPEG images downscaled by a factor of
+        two or more are decoded at 1/2, 1/4 or 1/8 of their size first.
+    sepia_amount : float, optional, default 1.0
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    method : str, optional, default 'numpy'
+        Choose implementation to use, see 'sepia_image'
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel",
+        see 'sepia_image'
+    quality, compression : int, optional, default None
+        Quality of JPEG and WebP images and compression level of PNG images,
+        see 'grayscale_bytes'
+
+    Returns
+    -------
+    image_bytes : bytes
+        Encoded transformed image with shape (H, W, c)
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    ValueError : if 'sepia_amount' is not a float between 0 and 1
+    TypeError : if 'source' is neither bytes-like nor a file object
+    ValueError : if 'source' could not be decoded as an image
+    ValueError : if the new image could not be encoded as 'ext'
+    ValueError : if 'quality' or 'compression' are invalid for 'ext'
+    """
+    # Invalid encoder settings fail before the image is filtered
+    _encode_params(ext, quality, compression)
+    buffer = _image_buffer(source)
+
+    def compute():
+        bgr_image, remaining_scale = _decode_image_scaled(buffer, scale)
+        sepia_image = sepia_array(bgr_image, scale=remaining_scale,
+                                  sepia_amount=sepia_amount, method=method,
+                                  num_threads=num_threads)
+        return _encode_image(sepia_image, ext, quality, compression)
+
+    return _cached(_result_cache, buffer,
+                   ("sepia", scale, sepia_amount, ext, quality, compression),
+                   method, _sepia_funcs, compute)
+
+
+def grayscale_tiled(source, destination, method="numpy", num_threads=None,
+                    band_rows=None):
+    """
+    Grayscale image filter applied band by band to an image larger than RAM.
+
+    Turn a colorful image of choice into a dramatic grayscale image with method
+    of choice. The image is read from a memory-mapped source and the new image
+    is written to a memory-mapped destination in bands of rows, so that memory
+    use is bounded by the band size rather than the image size. Resizing is
+    not supported, as it would mix pixels across bands.
+
+    Arguments
+    ---------
+    source : str or array, shape = (H, W, c)
+        Filename of a NumPy .npy file with the BGR image, which is memory
+        mapped, or a uint8 array, e.g. np.memmap of raw BGR image data
+    destination : str or array, shape = (H, W)
+        Filename of the NumPy .npy file to create for the transformed image,
+        which is memory mapped, or a uint8 array to write it to
+    method : str, optional, default 'numpy'
+        Choose implementation to use; either ["python", "numpy", "numba",
+        "numba-parallel", "cython", "cython-parallel", "lut", "fixed", "auto"].
+        "fixed" computes with integers and may differ by one from the others.
+        "auto" picks the implementation that is fastest on this host for the
+        image size, calibrated once per host.
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel".
+        Defaults to the environment variable 'INSTAPY_NUM_THREADS' if set,
+        otherwise the number of CPUs.
+    band_rows : int, optional, default None
+        Number of image rows per band. By default bands of about 64 MiB.
+
+    Returns
+    -------
+    grayscale_image : array, shape = (H, W)
+        Transformed image as (memory-mapped) array
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    ValueError : if 'source' is not a uint8 array of shape (H, W, 3)
+    ValueError : if 'destination' is not an array of shape (H, W)
+    ValueError : if 'band_rows' is not a positive integer
+    """
+    source = _load_source(source)
+    method = _resolve_method(method, "grayscale", source)
+    func = _get_func(_grayscale_funcs, method)
+    return _filter_bands(func, source, destination, None, band_rows,
+                         _thread_kwargs(method, num_threads))
+
+
+def sepia_tiled(source, destination, sepia_amount=1, method="numpy",
+                num_threads=None, band_rows=None):
+    """
+    Sepia image filter applied band by band to an image larger than RAM.
+
+    Turn a colorful image of choice into a nostalgic sepia image with method
+    of choice. The image is read from a memory-mapped source and the new image
+    is written to a memory-mapped destination in bands of rows, so that memory
+    use is bounded by the band size rather than the image size. Resizing is
+    not supported, as it would mix pixels across bands.
+
+    Arguments
+    ---------
+    source : str or array, shape = (H, W, c)
+        Filename of a NumPy .npy file with the BGR image, which is memory
+        mapped, or a uint8 array, e.g. np.memmap of raw BGR image data
+    destination : str or array, shape = (H, W, c)
+        Filename of the NumPy .npy file to create for the transformed image,
+        which is memory mapped, or a uint8 array to write it to
+    sepia_amount : float, optional, default 1.0
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    method : str, optional, default 'numpy'
+        Choose implementation to use; either ["python", "numpy", "numba",
+        "numba-parallel", "cython", "cython-parallel", "lut", "fixed", "auto"].
+        "fixed" computes with integers and may differ by one from the others.
+        "auto" picks the implementation that is fastest on this host for the
+        image size, calibrated once per host.
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel".
+        Defaults to the environment variable 'INSTAPY_NUM_THREADS' if set,
+        otherwise the number of CPUs.
+    band_rows : int, optional, default None
+        Number of image rows per band. By default bands of about 64 MiB.
+
+    Returns
+    -------
+    sepia_image : array, shape = (H, W, c)
+        Transformed image as (memory-mapped) array
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'source' is not a uint8 array of shape (H, W, 3)
+    ValueError : if 'destination' is not an array of shape (H, W, c)
+    ValueError : if 'band_rows' is not a positive integer
+    """
+    _check_sepia_amount(sepia_amount)
+    source = _load_source(source)
+    method = _resolve_method(method, "sepia", source)
+    func = _get_func(_sepia_funcs, method)
+    kwargs = {"sepia_amount": sepia_amount,
+              **_thread_kwargs(method, num_threads)}
+    return _filter_bands(func, source, destination, 3, band_rows, kwargs)
+
+
+def set_async_workers(max_workers=None):
+    """
+    Limit the number of async filter calls that run at the same time.
+
+    The async filters run in a thread pool shared by all event loops of the
+    process. Calls beyond 'max_workers' wait for a free thread without
+    blocking the event loop. A previous pool finishes its pending calls in
+    the background.
+
+    Arguments
+    ---------
+    max_workers : int, optional, default None
+        Number of threads of the pool. Defaults to the environment variable
+        'INSTAPY_NUM_THREADS' if set, otherwise the number of CPUs.
+
+    Raises
+    ------
+    ValueError : if 'max_workers' is not a positive integer
+    """
+    global _async_executor
+
+    executor = ThreadPoolExecutor(max_workers=_num_threads(max_workers),
+                                  thread_name_prefix="instapy")
+    with _async_lock:
+        previous, _async_executor = _async_executor, executor
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+def set_result_cache(max_bytes=64 * 2**20, directory=None,
+                     max_disk_bytes=2**30):
+    """
+    Enable, resize or disable the cache of filtered images.
+
+    'grayscale_image', 'sepia_image', 'grayscale_bytes', 'sepia_bytes' and
+    their async counterparts look up the filtered image by a hash of the
+    source image bytes and the filter parameters, and only filter images
+    not in the cache. Images are cached as arrays by the '_image' filters
+    and encoded by the '_bytes' filters. The least recently used images are
+    evicted once the cache exceeds its size. The cache is disabled by
+    default; enabling it again starts an empty in-memory cache.
+
+    Arguments
+    ---------
+    max_bytes : int, optional, default 64 MiB
+        Largest total size in bytes of the images held in memory; 0 holds
+        none
+    directory : str, optional, default None
+        Directory of an on-disk cache shared by processes, created if
+        missing. Keyword 'auto' uses the 'results' directory in the
+        directory given by the environment variable 'INSTAPY_CACHE_DIR' if
+        set, otherwise in ~/.cache/instapy. Defaults to no on-disk cache.
+    max_disk_bytes : int, optional, default 1 GiB
+        Largest total size in bytes of the images stored on disk
+
+    Raises
+    ------
+    ValueError : if 'max_bytes' or 'max_disk_bytes' is not a non-negative
+                 integer
+    OSError : if 'directory' could not be created
+    """
+    global _result_cache
+
+    max_bytes, max_disk_bytes = int(max_bytes), int(max_disk_bytes)
+    if max_bytes < 0 or max_disk_bytes < 0:
+        raise ValueError(
+            "'max_bytes' and 'max_disk_bytes' must be non-negative integers")
+    if directory == "auto":
+        directory = os.path.join(_cache_dir(), "results")
+
+    if max_bytes == 0 and directory is None:
+        _result_cache = None
+    else:
+        _result_cache = _ResultCache(max_bytes, directory, max_disk_bytes)
+
+
+def set_planar_layout(planar=None):
+    """
+    Choose the pixel layout of the three-channel Numba and Cython kernels.
+
+    The planar kernels split rows of the image into planes of B, G and R
+    values, so that the weighted sums vectorize, at the cost of splitting
+    and interleaving the channels. This pays off with 256-bit vectors, so
+    the planar layout is the default of Numba, which compiles for the host,
+    and of a Cython module built with 'INSTAPY_NATIVE' on a host with AVX2,
+    but not of the portable Cython module. Both layouts give the same
+    images; compare their run times on a host with
+    'instapy-benchmark --layouts planar interleaved'.
+
+    Arguments
+    ---------
+    planar : bool, optional, default None
+        True for the planar layout, False for the interleaved layout. None
+        restores the defaults.
+    """
+    if planar is None:
+        _numba._PLANAR_LAYOUT = _numba._PLANAR_DEFAULT
+        _cython._PLANAR_LAYOUT = _cython._WIDE_VECTORS
+    else:
+        _numba._PLANAR_LAYOUT = _cython._PLANAR_LAYOUT = bool(planar)
+
+
+def _get_async_executor():
+    """
+    Thread pool of the async filters, created on first use.
+
+    Returns
+    -------
+    executor : concurrent.futures.ThreadPoolExecutor
+        Thread pool, see 'set_async_workers'
+    """
+    global _async_executor
+
+    with _async_lock:
+        if _async_executor is None:
+            _async_executor = ThreadPoolExecutor(max_workers=_num_threads(),
+                                                 thread_name_prefix="instapy")
+        return _async_executor
+
+
+async def grayscale_image_async(source, ext=".png", scale=None,
+                                method="numpy", num_threads=None,
+                                quality=None, compression=None):
+    """
+    Grayscale image filter for encoded images that does not block the event
+    loop.
+
+    Async counterpart of 'grayscale_bytes' for e.g. web services: the image
+    is decoded, filtered and encoded in a thread pool shared by all calls,
+    see 'set_async_workers'. No file I/O is performed.
+
+    Arguments
+    ---------
+    source : bytes-like or file object
+        Encoded image with shape (H, W, c) to transform, see
+        'grayscale_bytes'
+    ext : str, optional, default '.png'
+        File extension of the format to encode the new image in, e.g. '.jpg'
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    method : str, optional, default 'numpy'
+        Choose implementation to use, see 'grayscale_image'
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel",
+        see 'grayscale_image'
+    quality, compression : int, optional, default None
+        Quality of JPEG and WebP images and compression level of PNG images,
+        see 'grayscale_bytes'
+
+    Returns
+    -------
+    image_bytes : bytes
+        Encoded transformed image with shape (H, W)
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    ValueError : if 'source' could not be decoded as an image
+    ValueError : if the new image could not be encoded as 'ext'
+    ValueError : if 'quality' or 'compression' are invalid for 'ext'
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_async_executor(),
+        partial(grayscale_bytes, source, ext, scale=scale, method=method,
+                num_threads=num_threads, quality=quality,
+                compression=compression))
+
+
+async def sepia_image_async(source, ext=".png", scale=None, sepia_amount=1,
+                            method="numpy", num_threads=None, quality=None,
+                            compression=None):
+    """
+    Sepia image filter for encoded images that does not block the event
+    loop.
+
+    Async counterpart of 'sepia_bytes' for e.g. web services: the image is
+    decoded, filtered and encoded in a thread pool shared by all calls, see
+    'set_async_workers'. No file I/O is performed.
+
+    Arguments
+    ---------
+    source : bytes-like or file object
+        Encoded image with shape (H, W, c) to transform, see 'sepia_bytes'
+    ext : str, optional, default '.png'
+        File extension of the format to encode the new image in, e.g. '.jpg'
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles
+    sepia_amount : float, optional, default 1.0
+        0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+    method : str, optional, default 'numpy'
+        Choose implementation to use, see 'sepia_image'
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel",
+        see 'sepia_image'
+    quality, compression : int, optional, default None
+        Quality of JPEG and WebP images and compression level of PNG images,
+        see 'sepia_bytes'
+
+    Returns
+    -------
+    image_bytes : bytes
+        Encoded transformed image with shape (H, W, c)
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                 'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                 'fixed', 'auto']
+    ValueError : if 'sepia_amount' is not a float between 0 and 1
+    ValueError : if 'source' could not be decoded as an image
+    ValueError : if the new image could not be encoded as 'ext'
+    ValueError : if 'quality' or 'compression' are invalid for 'ext'
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_async_executor(),
+        partial(sepia_bytes, source, ext, scale=scale,
+                sepia_amount=sepia_amount, method=method,
+                num_threads=num_threads, quality=quality,
+                compression=compression))
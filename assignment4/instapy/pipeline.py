@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+
+from ._utils import (_GRAYSCALE_MATRIX, _check_color_matrix,
+                     _check_sepia_amount, _needs_clip, _read_image, _resize,
+                     _sepia_matrix, _write_image)
+from .filters import color_matrix_array
+
+# Slack for the row sums of weights such as those of the grayscale matrix,
+# which sum to one only up to rounding
+_FOLD_TOLERANCE = 1e-9
+
+
+class Pipeline:
+    """
+    Chain of image operations run with as few passes over the image as
+    possible.
+
+    Operations are added with the methods 'resize', 'color_matrix',
+    'grayscale', 'sepia' and 'clip', which return the pipeline itself so
+    that calls can be chained:
+
+        pipeline = Pipeline(method="numba").resize(0.5).sepia(0.8).clip(20, 235)
+        new_image = pipeline.apply(bgr_image)
+
+    Consecutive color operations are folded into a single color matrix and
+    bias, and a resize directly in front of them is fused into the same
+    kernel, so that such a chain costs a single pass over the image rather
+    than a pass, and a full-size intermediate image, per operation.
+
+    An operation is only folded into the operations before it if those
+    cannot clip, as clipping an intermediate image is not linear. Folding
+    also skips the truncation of the intermediate images to uint8. Each
+    truncation is off by less than one, and every later matrix scales the
+    difference by up to its largest row sum of absolute weights. An operation
+    is therefore only folded if the difference it carries forward stays
+    below one, e.g. after a single operation for matrices with row sums up
+    to one. A pixel then differs by at most one from applying the filters
+    one after another. Otherwise a new pass is started.
+
+    Arguments
+    ---------
+    method : str, optional, default 'numpy'
+        Choose implementation to use; either ["python", "numpy", "numba",
+        "numba-parallel", "cython", "cython-parallel", "lut", "fixed", "auto"].
+        See 'instapy.filters.color_matrix_array'.
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel" and "cython-parallel".
+        Defaults to the environment variable 'INSTAPY_NUM_THREADS' if set,
+        otherwise the number of CPUs.
+    """
+
+    def __init__(self, method="numpy", num_threads=None):
+        self.method = method
+        self.num_threads = num_threads
+        self.steps = []
+
+    def __repr__(self):
+        steps = ", ".join(name for name, _ in self.steps)
+        return f"Pipeline([{steps}], method={self.method!r})"
+
+    def resize(self, scale):
+        """
+        Up/downscale the image but preserve aspect ratio.
+
+        Arguments
+        ---------
+        scale : float
+            Scale factor to resize image as fraction, e.g. 0.5 halves image
+            dimensions whereas 2 doubles
+
+        Returns
+        -------
+        pipeline : Pipeline
+            The pipeline itself
+
+        Raises
+        ------
+        ValueError : if 'scale' is not larger than 0
+        """
+        if not scale > 0:
+            raise ValueError("'scale' must be a float larger than 0")
+        self.steps.append(("resize", scale))
+        return self
+
+    def color_matrix(self, matrix, bias=None):
+        """
+        Map the channels of every pixel through a color matrix plus a bias.
+
+        A single-channel image is treated as B, G and R channels of equal
+        value.
+
+        Arguments
+        ---------
+        matrix : array_like, shape = (3,), (1, 3) or (3, 3)
+            Weights of the B, G and R channels (columns) for each new channel
+            (rows). A single row gives a single-channel image.
+        bias : float or array_like, shape = (c,), optional, default None
+            Offset added to each new channel. Defaults to no offset.
+
+        Returns
+        -------
+        pipeline : Pipeline
+            The pipeline itself
+
+        Raises
+        ------
+        ValueError : if 'matrix' or 'bias' are invalid, see
+                     'instapy.filters.color_matrix_array'
+        """
+        self.steps.append(("color_matrix", _check_color_matrix(matrix, bias)))
+        return self
+
+    def grayscale(self):
+        """
+        Turn the image into a grayscale image.
+
+        Returns
+        -------
+        pipeline : Pipeline
+            The pipeline itself
+        """
+        return self.color_matrix(_GRAYSCALE_MATRIX)
+
+    def sepia(self, sepia_amount=1):
+        """
+        Blend the image with its sepia image.
+
+        Arguments
+        ---------
+        sepia_amount : float, optional, default 1.0
+            0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+
+        Returns
+        -------
+        pipeline : Pipeline
+            The pipeline itself
+
+        Raises
+        ------
+        ValueError : if 'sepia_amount' is not a float between 0 and 1
+        """
+        _check_sepia_amount(sepia_amount)
+        return self.color_matrix(_sepia_matrix(sepia_amount))
+
+    def clip(self, low=0, high=255):
+        """
+        Clip the channels of every pixel to a range of values.
+
+        Arguments
+        ---------
+        low, high : int, optional, default 0 and 255
+            Smallest and largest value of the new channels
+
+        Returns
+        -------
+        pipeline : Pipeline
+            The pipeline itself
+
+        Raises
+        ------
+        ValueError : if not 0 <= 'low' <= 'high' <= 255
+        """
+        if not 0 <= low <= high <= 255:
+            raise ValueError("'low' and 'high' must satisfy 0 <= low <= high <= 255")
+        self.steps.append(("clip", (low, high)))
+        return self
+
+    def _passes(self):
+        """
+        Fold the operations into passes over the image.
+
+        Returns
+        -------
+        passes : list of tuple
+            ("color_matrix", (matrix, bias, scale)) for every folded color
+            matrix with the scale of a fused resize (or None), ("resize",
+            scale) for every resize that is not fused and ("clip", (low,
+            high)) for every clip
+        """
+        passes = []
+        scale = None
+        matrix = bias = None
+        # Bound of the difference between the folded color matrix and the
+        # operations applied one after another, before truncation
+        error = 0
+        for name, args in self.steps + [("end", None)]:
+            if name == "color_matrix":
+                step_matrix, step_bias = args
+                step_error = np.abs(step_matrix).sum(axis=1).max() * error
+                if matrix is not None and (
+                        _needs_clip(matrix, bias) or
+                        step_error > 1 + _FOLD_TOLERANCE):
+                    passes.append(("color_matrix", (matrix, bias, scale)))
+                    scale = None
+                    matrix = bias = None
+                if matrix is None:
+                    matrix, bias = step_matrix, step_bias
+                    error = 1
+                    continue
+                error = 1 + step_error
+                if len(matrix) == 1:
+                    # Spread the single channel to B, G and R
+                    matrix = np.repeat(matrix, 3, axis=0)
+                    bias = np.repeat(bias, 3)
+                matrix, bias = step_matrix @ matrix, step_matrix @ bias + step_bias
+                continue
+
+            if matrix is not None:
+                passes.append(("color_matrix", (matrix, bias, scale)))
+            elif scale is not None:
+                passes.append(("resize", scale))
+            scale = None
+            matrix = bias = None
+            if name == "resize":
+                scale = args
+            elif name == "clip":
+                passes.append((name, args))
+
+        return passes
+
+    def apply(self, bgr_image):
+        """
+        Apply the pipeline to an image already in memory.
+
+        Arguments
+        ---------
+        bgr_image : array, shape = (H, W, c)
+            BGR image to transform as array, e.g. as returned by cv2.imread
+
+        Returns
+        -------
+        new_image : array, shape = (H, W) or (H, W, c)
+            Transformed image as array; 2D if the last color operation gives
+            a single channel
+
+        Raises
+        ------
+        ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                     'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                     'fixed', 'auto']
+        """
+        image = bgr_image
+        for name, args in self._passes():
+            if name == "color_matrix":
+                matrix, bias, scale = args
+                if image.ndim == 2:
+                    image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+                image = color_matrix_array(image, matrix, bias, scale=scale,
+                                           method=self.method,
+                                           num_threads=self.num_threads)
+            elif name == "resize":
+                image = _resize(image, args)
+            else:
+                low, high = args
+                if image is bgr_image:
+                    image = image.copy()
+                np.clip(image, low, high, out=image)
+
+        if image is bgr_image:
+            image = image.copy()
+        return image
+
+    def apply_image(self, imagefile, outfile=None):
+        """
+        Apply the pipeline to an image file.
+
+        Arguments
+        ---------
+        imagefile : str
+            Image filename (with path included) of image with shape (H, W, c)
+            to transform
+        outfile : str, optional, default None
+            Image filename (with path included) if transformed image should be
+            saved. Keyword 'auto' will save the new image in the same
+            destination as the original with '_pipeline' added to the
+            original filename.
+
+        Returns
+        -------
+        new_image : array, shape = (H, W) or (H, W, c)
+            Transformed image as array
+
+        Raises
+        ------
+        ValueError : if 'method' is not one of ['python', 'numpy', 'numba',
+                     'numba-parallel', 'cython', 'cython-parallel', 'lut',
+                     'fixed', 'auto']
+        FileNotFoundError : if 'imagefile' could not be read as an image
+        """
+        new_image = self.apply(_read_image(imagefile))
+        _write_image(new_image, imagefile, outfile, "_pipeline")
+
+        return new_image
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numba
+import numpy as np
+
+from ._numba import (_sepia_blend, _sepia_blend_parallel, _sepia_delta,
+                     _sepia_delta_parallel)
+from ._utils import (_check_sepia_amount, _empty_image, _num_threads,
+                     _read_image_scaled, _resize, _sepia_matrix, _write_image)
+
+# Kernels computing the difference to the full sepia image and blending it,
+# keyed by method name
+_preview_funcs = {"numba": (_sepia_delta, _sepia_blend),
+                  "numba-parallel": (_sepia_delta_parallel,
+                                     _sepia_blend_parallel)}
+
+# Color matrix of the full sepia effect
+_FULL_SEPIA_MATRIX = _sepia_matrix(1)
+
+
+class SepiaPreview:
+    """
+    Sepia filter of a single image for many amounts of sepia effect, e.g.
+    for a slider previewing the effect.
+
+    The sepia matrix is linear in the amount of sepia effect, so the sepia
+    image of any amount is the image plus the amount times the difference
+    between the unclipped full sepia image and the image, clipped to
+    [0, 255]. The difference is computed once, when the preview is
+    created, and every call of 'sepia' is a single pass over the image that
+    blends and clips, rather than a full color matrix product:
+
+        preview = SepiaPreview("images/rain.jpg", scale=0.5)
+        for sepia_amount in (0.1, 0.2, 0.3):
+            sepia_img = preview.sepia(sepia_amount)
+
+    The difference is held as float32, so a channel may differ by one from
+    'instapy.filters.sepia_array'. The preview holds 5 bytes per channel
+    value of the (resized) image.
+
+    Arguments
+    ---------
+    source : str or array, shape = (H, W, c)
+        Image filename (with path included) of image with shape (H, W, c),
+        or BGR image as uint8 array, which is copied
+    scale : float, optional, default None
+        Scale factor to resize image as fraction, e.g. 0.5 halves image
+        dimensions whereas 2 doubles. JPEG images downscaled by a factor of
+        two or more are decoded at 1/2, 1/4 or 1/8 of their size first.
+    method : str, optional, default 'numba-parallel'
+        Choose implementation to use; either ["numba", "numba-parallel"]
+    num_threads : int, optional, default None
+        Number of threads used by "numba-parallel". Defaults to the
+        environment variable 'INSTAPY_NUM_THREADS' if set, otherwise the
+        number of CPUs. Capped at the size of Numba's thread pool.
+
+    Raises
+    ------
+    ValueError : if 'method' is not one of ['numba', 'numba-parallel']
+    ValueError : if 'source' is not a uint8 array with shape (H, W, 3)
+    ValueError : if 'scale' is not larger than 0
+    ValueError : if 'num_threads' is not a positive integer
+    FileNotFoundError : if 'source' could not be read as an image
+    """
+
+    def __init__(self, source, scale=None, method="numba-parallel",
+                 num_threads=None):
+        if method not in _preview_funcs:
+            raise ValueError(
+                f"'method' must be one of {list(_preview_funcs)}")
+        self.method = method
+        self.num_threads = num_threads
+
+        if isinstance(source, str):
+            self.imagefile = source
+            bgr_image, scale = _read_image_scaled(source, scale)
+        else:
+            self.imagefile = None
+            bgr_image = source
+            if not (isinstance(bgr_image, np.ndarray) and
+                    bgr_image.dtype == np.uint8 and bgr_image.ndim == 3 and
+                    bgr_image.shape[2] == 3):
+                raise ValueError(
+                    "'source' must be a uint8 array with shape (H, W, 3)")
+        bgr_image = _resize(bgr_image, scale)
+        # The difference is only valid for this image, so the image of the
+        # caller is copied
+        if bgr_image is source:
+            bgr_image = bgr_image.copy()
+        self._bgr_image = np.ascontiguousarray(bgr_image)
+
+        self._delta = np.empty(self._bgr_image.shape, dtype=np.float32)
+        delta_func = _preview_funcs[method][0]
+        self._set_threads()
+        delta_func(self._bgr_image, _FULL_SEPIA_MATRIX, self._delta)
+
+    def __repr__(self):
+        return f"SepiaPreview(shape={self.shape}, method={self.method!r})"
+
+    @property
+    def shape(self):
+        """
+        Shape (H, W, c) of the sepia images.
+        """
+        return self._bgr_image.shape
+
+    def _set_threads(self):
+        """
+        Set the number of threads of the "numba-parallel" kernels.
+        """
+        if self.method == "numba-parallel":
+            numba.set_num_threads(min(_num_threads(self.num_threads),
+                                      numba.config.NUMBA_NUM_THREADS))
+
+    def sepia(self, sepia_amount=1, out=None):
+        """
+        Sepia image of an amount of sepia effect.
+
+        Arguments
+        ---------
+        sepia_amount : float, optional, default 1.0
+            0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+        out : array, optional, default None
+            Array to write the new image to; C-contiguous uint8 of shape
+            'shape', e.g. the previous preview. Defaults to a new array.
+
+        Returns
+        -------
+        sepia_image : array, shape = (H, W, c)
+            Transformed image as array
+
+        Raises
+        ------
+        ValueError : if 'sepia_amount' is not a float between 0 and 1
+        ValueError : if 'out' is not a C-contiguous uint8 array of shape
+                     'shape'
+        """
+        _check_sepia_amount(sepia_amount)
+        H, W = self.shape[:2]
+        sepia_image = _empty_image(H, W, _FULL_SEPIA_MATRIX, out)
+        blend_func = _preview_funcs[self.method][1]
+        self._set_threads()
+        blend_func(self._bgr_image.reshape(-1), self._delta.reshape(-1),
+                   np.float32(sepia_amount), sepia_image.reshape(-1))
+
+        return sepia_image
+
+    def sepia_image(self, sepia_amount=1, outfile=None):
+        """
+        Sepia image of an amount of sepia effect, saved to file.
+
+        Arguments
+        ---------
+        sepia_amount : float, optional, default 1.0
+            0-100% amount sepia effect. 1.0 is full sepia effect, 0.0 the original image
+        outfile : str, optional, default None
+            Image filename (with path included) if transformed image should be
+            saved. Keyword 'auto' will save the new image in the same
+            destination as the original with '_sepia' added to the original
+            filename, and requires the preview to be created from a file.
+
+        Returns
+        -------
+        sepia_image : array, shape = (H, W, c)
+            Transformed image as array
+
+        Raises
+        ------
+        ValueError : if 'sepia_amount' is not a float between 0 and 1
+        ValueError : if 'outfile' is 'auto' for a preview of an array
+        """
+        if outfile == "auto" and self.imagefile is None:
+            raise ValueError("'outfile' must be a filename for a preview "
+                             "created from an array")
+        sepia_image = self.sepia(sepia_amount)
+        _write_image(sepia_image, self.imagefile, outfile, "_sepia")
+
+        return sepia_image
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import itertools
+import os
+
+import cv2
+
+from ._stages import _run_stages
+from .filters import grayscale_array, sepia_array
+
+_filter_funcs = {"grayscale": grayscale_array, "sepia": sepia_array}
+_filter_suffixes = {"grayscale": "_grayscale", "sepia": "_sepia"}
+
+# Frame rate of the new video if the source does not report one, e.g. for
+# image sequences
+_DEFAULT_FPS = 25.0
+
+
+def _read_frames(capture, n_buffers):
+    """
+    Decode the frames of a video capture until it is exhausted.
+
+    The frames are decoded into a ring of 'n_buffers' arrays, which
+    cv2.VideoCapture.read reuses for frames of the same size, so a frame
+    yielded is overwritten 'n_buffers' frames later.
+
+    Arguments
+    ---------
+    capture : cv2.VideoCapture
+        Opened video or image sequence
+    n_buffers : int
+        Number of frames decoded into distinct arrays
+
+    Yields
+    ------
+    bgr_frame : array, shape = (H, W, 3)
+        BGR frame as array
+    """
+    frames = [None] * n_buffers
+    for index in itertools.count():
+        slot = index % n_buffers
+        ok, frames[slot] = capture.read(frames[slot])
+        if not ok:
+            return
+        yield frames[slot]
+
+
+def filter_video(source, outfile="auto", filter_name="grayscale",
+                 fourcc="mp4v", fps=None, queue_size=8, **kwargs):
+    """
+    Apply an image filter to every frame of a video or image sequence.
+
+    The frames are decoded with cv2.VideoCapture, filtered with the in-memory
+    filters and encoded with cv2.VideoWriter. Decoding, filtering and
+    encoding run concurrently in a reader thread, the calling thread and a
+    writer thread connected by bounded queues, so that at most about
+    2 * 'queue_size' frames are in memory at a time. Decoded and filtered
+    frames are written to rings of as many arrays as frames can be in
+    flight, so after the first frames no new frames are allocated.
+
+    Arguments
+    ---------
+    source : str
+        Filename of the video, or pattern of an image sequence such as
+        'frames/img_%04d.png'
+    outfile : str, optional, default 'auto'
+        Filename of the new video. Keyword 'auto' will save the new video in
+        the same destination as the original with the transformation added to
+        the original filename.
+    filter_name : str, optional, default 'grayscale'
+        Filter to apply; either "grayscale" or "sepia"
+    fourcc : str, optional, default 'mp4v'
+        Four-character code of the codec of the new video
+    fps : float, optional, default None
+        Frame rate of the new video. Defaults to the frame rate of the source,
+        or 25 if the source does not report one.
+    queue_size : int, optional, default 8
+        Maximum number of frames waiting between two stages
+    **kwargs
+        Keyword arguments passed along to the filter, e.g. 'scale',
+        'sepia_amount', 'method' and 'num_threads'
+
+    Returns
+    -------
+    n_frames : int
+        Number of frames filtered
+    outfile : str
+        Filename of the new video
+
+    Raises
+    ------
+    ValueError : if 'filter_name' is not one of ['grayscale', 'sepia']
+    ValueError : if 'queue_size' is not a positive integer
+    FileNotFoundError : if 'source' could not be opened as a video
+    OSError : if the new video could not be opened for writing
+    """
+    if filter_name not in _filter_funcs:
+        raise ValueError(f"'filter_name' must be one of {list(_filter_funcs)}")
+    if outfile == "auto":
+        filename, file_extension = os.path.splitext(source)
+        outfile = filename + _filter_suffixes[filter_name] + file_extension
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise FileNotFoundError(f"Could not open video {source!r}")
+    if fps is None:
+        fps = capture.get(cv2.CAP_PROP_FPS) or _DEFAULT_FPS
+
+    func = _filter_funcs[filter_name]
+    # The writer is opened for the size of the first filtered frame
+    writers = []
+    # A stage holds one frame while the queue in front of the next stage
+    # holds up to 'queue_size', so a frame is free 'queue_size' + 2 frames
+    # later
+    n_buffers = queue_size + 2
+    new_frames = []
+    counter = itertools.count()
+
+    def transform(bgr_frame):
+        slot = next(counter) % n_buffers
+        if slot < len(new_frames):
+            return func(bgr_frame, out=new_frames[slot], **kwargs)
+        new_frames.append(func(bgr_frame, **kwargs))
+        return new_frames[slot]
+
+    def write(frame):
+        if not writers:
+            height, width = frame.shape[:2]
+            writer = cv2.VideoWriter(outfile, cv2.VideoWriter_fourcc(*fourcc),
+                                     fps, (width, height),
+                                     isColor=frame.ndim == 3)
+            if not writer.isOpened():
+                raise OSError(f"Could not write video {outfile!r}")
+            writers.append(writer)
+        writers[0].write(frame)
+
+    try:
+        n_frames = _run_stages(_read_frames(capture, n_buffers), transform,
+                               write, queue_size=queue_size)
+    finally:
+        capture.release()
+        for writer in writers:
+            writer.release()
+
+    return n_frames, outfile
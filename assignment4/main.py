@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from instapy.filters import grayscale_image, sepia_image
+import sys
+
+from instapy.batch import batch_filter
 
 imgs = ["./images/rain.jpg", "./images/laperm_kitten.jpg"]
 
-for img in imgs:
-    gray_img = grayscale_image(img, outfile="auto", method="numba")
+if __name__ == "__main__":
+    # Filter the images in parallel worker processes with the implementations
+    # that are fastest on this host
+    _, gray_failures = batch_filter(imgs, "grayscale", method="auto")
+    _, sepia_failures = batch_filter(imgs, "sepia", method="auto")
 
-for img in imgs:
-    sepia_img = sepia_image(img, outfile="auto", method="cython")
+    failures = {**gray_failures, **sepia_failures}
+    for img, error in sorted(failures.items()):
+        print(f"Failed to filter {img!r}: {error}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
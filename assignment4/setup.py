@@ -1,7 +1,90 @@
+import os
+import sys
+import tempfile
+
+# setuptools is imported before distutils, which it provides on Python 3.12
+# and later, where distutils is no longer part of the standard library
+import setuptools  # isort: skip
+from distutils.ccompiler import new_compiler
+from distutils.errors import CompileError, LinkError
+from distutils.sysconfig import customize_compiler
+
 import numpy
-import setuptools
 from setuptools.extension import Extension
 
+
+def openmp_flags():
+    """
+    Compile and link flags for OpenMP.
+
+    A small OpenMP program is compiled to check whether the compiler
+    supports OpenMP. If it does not, no flags are returned and the
+    'cython-parallel' implementation runs serially.
+
+    Returns
+    -------
+    compile_args : list of str
+        Extra compile arguments
+    link_args : list of str
+        Extra link arguments
+    """
+    flag = "/openmp" if sys.platform == "win32" else "-fopenmp"
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "test_openmp.c")
+        with open(source, "w") as f:
+            f.write("#include <omp.h>\n"
+                    "int main(void) { return omp_get_max_threads() < 1; }\n")
+        try:
+            objects = compiler.compile([source], output_dir=tmpdir,
+                                       extra_postargs=[flag])
+            compiler.link_executable(objects, os.path.join(tmpdir, "test_openmp"),
+                                     extra_postargs=[flag])
+        except (CompileError, LinkError):
+            print("OpenMP is not available; 'cython-parallel' will run serially")
+            return [], []
+    link_args = [] if sys.platform == "win32" else [flag]
+    return [flag], link_args
+
+
+def native_flags():
+    """
+    Compile flags for the CPU of the build host.
+
+    The Cython module is portable by default, so that a built wheel runs on
+    any CPU of the architecture. Set the environment variable
+    'INSTAPY_NATIVE' to compile it with '-march=native' instead, so that the
+    C compiler vectorizes the kernels with the widest vectors of the build
+    host, like Numba does. Contracting multiplications and additions into
+    fused multiply-adds is then turned off, as it changes the rounding and
+    thus the result of the filters.
+
+    Returns
+    -------
+    compile_args : list of str
+        Extra compile arguments
+    """
+    flags = ["-march=native", "-ffp-contract=off"]
+    if not os.environ.get("INSTAPY_NATIVE") or sys.platform == "win32":
+        return []
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = os.path.join(tmpdir, "test_native.c")
+        with open(source, "w") as f:
+            f.write("int main(void) { return 0; }\n")
+        try:
+            compiler.compile([source], output_dir=tmpdir,
+                             extra_postargs=flags)
+        except CompileError:
+            return []
+    return flags
+
+
+compile_args, link_args = openmp_flags()
+compile_args += native_flags()
+
 setuptools.setup(
     name="instapy",
     version="0.0.1",
@@ -11,7 +94,7 @@ setuptools.setup(
     # this installs the Python package (looks for dirs containing '__init__.py')
     packages=setuptools.find_packages(),
     # 'scripts' are put on $PATH
-    scripts=["bin/instapy"],
+    scripts=["bin/instapy", "bin/instapy-benchmark"],
     # Cython extensions are compiled
     ext_modules=[Extension(
         # the 'import' name of the module
@@ -19,7 +102,11 @@ setuptools.setup(
         # the location of Cython source files
         sources=["instapy/_cython.pyx"],
         # any additional included directories, e.g. for Cython
-        # included_dirs=[numpy.get_include()],
+        include_dirs=[numpy.get_include()],
+        # OpenMP flags for 'cython.parallel.prange', if supported, and
+        # flags for the CPU of the build host
+        extra_compile_args=compile_args,
+        extra_link_args=link_args,
     )],
     setup_requires=["cython", "numpy", "setuptools>=18.0"],
     install_requires=["numpy", "numba", "opencv-python"],
@@ -5,10 +5,14 @@ import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 import pytest
-from instapy.filters import grayscale_image, sepia_image
+from instapy.batch import batch_filter
+from instapy.filters import (color_matrix_array, color_matrix_image,
+                             grayscale_array, grayscale_image,
+                             grayscale_matrix, grayscale_tiled, sepia_array,
+                             sepia_image, sepia_matrix, sepia_tiled)
 
 
-@pytest.mark.parametrize("implementation", ("python", "numpy", "numba", "cython"))
+@pytest.mark.parametrize("implementation", ("python", "numpy", "numba", "numba-parallel", "cython", "cython-parallel", "lut"))
 def test_grayscale(implementation):
     """
     Verify difference in image shape of color image (3D) and grayscale image (2D)
@@ -38,7 +42,7 @@ def test_grayscale(implementation):
     assert gray_img[i, j] == int(expected_value)
 
 
-@pytest.mark.parametrize("implementation", ("python", "numpy", "numba", "cython"))
+@pytest.mark.parametrize("implementation", ("python", "numpy", "numba", "numba-parallel", "cython", "cython-parallel", "lut"))
 def test_sepia(implementation):
     """
     Verify that a random pixel has the expected value
@@ -67,3 +71,933 @@ def test_sepia(implementation):
 
     # Verify random pixel value
     assert np.array_equal(sepia_img[i, j, :], expected)
+
+
+@pytest.mark.parametrize("implementation", ("python", "numpy", "numba", "numba-parallel", "cython", "cython-parallel", "lut", "fixed"))
+def test_array_api(implementation, tmp_path):
+    """
+    Verify that the in-memory filters match the file-based filters
+    """
+    np.random.seed(2020)
+    N = 28
+    # PNG, as JPEG images are decoded at reduced size when downscaled
+    imagefile = str(tmp_path / "test_image.png")
+    imarray = np.random.randint(0, 256, size=(N, N, 3)).astype("uint8")
+    cv2.imwrite(imagefile, imarray)
+    imarray = cv2.imread(imagefile)
+
+    gray_img = grayscale_array(imarray, scale=0.5, method=implementation)
+    sepia_img = sepia_array(imarray, sepia_amount=0.5, method=implementation)
+
+    assert gray_img.shape == (N // 2, N // 2)
+    assert gray_img.dtype == np.uint8
+    assert np.array_equal(gray_img, grayscale_image(
+        imagefile, scale=0.5, method=implementation))
+    assert np.array_equal(sepia_img, sepia_image(
+        imagefile, sepia_amount=0.5, method=implementation))
+
+
+def test_invalid_arguments():
+    """
+    Verify that invalid arguments raise errors
+    """
+    imarray = np.zeros((4, 4, 3), dtype="uint8")
+    with pytest.raises(ValueError):
+        grayscale_array(imarray, method="fortran")
+    with pytest.raises(ValueError):
+        sepia_array(imarray, scale=0)
+    with pytest.raises(ValueError):
+        sepia_array(imarray, sepia_amount=2)
+    with pytest.raises(FileNotFoundError):
+        grayscale_image("no_such_image.jpg")
+
+
+def test_batch_filter(tmp_path):
+    """
+    Verify that batch mode filters every image and reports failures
+    """
+    np.random.seed(2020)
+    N = 28
+    for n in range(3):
+        imarray = np.random.randint(0, 256, size=(N, N, 3)).astype("uint8")
+        cv2.imwrite(str(tmp_path / f"image{n}.png"), imarray)
+    (tmp_path / "broken.png").write_bytes(b"not an image")
+
+    results, failures = batch_filter(str(tmp_path), "sepia",
+                                     outdir=str(tmp_path / "out"),
+                                     max_workers=2, sepia_amount=0.5)
+
+    assert len(results) == 3
+    assert list(failures) == [str(tmp_path / "broken.png")]
+    for imagefile, outfile in results.items():
+        expected = sepia_image(imagefile, sepia_amount=0.5)
+        assert np.array_equal(cv2.imread(outfile), expected)
+
+
+def test_batch_filter_collisions(tmp_path):
+    """
+    Verify that colliding output filenames and failed writes are reported
+    """
+    imarray = np.zeros((8, 8, 3), dtype="uint8")
+    for subdir in ("a", "b"):
+        (tmp_path / subdir).mkdir()
+        cv2.imwrite(str(tmp_path / subdir / "x.png"), imarray)
+    sources = [str(tmp_path / "a"), str(tmp_path / "b")]
+
+    results, failures = batch_filter(sources, outdir=str(tmp_path / "out"),
+                                     max_workers=1)
+    assert list(results) == [str(tmp_path / "a" / "x.png")]
+    assert isinstance(failures[str(tmp_path / "b" / "x.png")], FileExistsError)
+
+    with pytest.raises(OSError):
+        grayscale_image(str(tmp_path / "a" / "x.png"),
+                        outfile=str(tmp_path / "missing" / "x.png"))
+
+
+def test_pipelined_filter(tmp_path):
+    """
+    Verify that the pipelined batch mode matches batch mode and reports
+    unreadable images, collisions and failed writes per image
+    """
+    from instapy.batch import pipelined_filter
+
+    np.random.seed(2020)
+    for subdir in ("a", "b"):
+        (tmp_path / subdir).mkdir()
+        for n in range(3):
+            imarray = np.random.randint(0, 256, size=(20, 30, 3)).astype("uint8")
+            cv2.imwrite(str(tmp_path / subdir / f"image{n}.png"), imarray)
+    (tmp_path / "a" / "broken.png").write_bytes(b"not an image")
+    sources = [str(tmp_path / "a"), str(tmp_path / "b" / "image0.png")]
+
+    results, failures = pipelined_filter(sources, "sepia",
+                                         outdir=str(tmp_path / "out"),
+                                         queue_size=1, sepia_amount=0.5,
+                                         method="cython")
+    assert sorted(results) == [str(tmp_path / "a" / f"image{n}.png")
+                               for n in range(3)]
+    assert isinstance(failures[str(tmp_path / "a" / "broken.png")],
+                      FileNotFoundError)
+    assert isinstance(failures[str(tmp_path / "b" / "image0.png")],
+                      FileExistsError)
+    for imagefile, outfile in results.items():
+        expected = sepia_image(imagefile, sepia_amount=0.5, method="cython")
+        assert np.array_equal(cv2.imread(outfile), expected)
+
+    # A directory in place of the new image fails the write
+    (tmp_path / "out" / "image1_grayscale.png").mkdir()
+    results, failures = pipelined_filter(str(tmp_path / "b"),
+                                         outdir=str(tmp_path / "out"))
+    assert len(results) == 2
+    assert isinstance(failures[str(tmp_path / "b" / "image1.png")], OSError)
+
+
+def test_filter_video(tmp_path):
+    """
+    Verify that every frame of a video and an image sequence is filtered,
+    and that a failing stage stops the others
+    """
+    from instapy._stages import _run_stages
+    from instapy.video import filter_video
+
+    np.random.seed(2020)
+    frames = np.random.randint(0, 256, size=(12, 32, 48, 3)).astype("uint8")
+    for n, frame in enumerate(frames):
+        cv2.imwrite(str(tmp_path / f"frame{n:02d}.png"), frame)
+    source = str(tmp_path / "frame%02d.png")
+
+    n_frames, outfile = filter_video(source, str(tmp_path / "gray.avi"),
+                                     fourcc="MJPG", queue_size=2)
+    assert n_frames == 12
+    capture = cv2.VideoCapture(outfile)
+    assert capture.get(cv2.CAP_PROP_FRAME_COUNT) == 12
+    assert capture.read()[1].shape == (32, 48, 3)
+
+    n_frames, outfile = filter_video(outfile, filter_name="sepia",
+                                     fourcc="MJPG", scale=0.5,
+                                     sepia_amount=0.5, method="numba")
+    assert n_frames == 12
+    assert outfile == str(tmp_path / "gray_sepia.avi")
+    assert cv2.VideoCapture(outfile).read()[1].shape == (16, 24, 3)
+
+    # Decoded and filtered frames are reused once written, with a lossless
+    # codec the frames are read back unchanged
+    n_frames, outfile = filter_video(source, str(tmp_path / "sepia.avi"),
+                                     filter_name="sepia", fourcc="FFV1",
+                                     queue_size=1, method="numba")
+    capture = cv2.VideoCapture(outfile)
+    for frame in frames:
+        assert np.array_equal(capture.read()[1],
+                              sepia_array(frame, method="numba"))
+
+    # The frames are filtered and written in order
+    written = []
+    assert _run_stages(iter(frames), grayscale_array, written.append,
+                       queue_size=1) == 12
+    assert all(np.array_equal(new, grayscale_array(frame))
+               for new, frame in zip(written, frames))
+
+    def fail(frame):
+        raise RuntimeError("kernel failed")
+
+    with pytest.raises(RuntimeError):
+        _run_stages(iter(frames), fail, written.append)
+    with pytest.raises(FileNotFoundError):
+        filter_video(str(tmp_path / "missing.avi"))
+    with pytest.raises(ValueError):
+        filter_video(source, filter_name="blur")
+
+
+def test_numba_precompiled():
+    """
+    Verify that the Numba kernels are compiled ahead of the first call and
+    that strided views do not trigger a new compilation
+    """
+    from instapy import _numba
+
+    kernels = [_numba._channel_filter, _numba._channel_filter_parallel,
+               _numba._color_matrix_filter,
+               _numba._color_matrix_filter_parallel]
+    n_signatures = [len(kernel.signatures) for kernel in kernels]
+    assert all(n == 2 for n in n_signatures)
+
+    imarray = np.random.randint(0, 256, size=(9, 8, 3)).astype("uint8")
+    view = imarray[::2, ::-1]
+    assert np.array_equal(grayscale_array(view, method="numba"),
+                          grayscale_array(view, method="python"))
+    assert np.array_equal(sepia_array(view, method="numba-parallel"),
+                          sepia_array(view, method="python"))
+    assert [len(kernel.signatures) for kernel in kernels] == n_signatures
+
+
+def test_cython_threads():
+    """
+    Verify that the GIL-releasing Cython kernels give the same result when
+    called from several threads and on strided views
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(64, 48, 3)).astype("uint8")
+    view = imarray[::2, ::-1]
+    expected = sepia_array(view, sepia_amount=0.7, method="python")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        sepia_imgs = list(executor.map(
+            lambda _: sepia_array(view, sepia_amount=0.7, method="cython"),
+            range(8)))
+
+    for sepia_img in sepia_imgs:
+        assert np.array_equal(sepia_img, expected)
+    assert np.array_equal(grayscale_array(view, method="cython"),
+                          grayscale_array(view, method="python"))
+
+
+@pytest.mark.parametrize("implementation", ("numba-parallel", "cython-parallel"))
+def test_num_threads(implementation, monkeypatch):
+    """
+    Verify that the number of threads does not change the result and that
+    an invalid number of threads raises an error
+    """
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(37, 29, 3)).astype("uint8")
+    expected = sepia_array(imarray, sepia_amount=0.4, method="numpy")
+
+    for num_threads in (1, 2, 3):
+        sepia_img = sepia_array(imarray, sepia_amount=0.4,
+                                method=implementation, num_threads=num_threads)
+        assert np.array_equal(sepia_img, expected)
+
+    monkeypatch.setenv("INSTAPY_NUM_THREADS", "2")
+    assert np.array_equal(grayscale_array(imarray, method=implementation),
+                          grayscale_array(imarray, method="numpy"))
+    with pytest.raises(ValueError):
+        grayscale_array(imarray, method=implementation, num_threads=0)
+
+
+def test_numpy_sepia_tiles(monkeypatch):
+    """
+    Verify that the tiled NumPy filters are independent of the tile size
+    """
+    from instapy import _numpy
+
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(23, 17, 3)).astype("uint8")
+    expected = sepia_array(imarray, sepia_amount=0.6, method="python")
+
+    expected_gray = grayscale_array(imarray, method="python")
+
+    # 390 leaves a single pixel for the last tile
+    for tile_pixels in (1, 50, 390, 391, 10**6):
+        monkeypatch.setattr(_numpy, "_TILE_PIXELS", tile_pixels)
+        sepia_img = sepia_array(imarray, sepia_amount=0.6, method="numpy")
+        assert np.array_equal(sepia_img, expected)
+        assert np.array_equal(grayscale_array(imarray, method="numpy"),
+                              expected_gray)
+
+
+@pytest.mark.parametrize("implementation", ("numba", "numba-parallel", "cython", "cython-parallel"))
+def test_planar_layout(implementation, monkeypatch):
+    """
+    Verify that the planar kernels match the interleaved kernels
+    """
+    from instapy import _cython, _numba
+
+    module = _numba if implementation.startswith("numba") else _cython
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(37, 29, 3)).astype("uint8")
+    matrix = [[0.9, -0.4, 0.7], [0.1, 1.2, 0.0], [-0.3, 0.2, 1.1]]
+    bias = [-20.0, 10.0, 5.0]
+
+    results = []
+    for planar in (False, True):
+        monkeypatch.setattr(module, "_PLANAR_LAYOUT", planar)
+        results.append([
+            sepia_array(image, sepia_amount=amount, method=implementation)
+            for image in (imarray, imarray[:, ::-1])
+            for amount in (0.3, 1)
+        ] + [color_matrix_array(imarray, matrix, bias, method=implementation)])
+    for interleaved, planar in zip(*results):
+        assert np.array_equal(planar, interleaved)
+
+    from instapy.filters import set_planar_layout
+
+    set_planar_layout(False)
+    assert not _numba._PLANAR_LAYOUT and not _cython._PLANAR_LAYOUT
+    set_planar_layout()
+    assert _numba._PLANAR_LAYOUT == _numba._PLANAR_DEFAULT
+    assert _cython._PLANAR_LAYOUT == _cython._WIDE_VECTORS
+
+
+def test_lut_tables():
+    """
+    Verify that the lookup table filters match the NumPy filters, also for
+    pixels close to rounding boundaries, and that tables are cached per
+    color matrix
+    """
+    from instapy import _lut
+
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(64, 64, 3)).astype("uint8")
+    # Every gray value, whose weights sum to exactly 1.0
+    imarray[0, :, :] = np.arange(0, 256, 4)[:, np.newaxis]
+    imarray[1, :, :] = np.arange(3, 256, 4)[:, np.newaxis]
+    view = imarray[::-1, ::2]
+
+    assert np.array_equal(grayscale_array(view, method="lut"),
+                          grayscale_array(view, method="numpy"))
+    for sepia_amount in (0, 0.3, 1):
+        assert np.array_equal(
+            sepia_array(view, sepia_amount=sepia_amount, method="lut"),
+            sepia_array(view, sepia_amount=sepia_amount, method="numpy"))
+
+    # A single ambiguous pixel is recomputed like in the full image
+    pixels = np.array([[[161, 106, 121], [0, 0, 0]]], dtype="uint8")
+    assert np.array_equal(grayscale_array(pixels, method="lut"),
+                          grayscale_array(pixels, method="numba"))
+    for pixel in pixels[:, :1], view[:1, :1]:
+        assert np.array_equal(grayscale_array(pixel, method="lut"),
+                              grayscale_array(pixel, method="numba"))
+        assert np.array_equal(sepia_array(pixel, sepia_amount=0.3, method="lut"),
+                              sepia_array(pixel, sepia_amount=0.3, method="numba"))
+
+    _lut._cached_tables.cache_clear()
+    sepia_array(imarray, sepia_amount=0.3, method="lut")
+    sepia_array(imarray, sepia_amount=0.3, method="lut")
+    sepia_array(imarray, sepia_amount=0.6, method="lut")
+    info = _lut._cached_tables.cache_info()
+    assert (info.hits, info.misses) == (1, 2)
+    # The identity matrix of sepia_amount=0 is exact and has no margins
+    assert not _lut._matrix_tables(sepia_matrix(0), np.zeros(3))[1].any()
+
+
+def test_fixed_point():
+    """
+    Verify that the fixed-point filters are within one of the NumPy filters
+    and that matrices too large for int32 sums fall back to NumPy
+    """
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(64, 48, 3)).astype("uint8")
+    view = imarray[::-1, ::2]
+    matrix = [[0.9, -0.4, 0.7], [0.1, 1.2, 0.0], [-0.3, 0.2, 1.1]]
+    bias = [-20.5, 10.0, 5.25]
+
+    for image in (imarray, view):
+        for gray_img, expected in (
+                (grayscale_array(image, method="fixed"),
+                 grayscale_array(image, method="numpy")),
+                (grayscale_array(image, scale=0.5, method="fixed"),
+                 grayscale_array(image, scale=0.5, method="numpy")),
+                (color_matrix_array(image, matrix, bias, method="fixed"),
+                 color_matrix_array(image, matrix, bias, method="numpy")),
+                (color_matrix_array(image, matrix[0], -30, method="fixed"),
+                 color_matrix_array(image, matrix[0], -30, method="numpy"))):
+            assert gray_img.shape == expected.shape
+            assert np.abs(gray_img.astype(int) - expected).max() <= 1
+        for sepia_amount in (0, 0.3, 1):
+            sepia_img = sepia_array(image, sepia_amount=sepia_amount,
+                                    method="fixed")
+            expected = sepia_array(image, sepia_amount=sepia_amount,
+                                   method="numpy")
+            assert np.abs(sepia_img.astype(int) - expected).max() <= 1
+    # The identity matrix of sepia_amount=0 is exact
+    assert np.array_equal(sepia_array(imarray, sepia_amount=0,
+                                      method="fixed"), imarray)
+
+    large = np.full((3, 3), 1000.0)
+    assert np.array_equal(color_matrix_array(imarray, large, method="fixed"),
+                          color_matrix_array(imarray, large, method="numpy"))
+
+
+def test_color_matrix(tmp_path):
+    """
+    Verify that the grayscale and sepia filters are presets of the color
+    matrix filter, and that custom matrices with negative weights and a bias
+    give the same result with every implementation
+    """
+    methods = ["python", "numpy", "numba", "numba-parallel", "cython",
+               "cython-parallel", "lut"]
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(48, 64, 3)).astype("uint8")
+
+    for method in methods:
+        assert np.array_equal(
+            color_matrix_array(imarray, grayscale_matrix(), method=method),
+            grayscale_array(imarray, method=method))
+        assert np.array_equal(
+            color_matrix_array(imarray, sepia_matrix(0.4), method=method),
+            sepia_array(imarray, sepia_amount=0.4, method=method))
+
+    # Swap the B and R channels, wash out G and darken
+    mixer = [[-0.2, 0.1, 1.1], [0.3, 0.5, 0.3], [0.9, -0.1, 0.05]]
+    bias = [20.5, 40, -10]
+    expected = color_matrix_array(imarray, mixer, bias, method="python")
+    assert expected.shape == imarray.shape
+    assert expected.min() == 0 and expected.max() == 255
+    for method in methods[1:]:
+        assert np.array_equal(
+            color_matrix_array(imarray, mixer, bias, method=method), expected)
+
+    # A single row gives a 2D image; a scalar bias applies to all channels
+    single = color_matrix_array(imarray, [0.5, 0.5, -0.5], 100, method="numba")
+    assert single.shape == imarray.shape[:2]
+    assert np.array_equal(
+        single, color_matrix_array(imarray, [[0.5, 0.5, -0.5]], [100]))
+
+    # Fused downscaling and weights too large for the lookup tables
+    for method in ("numba-parallel", "cython"):
+        assert np.array_equal(
+            color_matrix_array(imarray, mixer, bias, scale=0.25, method=method),
+            color_matrix_array(cv2.resize(imarray, (16, 12),
+                                          interpolation=cv2.INTER_AREA),
+                               mixer, bias, method=method))
+    assert np.array_equal(color_matrix_array(imarray, [40, -40, 0], method="lut"),
+                          color_matrix_array(imarray, [40, -40, 0]))
+
+    imagefile = str(tmp_path / "image.png")
+    cv2.imwrite(imagefile, imarray)
+    color_matrix_image(imagefile, mixer, bias, outfile="auto")
+    assert np.array_equal(cv2.imread(str(tmp_path / "image_color_matrix.png")),
+                          color_matrix_array(imarray, mixer, bias))
+
+    for matrix, bias in (([[1, 0], [0, 1]], None), (np.eye(2, 3), None),
+                         (mixer, [1, 2]), ([0.2, 0.7, np.nan], None)):
+        with pytest.raises(ValueError):
+            color_matrix_array(imarray, matrix, bias)
+
+
+def test_pipeline(tmp_path):
+    """
+    Verify that the pipeline folds consecutive color operations that cannot
+    clip into a single pass with a fused resize, and starts a new pass
+    otherwise
+    """
+    from instapy.pipeline import Pipeline
+
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(48, 64, 3)).astype("uint8")
+    darken = [[0.5, 0.1, 0], [0, 0.6, 0], [0.1, 0, 0.7]]
+
+    pipeline = Pipeline(method="numba").resize(0.25).color_matrix(darken, 20).grayscale()
+    passes = pipeline._passes()
+    assert [name for name, _ in passes] == ["color_matrix"]
+    matrix, bias, scale = passes[0][1]
+    assert scale == 0.25
+    assert np.allclose(matrix, grayscale_matrix() @ darken)
+    new_image = pipeline.apply(imarray)
+    expected = grayscale_array(color_matrix_array(imarray, darken, 20, scale=0.25))
+    assert new_image.shape == (12, 16)
+    assert np.abs(new_image.astype(int) - expected).max() <= 1
+
+    # Folding stops before a truncation error could grow beyond one
+    swap = [[0, 0, 1], [0, 1, 0], [1, 0, 0]]
+    for steps, n_passes in (((darken, swap), 1), ((darken, swap, swap), 2),
+                            ((darken, np.eye(3) * 1.8), 2)):
+        pipeline = Pipeline(method="numba")
+        expected = imarray
+        for step in steps:
+            pipeline.color_matrix(step)
+            expected = color_matrix_array(expected, step, method="numba")
+        assert len(pipeline._passes()) == n_passes
+        new_image = pipeline.apply(imarray)
+        assert np.abs(new_image.astype(int) - expected).max() <= 1
+
+    # Sepia can clip, so the following operations run in a new pass and
+    # match the filters applied one after another
+    pipeline = Pipeline(method="cython").sepia(0.7).color_matrix(darken).clip(30, 200).resize(0.5)
+    assert [name for name, _ in pipeline._passes()] == [
+        "color_matrix", "color_matrix", "clip", "resize"]
+    expected = color_matrix_array(
+        sepia_array(imarray, sepia_amount=0.7, method="cython"), darken,
+        method="cython")
+    expected = cv2.resize(np.clip(expected, 30, 200), (32, 24),
+                          interpolation=cv2.INTER_AREA)
+    assert np.array_equal(pipeline.apply(imarray), expected)
+
+    # A single-channel image is spread to B, G and R
+    assert Pipeline().grayscale().sepia().apply(imarray).shape == imarray.shape
+    assert np.array_equal(Pipeline().apply(imarray), imarray)
+    assert Pipeline().apply(imarray) is not imarray
+
+    imagefile = str(tmp_path / "image.png")
+    cv2.imwrite(imagefile, imarray)
+    Pipeline().sepia(0.5).apply_image(imagefile, outfile="auto")
+    assert np.array_equal(cv2.imread(str(tmp_path / "image_pipeline.png")),
+                          sepia_array(imarray, sepia_amount=0.5))
+
+    with pytest.raises(ValueError):
+        Pipeline().clip(200, 100)
+    with pytest.raises(ValueError):
+        Pipeline().resize(0)
+    with pytest.raises(ValueError):
+        Pipeline(method="gpu").grayscale().apply(imarray)
+
+
+def test_reduced_decode(tmp_path):
+    """
+    Verify that downscaled JPEG images are decoded at reduced size into
+    images of the expected size, close to decoding at full size
+    """
+    from instapy._utils import _jpeg_size
+    from instapy.filters import sepia_bytes
+
+    np.random.seed(2020)
+    blocks = np.random.randint(0, 256, size=(12, 16, 3)).astype("uint8")
+    for W, H in ((160, 120), (157, 117)):
+        imarray = cv2.resize(blocks, (W, H), interpolation=cv2.INTER_LINEAR)
+        imagefile = str(tmp_path / f"image{W}.jpg")
+        cv2.imwrite(imagefile, imarray, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        with open(imagefile, "rb") as f:
+            jpeg_bytes = f.read()
+        assert _jpeg_size(np.frombuffer(jpeg_bytes, np.uint8)) == (H, W)
+        imarray = cv2.imread(imagefile)
+
+        for scale in (0.5, 0.3, 0.2):
+            expected = sepia_array(imarray, scale=scale, method="numba")
+            new_image = sepia_image(imagefile, scale=scale, method="numba")
+            assert new_image.shape == expected.shape
+            if W % 8 == 0:
+                assert np.abs(new_image.astype(int) - expected).mean() < 3
+            new_bytes = sepia_bytes(jpeg_bytes, scale=scale, method="numba")
+            assert np.array_equal(
+                cv2.imdecode(np.frombuffer(new_bytes, np.uint8), cv2.IMREAD_COLOR),
+                new_image)
+
+    # Scales above 1/2 and images other than JPEG are decoded at full size
+    assert np.array_equal(grayscale_image(imagefile, scale=0.6),
+                          grayscale_array(imarray, scale=0.6))
+    pngfile = str(tmp_path / "image.png")
+    cv2.imwrite(pngfile, imarray)
+    assert np.array_equal(grayscale_image(pngfile, scale=0.25, method="cython"),
+                          grayscale_array(imarray, scale=0.25, method="cython"))
+    with pytest.raises(FileNotFoundError):
+        sepia_image(str(tmp_path / "missing.jpg"), scale=0.25)
+
+
+def test_bytes_filters():
+    """
+    Verify that the filters decode bytes, buffers and file objects and encode
+    the new image with the requested quality or compression
+    """
+    import io
+
+    from instapy.filters import grayscale_bytes, sepia_bytes
+
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(30, 40, 3)).astype("uint8")
+    png_bytes = cv2.imencode(".png", imarray)[1].tobytes()
+    expected = sepia_array(imarray, sepia_amount=0.5, method="numba")
+
+    for source in (png_bytes, bytearray(png_bytes), memoryview(png_bytes),
+                   np.frombuffer(png_bytes, np.uint8), io.BytesIO(png_bytes)):
+        sepia_png = sepia_bytes(source, "png", sepia_amount=0.5,
+                                method="numba", compression=9)
+        assert np.array_equal(cv2.imdecode(np.frombuffer(sepia_png, np.uint8),
+                                           cv2.IMREAD_UNCHANGED), expected)
+
+    flat_png = cv2.imencode(".png", np.zeros_like(imarray))[1]
+    assert (len(grayscale_bytes(flat_png, compression=0)) >
+            len(grayscale_bytes(flat_png, compression=9)))
+    low, high = (grayscale_bytes(png_bytes, ".jpg", quality=quality)
+                 for quality in (10, 95))
+    assert low[:2] == high[:2] == b"\xff\xd8" and len(low) < len(high)
+    lossless = sepia_bytes(png_bytes, ".webp", quality=101, scale=0.5)
+    assert np.array_equal(
+        cv2.imdecode(np.frombuffer(lossless, np.uint8), cv2.IMREAD_COLOR),
+        sepia_array(imarray, scale=0.5))
+
+    for kwargs in ({"ext": ".png", "quality": 90}, {"ext": ".jpg", "quality": 101},
+                   {"ext": ".jpg", "compression": 3}, {"ext": ".png", "compression": 10}):
+        with pytest.raises(ValueError):
+            grayscale_bytes(png_bytes, **kwargs)
+    with pytest.raises(ValueError):
+        sepia_bytes(b"")
+    with pytest.raises(TypeError):
+        grayscale_bytes("image.png")
+
+
+def test_async_filters():
+    """
+    Verify that the async filters decode, filter and encode bytes in the
+    thread pool, also with a concurrency limit of a single call
+    """
+    import asyncio
+    import io
+
+    from instapy.filters import (grayscale_image_async, sepia_image_async,
+                                 set_async_workers)
+
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(30, 40, 3)).astype("uint8")
+    image_bytes = cv2.imencode(".png", imarray)[1].tobytes()
+
+    async def filter_all():
+        return await asyncio.gather(
+            grayscale_image_async(image_bytes, method="numba"),
+            sepia_image_async(image_bytes, ".png", scale=0.5,
+                              sepia_amount=0.5, method="lut"),
+            *(sepia_image_async(io.BytesIO(image_bytes), ".jpg", quality=80)
+          for _ in range(4)))
+
+    for max_workers in (None, 1):
+        set_async_workers(max_workers)
+        gray_bytes, sepia_bytes, *jpeg_bytes = asyncio.run(filter_all())
+        assert np.array_equal(
+            cv2.imdecode(np.frombuffer(gray_bytes, np.uint8), cv2.IMREAD_UNCHANGED),
+            grayscale_array(imarray, method="numba"))
+        assert np.array_equal(
+            cv2.imdecode(np.frombuffer(sepia_bytes, np.uint8), cv2.IMREAD_UNCHANGED),
+            sepia_array(imarray, scale=0.5, sepia_amount=0.5, method="lut"))
+        assert len(set(jpeg_bytes)) == 1 and jpeg_bytes[0][:2] == b"\xff\xd8"
+
+    with pytest.raises(ValueError):
+        asyncio.run(grayscale_image_async(b"not an image"))
+    with pytest.raises(ValueError):
+        asyncio.run(sepia_image_async(image_bytes, ".xyz"))
+    with pytest.raises(ValueError):
+        set_async_workers(0)
+
+
+@pytest.mark.parametrize("implementation", ("numba", "numba-parallel"))
+def test_sepia_preview(implementation, tmp_path):
+    """
+    Verify that the sepia preview blends every amount of sepia effect within
+    one of the sepia filter, from arrays and files, into new and existing
+    arrays
+    """
+    from instapy.preview import SepiaPreview
+
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(37, 53, 3)).astype("uint8")
+    imagefile = str(tmp_path / "image.png")
+    cv2.imwrite(imagefile, imarray)
+
+    preview = SepiaPreview(imarray[:, ::-1], method=implementation)
+    assert preview.shape == imarray.shape
+    sepia_img = None
+    for sepia_amount in (0, 0.25, 0.5, 0.75, 1):
+        out = sepia_img
+        sepia_img = preview.sepia(sepia_amount, out=out)
+        assert out is None or sepia_img is out
+        expected = sepia_array(imarray[:, ::-1], sepia_amount=sepia_amount)
+        assert np.abs(sepia_img.astype(int) - expected).max() <= 1
+    assert np.array_equal(preview.sepia(0), imarray[:, ::-1])
+
+    preview = SepiaPreview(imagefile, scale=0.5, method=implementation)
+    sepia_img = preview.sepia_image(0.3, outfile="auto")
+    assert np.array_equal(cv2.imread(str(tmp_path / "image_sepia.png")),
+                          sepia_img)
+    expected = sepia_array(imarray, scale=0.5, sepia_amount=0.3)
+    assert np.abs(sepia_img.astype(int) - expected).max() <= 1
+
+    with pytest.raises(ValueError):
+        preview.sepia(1.5)
+    with pytest.raises(ValueError):
+        preview.sepia(0.5, out=np.empty(imarray.shape, np.uint8))
+    with pytest.raises(ValueError):
+        SepiaPreview(imarray[..., 0], method=implementation)
+    with pytest.raises(ValueError):
+        SepiaPreview(imarray, method="numpy")
+    with pytest.raises(ValueError):
+        SepiaPreview(imarray).sepia_image(outfile="auto")
+
+
+def test_result_cache(tmp_path, monkeypatch):
+    """
+    Verify that cached filtered images are returned without filtering
+    again, from memory and from disk, and that both caches evict the least
+    recently used images beyond their size
+    """
+    from instapy import filters
+    from instapy.filters import sepia_bytes, set_result_cache
+
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(30, 40, 3)).astype("uint8")
+    imagefile = str(tmp_path / "image.png")
+    cv2.imwrite(imagefile, imarray)
+    cache_dir = tmp_path / "cache"
+    expected = sepia_array(imarray, scale=0.5, sepia_amount=0.5)
+
+    try:
+        set_result_cache(directory=str(cache_dir))
+        sepia_img = sepia_image(imagefile, scale=0.5, sepia_amount=0.5)
+        jpeg_bytes = sepia_bytes(cv2.imencode(".png", imarray)[1], ".jpg")
+        assert np.array_equal(sepia_img, expected)
+        assert len(list(cache_dir.iterdir())) == 2
+
+        def fail(*args, **kwargs):
+            pytest.fail("cached image filtered again")
+
+        monkeypatch.setitem(filters._sepia_funcs, "numpy", fail)
+        monkeypatch.setitem(filters._sepia_funcs, "numba", fail)
+        sepia_img[:] = 0
+        for _ in range(2):
+            # Identical implementations share cached images
+            cached = sepia_image(imagefile, scale=0.5, sepia_amount=0.5,
+                                 method="numba")
+            assert np.array_equal(cached, expected) and cached.flags.writeable
+            assert sepia_bytes(cv2.imencode(".png", imarray)[1],
+                               ".jpg") == jpeg_bytes
+            # A new process finds the images on disk
+            set_result_cache(0, directory=str(cache_dir))
+        with pytest.raises(ValueError):
+            sepia_image(imagefile, method="unknown")
+        monkeypatch.undo()
+
+        set_result_cache(max_bytes=2 * expected.nbytes)
+        for sepia_amount in (0.1, 0.2, 0.3):
+            sepia_image(imagefile, scale=0.5, sepia_amount=sepia_amount)
+        assert len(filters._result_cache._entries) == 2
+        assert filters._result_cache._size <= 2 * expected.nbytes
+
+        # Images are stored with a header of 128 bytes
+        set_result_cache(0, directory=str(cache_dir),
+                         max_disk_bytes=imarray.nbytes // 3 + 128)
+        grayscale_image(imagefile)
+        assert [path.suffix for path in cache_dir.iterdir()] == [".npy"]
+        sepia_image(imagefile, scale=0.5, sepia_amount=0.9)
+        assert [np.load(path).shape for path in cache_dir.iterdir()] == [
+            expected.shape]
+    finally:
+        set_result_cache(0)
+
+    with pytest.raises(ValueError):
+        set_result_cache(-1)
+
+
+@pytest.mark.parametrize("implementation", ("numpy", "numba", "cython-parallel", "lut"))
+def test_tiled(implementation, tmp_path):
+    """
+    Verify that the tiled filters match the in-memory filters for memory
+    mapped sources and destinations
+    """
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(45, 31, 3)).astype("uint8")
+    source = str(tmp_path / "image.npy")
+    np.save(source, imarray)
+
+    gray_img = grayscale_tiled(source, str(tmp_path / "gray.npy"),
+                               method=implementation, band_rows=7)
+    assert np.array_equal(np.load(str(tmp_path / "gray.npy")),
+                          grayscale_array(imarray, method=implementation))
+    assert gray_img.shape == (45, 31)
+
+    raw = str(tmp_path / "image.raw")
+    imarray.tofile(raw)
+    raw_source = np.memmap(raw, dtype=np.uint8, mode="r", shape=imarray.shape)
+    destination = np.zeros_like(imarray)
+    sepia_tiled(raw_source, destination, sepia_amount=0.3,
+                method=implementation)
+    assert np.array_equal(destination, sepia_array(
+        imarray, sepia_amount=0.3, method=implementation))
+
+    with pytest.raises(ValueError):
+        sepia_tiled(source, np.zeros((45, 31), dtype="uint8"))
+    with pytest.raises(ValueError):
+        grayscale_tiled(imarray.astype(float), str(tmp_path / "x.npy"))
+
+
+@pytest.mark.parametrize("implementation", ("numba", "numba-parallel", "cython", "cython-parallel"))
+def test_fused_resize(implementation):
+    """
+    Verify that downscaling fused into the kernels matches resizing with
+    OpenCV first
+    """
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(120, 90, 3)).astype("uint8")
+
+    for image in (imarray, imarray[:, ::-1]):
+        for scale in (0.5, 1 / 3, 0.25, 0.1, 0.7):
+            H, W = int(image.shape[0] * scale), int(image.shape[1] * scale)
+            resized = cv2.resize(image, (W, H), interpolation=cv2.INTER_AREA)
+            assert np.array_equal(
+                grayscale_array(image, scale=scale, method=implementation),
+                grayscale_array(resized, method=implementation))
+            assert np.array_equal(
+                sepia_array(image, scale=scale, sepia_amount=0.8,
+                            method=implementation),
+                sepia_array(resized, sepia_amount=0.8, method=implementation))
+
+
+@pytest.mark.parametrize("implementation", ("python", "numpy", "numba", "numba-parallel", "cython", "cython-parallel", "lut", "fixed"))
+def test_output_buffers(implementation):
+    """
+    Verify that the filters write to caller-supplied arrays and reject
+    arrays of the wrong shape, type or layout
+    """
+    np.random.seed(2020)
+    imarray = np.random.randint(0, 256, size=(24, 36, 3)).astype("uint8")
+    matrix = [[0.9, -0.4, 0.7], [0.1, 1.2, 0.0], [-0.3, 0.2, 1.1]]
+
+    for image in (imarray, imarray[:, ::-1]):
+        for scale in (None, 0.25, 0.5):
+            for func, kwargs in ((grayscale_array, {}),
+                                 (sepia_array, {"sepia_amount": 0.7}),
+                                 (color_matrix_array,
+                                  {"matrix": matrix, "bias": 5})):
+                expected = func(image, scale=scale, method=implementation,
+                                **kwargs)
+                out = np.full_like(expected, 7)
+                new_image = func(image, scale=scale, method=implementation,
+                                 out=out, **kwargs)
+                assert new_image is out
+                assert np.array_equal(out, expected)
+
+    for out in (np.empty((24, 35), dtype="uint8"),
+                np.empty((24, 36), dtype="float64"),
+                np.empty((36, 24), dtype="uint8").T):
+        with pytest.raises(ValueError):
+            grayscale_array(imarray, method=implementation, out=out)
+    with pytest.raises(ValueError):
+        sepia_array(imarray, method=implementation, out=imarray)
+
+
+def test_auto_method(tmp_path, monkeypatch):
+    """
+    Verify that method "auto" calibrates once, caches the calibration in a
+    file and uses the fastest implementation
+    """
+    from instapy import _auto
+
+    monkeypatch.setenv("INSTAPY_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(_auto, "_CALIBRATION_SHAPES", [(8, 8), (64, 64)])
+    monkeypatch.setattr(_auto, "_N_EXPERIMENTS", 1)
+    _auto._calibration.cache_clear()
+
+    try:
+        np.random.seed(2020)
+        imarray = np.random.randint(0, 256, size=(50, 70, 3)).astype("uint8")
+        gray_img = grayscale_array(imarray, method="auto")
+        method = _auto._auto_method("grayscale", imarray.shape)
+        assert method in _auto._AUTO_METHODS
+        assert np.array_equal(gray_img, grayscale_array(imarray, method=method))
+        assert len(list(tmp_path.iterdir())) == 1
+
+        # A new process reads the calibration from the cache file
+        _auto._calibration.cache_clear()
+        monkeypatch.setattr(_auto, "_calibrate", lambda: pytest.fail(
+            "implementations calibrated again"))
+        sepia_img = sepia_array(imarray, sepia_amount=0.5, method="auto")
+        method = _auto._auto_method("sepia", imarray.shape)
+        assert np.array_equal(sepia_img, sepia_array(
+            imarray, sepia_amount=0.5, method=method))
+    finally:
+        _auto._calibration.cache_clear()
+
+
+def test_benchmark(tmp_path):
+    """
+    Verify that the benchmark harness sweeps all combinations and writes
+    JSON and CSV reports
+    """
+    import csv
+
+    from instapy.benchmark import read_json, run_benchmarks, write_csv, write_json
+
+    results = run_benchmarks(methods=["numpy", "lut"], shapes=[(16, 24)],
+                             scales=[None, 0.5], sepia_amounts=[1, 0.5],
+                             n_repeats=3)
+    # 2 methods x 2 scales x (grayscale + sepia with 2 amounts)
+    assert len(results) == 12
+    assert {record["layout"] for record in results} == {None}
+    for record in results:
+        assert len(record["run_times"]) == 3
+        assert record["min"] <= record["median"] <= record["max"]
+
+    write_json(results, str(tmp_path / "bench.json"))
+    loaded, host_info = read_json(str(tmp_path / "bench.json"))
+    assert loaded == results
+    assert host_info["cpu_count"] > 0
+
+    write_csv(results, str(tmp_path / "bench.csv"))
+    with open(tmp_path / "bench.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 12
+    assert "run_times" not in rows[0]
+
+    layouts = run_benchmarks(methods=["numba"], filters=["sepia"],
+                             shapes=[(16, 24)],
+                             layouts=[None, "planar", "interleaved"],
+                             n_repeats=1)
+    assert [r["layout"] for r in layouts] == [None, "planar", "interleaved"]
+
+    with pytest.raises(ValueError):
+        run_benchmarks(filters=["blur"])
+    with pytest.raises(ValueError):
+        run_benchmarks(layouts=["tiled"])
+
+
+def test_benchmark_regression():
+    """
+    Verify that a significant slowdown beyond the threshold is flagged as a
+    regression, while noise within the threshold is not
+    """
+    from instapy.benchmark import baseline_grid, compare
+
+    np.random.seed(2020)
+
+    def record(method, run_times):
+        return {"filter": "sepia", "method": method, "height": 64,
+                "width": 64, "scale": None, "sepia_amount": 1.0,
+                "median": float(np.median(run_times)),
+                "run_times": list(run_times)}
+
+    base_times = 1 + 0.01 * np.random.rand(15)
+    baseline = [record("numba", base_times), record("cython", base_times),
+                record("lut", base_times)]
+    results = [record("numba", base_times * 1.5),
+               record("cython", base_times * 1.05),
+               record("numpy", base_times * 2)]
+
+    comparisons = compare(results, baseline, threshold=0.1)
+    assert [c["method"] for c in comparisons] == ["numba", "cython"]
+    assert [c["regressed"] for c in comparisons] == [True, False]
+    assert comparisons[0]["ratio"] == pytest.approx(1.5)
+
+    grid = baseline_grid(baseline)
+    assert grid["methods"] == ["numba", "cython", "lut"]
+    assert grid["shapes"] == [(64, 64)]
+    # Baselines recorded before the layout was stored used the defaults
+    assert grid["layouts"] == [None]
+    with pytest.raises(ValueError):
+        compare(results, baseline, alpha=2)